@@ -0,0 +1,92 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from cloudvirt.image import image_info, optimize_image, qemu_img
+
+# run from the repository root: python -m benchmarks.bench_image_read IMAGE
+#
+# reads the image through a fresh qcow2 overlay the way a guest does, once in
+# the layout it came in and once after `cloudvirt image import' rewrote it.
+# needs qemu-img, and a filesystem with O_DIRECT support for `-t none'.
+
+
+def make_overlay(base_path, base_format, overlay_path):
+    qemu_img(
+        "create",
+        "-f",
+        "qcow2",
+        "-b",
+        base_path,
+        "-F",
+        base_format,
+        overlay_path,
+    )
+
+
+def bench_read(path, buffer_size, count, cache):
+    # MiB/s of sequential reads of buffer_size bytes, qemu-img bench reads
+    # unless told to write
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            "qemu-img",
+            "bench",
+            "-f",
+            "qcow2",
+            "-t",
+            cache,
+            "-c",
+            str(count),
+            "-s",
+            str(buffer_size),
+            "-q",
+            path,
+        ],
+        check=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    return buffer_size * count / elapsed / 1024**2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="base image read benchmark")
+    parser.add_argument("image", help="the image as downloaded")
+    parser.add_argument("-s", dest="buffer_size", type=int, default=1024 * 1024)
+    parser.add_argument("-t", dest="cache", default="none")
+    parser.add_argument("-r", dest="repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    src_format, virtual_size = image_info(args.image)
+    count = virtual_size // args.buffer_size
+
+    with tempfile.TemporaryDirectory(
+        prefix="cloudvirt-bench-", dir=os.path.dirname(os.path.abspath(args.image))
+    ) as tmp_dir:
+        optimized_path = os.path.join(tmp_dir, "optimized.qcow2")
+        optimize_image(args.image, src_format, optimized_path)
+
+        layouts = {
+            "original": (os.path.abspath(args.image), src_format),
+            "optimized": (optimized_path, "qcow2"),
+        }
+
+        results = {}
+        for name, (base_path, base_format) in layouts.items():
+            overlay_path = os.path.join(tmp_dir, f"{name}-overlay.qcow2")
+            make_overlay(base_path, base_format, overlay_path)
+
+            results[name] = max(
+                bench_read(overlay_path, args.buffer_size, count, args.cache)
+                for _ in range(args.repeat)
+            )
+            print(f"{name:>9}: {results[name]:10.1f} MiB/s")
+
+    print(f"  speedup: {results['optimized'] / results['original']:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import io
+import timeit
+
+import pycdlib
+
+from cloudvirt.cloudinit import CloudInit
+from cloudvirt.seediso import write_seed_iso
+from cloudvirt.spec import UserSpec, VMSpec
+
+# run from the repository root: python -m benchmarks.bench_seediso
+
+
+def get_cloudinit():
+    vmspec = VMSpec()
+    vmspec.dom_name = "bench_dom"
+    vmspec.ip = "192.168.254.129"
+    vmspec.gateway = "192.168.254.1"
+    vmspec.bridge_pfxlen = "24"
+    vmspec.mac_addr = "52:54:00:00:00:01"
+
+    user = UserSpec()
+    user.name = "bench"
+    user.ssh_keys = ["ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAI0000000000000000000000"]
+    vmspec.users.append(user)
+
+    return CloudInit(vmspec)
+
+
+def check(image, files):
+    iso = pycdlib.PyCdlib()
+    iso.open_fp(io.BytesIO(image))
+
+    for _, name, data in files:
+        out = io.BytesIO()
+        iso.get_file_from_iso_fp(out, joliet_path=f"/{name}")
+        assert out.getvalue() == data, name
+
+    iso.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="seed iso writer benchmark")
+    parser.add_argument("-n", dest="number", type=int, default=500)
+    args = parser.parse_args()
+
+    cloudinit = get_cloudinit()
+    files = cloudinit._gen_files()  # pylint: disable=protected-access
+
+    # only the image construction, user-data generation is the same for both
+    writers = {
+        "fast": lambda: write_seed_iso(files),
+        "pycdlib": lambda: cloudinit._mkiso_pycdlib(  # pylint: disable=protected-access
+            files
+        ),
+    }
+
+    results = {}
+    for name, writer in writers.items():
+        check(writer(), files)
+
+        results[name] = timeit.timeit(writer, number=args.number) / args.number
+        print(f"{name:>8}: {results[name] * 1e6:10.1f} us/iso")
+
+    print(f" speedup: {results['pycdlib'] / results['fast']:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
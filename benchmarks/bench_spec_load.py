@@ -0,0 +1,81 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import yaml
+
+from cloudvirt import config
+from cloudvirt.config import ConfigYAML
+
+# run from the repository root: python -m benchmarks.bench_spec_load
+#
+# loads and validates a generated fleet file once with the pure python safe
+# loader and once with the libyaml one, if the yaml module was built with it.
+
+
+def write_fleet(path, count):
+    with open(path, "w", encoding="utf-8") as fleet_file:
+        yaml.dump_all(
+            (
+                {
+                    "vmspec": {
+                        "dom_name": f"bench{i}",
+                        "dom_mem": 2048,
+                        "dom_vcpu": 2,
+                        "net": "default",
+                        "vol_pool": "default",
+                        "vol_size": 20,
+                        "ip": "auto",
+                        "labels": {"role": "bench", "index": i},
+                        "disk_profile": {"iothreads": 2},
+                    }
+                }
+                for i in range(count)
+            ),
+            fleet_file,
+        )
+
+
+def bench_load(fleet_path, userspec_path, loader, repeat):
+    config.YAMLLoader = loader
+
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ConfigYAML(fleet_path, userspec_path, None).run()
+        elapsed.append(time.perf_counter() - start)
+
+    return min(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fleet spec load benchmark")
+    parser.add_argument("-n", dest="count", type=int, default=5000)
+    parser.add_argument("-r", dest="repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    loaders = {"python": yaml.SafeLoader}
+    if hasattr(yaml, "CSafeLoader"):
+        loaders["libyaml"] = yaml.CSafeLoader
+
+    with tempfile.TemporaryDirectory(prefix="cloudvirt-bench-") as tmp_dir:
+        fleet_path = os.path.join(tmp_dir, "fleet.yml")
+        write_fleet(fleet_path, args.count)
+
+        userspec_path = os.path.join(tmp_dir, "userspec.yml")
+        with open(userspec_path, "w", encoding="utf-8") as userspec_file:
+            yaml.dump(
+                {"userspec": [{"name": "bench", "ssh_keys": ["k"]}]}, userspec_file
+            )
+
+        for name, loader in loaders.items():
+            secs = bench_load(fleet_path, userspec_path, loader, args.repeat)
+            print(f"{name:>8}: {secs:8.3f}s, {args.count / secs:10.0f} vmspecs/s")
+
+
+if __name__ == "__main__":
+    main()
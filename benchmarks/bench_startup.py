@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+
+# run from the repository root: python -m benchmarks.bench_startup
+#
+# runs the cloudvirt entry point under `python -X importtime' once per case in
+# startup_budget.json and fails if a case goes over its import time budget or
+# pulls in a module it has no use for. the budgets leave room for slower
+# machines, a heavy dependency imported eagerly again still blows them.
+
+ENTRY_POINT = "from cloudvirt.cli import run; run()"
+BUDGET_FILE = os.path.join(os.path.dirname(__file__), "startup_budget.json")
+
+
+def serve_fake_daemon(socket_path):
+    # answers every request like an idle cloudvirtd connected to the default
+    # uri would, so that the thin client path can be measured without libvirt
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen()
+
+    def loop():
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile("rwb") as conn_file:
+                if conn_file.readline():
+                    conn_file.write(
+                        b'{"ok": true, "url": "qemu:///system", "domains": []}\n'
+                    )
+
+    threading.Thread(target=loop, daemon=True).start()
+
+
+def parse_importtime(stderr):
+    # returns the cumulative import time of the top level imports in ms and
+    # the names of every module imported
+    total, modules = 0, set()
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules.add(name.strip())
+
+        if not name[1:].startswith(" "):
+            total += int(cumulative)
+
+    return total / 1000, modules
+
+
+def measure(argv, repeat):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    best, modules = None, set()
+
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", ENTRY_POINT] + argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            env=env,
+            check=False,
+            text=True,
+        )
+
+        total, modules = parse_importtime(proc.stderr)
+        best = total if best is None else min(best, total)
+
+    return best, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cli startup time benchmark")
+    parser.add_argument("-n", dest="repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(BUDGET_FILE, "r", encoding="utf-8") as budget_file:
+        budget = json.load(budget_file)
+
+    failed = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        socket_path = os.path.join(tmpdir, "cloudvirtd.sock")
+        serve_fake_daemon(socket_path)
+
+        for name, case in budget.items():
+            argv = [x.replace("{socket}", socket_path) for x in case["argv"]]
+            total, modules = measure(argv, args.repeat)
+
+            imported = sorted(
+                x
+                for x in case["forbidden"]
+                if any(y == x or y.startswith(f"{x}.") for y in modules)
+            )
+
+            status = "ok"
+            if total > case["max_import_ms"]:
+                status = "OVER BUDGET"
+                failed.append(name)
+
+            if imported:
+                status = "FORBIDDEN IMPORT"
+                failed.append(name)
+
+            print(
+                f"{name:>16}: {total:8.1f} ms / {case['max_import_ms']:6.1f} ms  {status}"
+            )
+
+            if imported:
+                print(f"{'':>16}  imported: {', '.join(imported)}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import libvirt
+
+from .driver import APIDriver, start_event_loop
+from .util import DEFAULT_JOBS
+
+# the workers mostly wait on libvirtd, so far more of them than there are
+# cores is fine
+DEFAULT_AIO_WORKERS = 64
+
+# put on the queue by close() so that a pending __anext__() ends
+_CLOSED = object()
+
+
+class EventStream:
+    # async iterator over the events of a libvirt callback. the callback may
+    # be run by libvirtaio on the loop itself or by the default implementation
+    # on its own thread, either way the event is handed to the loop
+    def __init__(self, loop, register, deregister, event_id, convert):
+        self._loop = loop
+        self._deregister = deregister
+        self._convert = convert
+
+        self._queue = asyncio.Queue()
+        self._callback_id = register(None, event_id, self._callback, None)
+
+    def _callback(self, conn, *args):  # pylint: disable=unused-argument
+        event = self._convert(*args[:-1])
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._callback_id is None:
+            raise StopAsyncIteration
+
+        event = await self._queue.get()
+        if event is _CLOSED:
+            raise StopAsyncIteration
+
+        return event
+
+    def close(self):
+        if self._callback_id is not None:
+            self._deregister(self._callback_id)
+            self._callback_id = None
+
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, _CLOSED)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+
+class AsyncAPIDriver:
+    # asyncio front of APIDriver. the blocking libvirt calls run on a thread
+    # pool while the coroutines of the caller wait on them, libvirt events are
+    # dispatched by the asyncio event loop through libvirtaio.
+    def __init__(self, url="qemu:///system", workers=DEFAULT_AIO_WORKERS):
+        self.driver = APIDriver(url)
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="cloudvirt-aio"
+        )
+
+    async def _call(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
+        )
+
+    # - - connection - - #
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+
+        # imported here as it is only needed by asyncio users
+        import libvirtaio  # pylint: disable=import-outside-toplevel
+
+        # a no-op if another driver in this process already started the
+        # default implementation, events then arrive from its thread
+        start_event_loop(lambda: libvirtaio.virEventRegisterAsyncIOImpl(loop=loop))
+
+        await self._call(self.driver.connect)
+
+    async def close(self):
+        await self._call(self.driver.close)
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # - - actions - - #
+    async def create(self, vmspec, wait=None):
+        return await self._call(self.driver.create, vmspec, wait)
+
+    async def nuke(self, dom_name):
+        await self._call(self.driver.nuke, dom_name)
+
+    async def create_many(
+        self, vmspecs, jobs=DEFAULT_JOBS, net_update="live", wait=None, timings=None
+    ):
+        return await self._call(
+            self.driver.create_many,
+            vmspecs,
+            jobs,
+            net_update,
+            wait=wait,
+            timings=timings,
+        )
+
+    async def nuke_many(self, dom_names, jobs=DEFAULT_JOBS, net_update="live"):
+        return await self._call(self.driver.nuke_many, dom_names, jobs, net_update)
+
+    async def list_domains(self):
+        return await self._call(self.driver.list_domains)
+
+    async def select_domains(self, patterns, regex=False, labels=None):
+        return await self._call(self.driver.select_domains, patterns, regex, labels)
+
+    # - - events - - #
+    def domain_events(self):
+        return EventStream(
+            asyncio.get_running_loop(),
+            self.driver.domainEventRegisterAny,
+            self.driver.domainEventDeregisterAny,
+            libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+            lambda dom, event, detail: {
+                "dom_name": dom.name(),
+                "event": event,
+                "detail": detail,
+            },
+        )
+
+    def network_events(self):
+        return EventStream(
+            asyncio.get_running_loop(),
+            self.driver.networkEventRegisterAny,
+            self.driver.networkEventDeregisterAny,
+            libvirt.VIR_NETWORK_EVENT_ID_LIFECYCLE,
+            lambda net, event, detail: {
+                "net_name": net.name(),
+                "event": event,
+                "detail": detail,
+            },
+        )
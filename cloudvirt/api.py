@@ -0,0 +1,127 @@
+from .config import Config
+from .driver import APIDriver, seed_iso_name
+from .journal import CreateJournal
+from .scheduler import Scheduler
+from .util import CACHE_MAX_AGE, DEFAULT_JOBS
+
+
+def vmspecs_from_dicts(vmspec_docs, userspec_docs=None, userdata=None):
+    # validated the same way the yaml files are, off of what they would hold:
+    # the vmspec sections, the list under the userspec section and the
+    # user-data. raises SpecError
+    config = Config(list(vmspec_docs), userspec_docs, userdata)
+    config.run()
+
+    return config.vmspecs
+
+
+def vmspec_from_dict(vmspec_doc, userspec_docs=None, userdata=None):
+    return vmspecs_from_dicts([vmspec_doc], userspec_docs, userdata)[0]
+
+
+class CreateResult:
+    def __init__(self, vmspec, error=None, timings=None):
+        self.dom_name = vmspec.dom_name
+        self.error = error
+
+        # as the creator filled them in, the ip stays None if the network
+        # hands it out
+        self.mac_addr = vmspec.mac_addr
+        self.ip = vmspec.ip
+
+        # (pool, volume) of the disk and the cloud-init seed
+        self.volumes = []
+        if error is None:
+            self.volumes = [
+                (vmspec.vol_pool, vmspec.vol_name),
+                (vmspec.vol_pool, seed_iso_name(vmspec.dom_name)),
+            ]
+
+        # seconds from define to each boot phase, only filled in with wait
+        self.timings = timings or {}
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class NukeResult:
+    def __init__(self, dom_name, error=None, volumes=None):
+        self.dom_name = dom_name
+        self.error = error
+
+        # (pool, volume) of the volumes deleted
+        self.volumes = volumes or []
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class Client:
+    # cloudvirt for programs generating their specs in memory. the connection
+    # and the cached network, pool and host snapshots are kept across calls
+    # the same way cloudvirtd keeps them, and failed creates are journaled.
+    # vmspecs handed to create_many are filled in with the mac and the ip
+    def __init__(self, url="qemu:///system", journal=True):
+        self.driver = APIDriver(url)
+        self.driver.cache.max_age = CACHE_MAX_AGE
+
+        if journal:
+            self.driver.journal = CreateJournal(url)
+
+    # - - connection - - #
+    def connect(self):
+        self.driver.connect()
+
+    def close(self):
+        self.driver.close()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # - - actions - - #
+    def create_many(
+        self,
+        vmspecs,
+        jobs=DEFAULT_JOBS,
+        net_update="live",
+        *,
+        wait=None,
+        overcommit=None,
+        rollback=False,
+    ):
+        vmspecs = list(vmspecs)
+        timings = {}
+
+        results = Scheduler([self.driver], overcommit).create_many(
+            vmspecs,
+            jobs,
+            net_update,
+            wait=wait,
+            timings=timings,
+            rollback=rollback,
+        )
+
+        return {
+            vmspec.dom_name: CreateResult(
+                vmspec, results[vmspec.dom_name], timings.get(vmspec.dom_name)
+            )
+            for vmspec in vmspecs
+        }
+
+    def nuke_many(self, dom_names, jobs=DEFAULT_JOBS, net_update="live"):
+        volumes = {}
+        results = self.driver.nuke_many(dom_names, jobs, net_update, volumes)
+
+        return {
+            dom_name: NukeResult(dom_name, err, volumes.get(dom_name))
+            for dom_name, err in results.items()
+        }
+
+    def select_domains(self, patterns, regex=False, labels=None):
+        return self.driver.select_domains(patterns, regex, labels)
@@ -0,0 +1,328 @@
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from .errors import SpecError
+from .ipalloc import IPAllocator
+
+
+class NetworkSnapshot:
+    def __init__(self, network, xml_root):
+        self.network = network
+        self.xml_root = xml_root
+        self.fetched = time.monotonic()
+
+        self._ip_allocator = None
+        self._lock = threading.Lock()
+
+    @property
+    def forward_mode(self):
+        network_type = self.xml_root.find("forward")
+        if network_type is None:
+            return None
+
+        return network_type.attrib.get("mode")
+
+    @property
+    def ip_allocator(self):
+        # leases and reservations are only fetched the first time an address
+        # is validated or picked on this network
+        with self._lock:
+            if self._ip_allocator is not None:
+                return self._ip_allocator
+
+            net_dhcp = self.xml_root.find("ip/dhcp/range")
+            if net_dhcp is None:
+                raise SpecError(
+                    f"{self.xml_root.findtext('name')} does not have a DHCP range"
+                )
+
+            allocator = IPAllocator(net_dhcp.attrib["start"], net_dhcp.attrib["end"])
+
+            for lease in self.network.DHCPLeases():
+                allocator.add_lease(lease["ipaddr"])
+
+            for res in self.xml_root.findall("ip/dhcp/host"):
+                if "ip" in res.attrib:
+                    allocator.add_reservation(res.attrib["ip"])
+
+            # never hand out the address of the network itself
+            for net_ip in self.xml_root.findall("ip"):
+                if "address" in net_ip.attrib:
+                    allocator.add_reservation(net_ip.attrib["address"])
+
+            self._ip_allocator = allocator
+
+        return allocator
+
+    # our own network.update() calls are mirrored here instead of refetching
+    # and reparsing the network xml
+    def add_dhcp_host(self, attrib):
+        with self._lock:
+            ET.SubElement(self.xml_root.find("ip/dhcp"), "host", attrib)
+
+    def add_dns_host(self, ip, hostname):
+        with self._lock:
+            dns = self.xml_root.find("dns")
+            if dns is None:
+                dns = ET.SubElement(self.xml_root, "dns")
+
+            host = ET.SubElement(dns, "host", {"ip": ip})
+            ET.SubElement(host, "hostname").text = hostname
+
+    def remove_dhcp_host(self, name):
+        with self._lock:
+            for dhcp in self.xml_root.findall("ip/dhcp"):
+                for res in dhcp.findall("host"):
+                    if res.attrib.get("name") != name:
+                        continue
+
+                    dhcp.remove(res)
+
+                    if self._ip_allocator is not None and "ip" in res.attrib:
+                        self._ip_allocator.release(res.attrib["ip"])
+
+    def remove_dns_host(self, hostname):
+        with self._lock:
+            for dns in self.xml_root.findall("dns"):
+                for host in dns.findall("host"):
+                    if hostname in [x.text for x in host.findall("hostname")]:
+                        dns.remove(host)
+
+
+class PoolSnapshot:
+    def __init__(self, pool, xml_root):
+        self.pool = pool
+        self.xml_root = xml_root
+        self.fetched = time.monotonic()
+
+        # bytes the volumes placed by us may still grow into
+        self.reserved = 0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self.xml_root.findall("target/path")[0].text
+
+    @property
+    def available(self):
+        return int(self.xml_root.find("available").text)
+
+    def reserve(self, size):
+        with self._lock:
+            self.reserved += size
+
+
+class HostSnapshot:
+    # capacity of the host and what the running domains have committed of it,
+    # the latter out of a single bulk stats call. memory is in KiB
+    def __init__(self, info, free_memory, domain_stats):
+        self.fetched = time.monotonic()
+
+        self.cpus = info[2]
+        self.memory = info[1] * 1024
+        self.free_memory = free_memory // 1024
+
+        self.committed_vcpus = 0
+        self.committed_memory = 0
+        for _, stats in domain_stats:
+            self.committed_vcpus += stats.get("vcpu.current", 0)
+            self.committed_memory += stats.get("balloon.maximum", 0)
+
+        self._lock = threading.Lock()
+
+    # domains placed by us are mirrored here instead of refetching the stats,
+    # a negative amount undoes it
+    def reserve(self, vcpus, memory):
+        with self._lock:
+            self.committed_vcpus += vcpus
+            self.committed_memory += memory
+            self.free_memory -= memory
+
+
+class BaseImageSnapshot:
+    def __init__(self, path, mtime, xml_root):
+        self.path = path
+        self.mtime = mtime
+        self.fetched = time.monotonic()
+
+        # what libvirt probed from the image header, not the file extension
+        self.format = xml_root.find("target/format").attrib["type"]
+        self.capacity = int(xml_root.find("capacity").text)
+
+
+class APIDriverCache:
+    # parsed network and pool descriptions shared by every creator and nuker
+    # on a connection, so that N vms on a network cost a single XMLDesc() and
+    # parse. entries are dropped on libvirt lifecycle events, changes other
+    # processes make to the dhcp/dns hosts of a network are not evented, those
+    # surface as a failing network.update() which also drops the entry.
+    # long running processes set max_age so that leases handed out by dnsmasq
+    # in the meantime are picked up as well. the capacity of the host is kept
+    # the same way for the scheduler.
+    def __init__(self, driver, max_age=None):
+        self.driver = driver
+        self.max_age = max_age
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        # the pool paths are only ours to stat on a local connection
+        self._local = urllib.parse.urlsplit(driver.url).hostname is None
+
+        self._networks = {}
+        self._pools = {}
+        self._base_images = {}
+        self._host = None
+        self._lock = threading.Lock()
+
+        self._callback_ids = []
+
+    @staticmethod
+    def _parse(xml):
+        return ET.ElementTree(ET.fromstring(xml)).getroot()
+
+    def _expired(self, snapshot):
+        if snapshot is None or self.max_age is None:
+            return snapshot is None
+
+        return time.monotonic() - snapshot.fetched > self.max_age
+
+    def network(self, name):
+        with self._lock:
+            if self._expired(self._networks.get(name)):
+                network = self.driver.networkLookupByName(name)
+                self._networks[name] = NetworkSnapshot(
+                    network, self._parse(network.XMLDesc())
+                )
+
+            return self._networks[name]
+
+    def pool(self, name):
+        with self._lock:
+            if self._expired(self._pools.get(name)):
+                pool = self.driver.storagePoolLookupByName(name)
+                self._pools[name] = PoolSnapshot(pool, self._parse(pool.XMLDesc()))
+
+            return self._pools[name]
+
+    def host(self):
+        with self._lock:
+            if self._expired(self._host):
+                self._host = HostSnapshot(
+                    self.driver.getInfo(),
+                    self.driver.getFreeMemory(),
+                    self.driver.getAllDomainStats(
+                        libvirt.VIR_DOMAIN_STATS_VCPU
+                        | libvirt.VIR_DOMAIN_STATS_BALLOON,
+                        libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE,
+                    ),
+                )
+
+            return self._host
+
+    def base_image(self, pool_snapshot, name):
+        # probed once per path and mtime so that a replaced image is probed
+        # again without a libvirt call per create. an image that cannot be
+        # stat'ed here, as it lives on a remote host, is kept like its pool
+        # until a lifecycle or refresh event of the pool or max_age
+        path = f"{pool_snapshot.path}/{name}"
+
+        mtime = None
+        if self._local:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+
+        with self._lock:
+            snapshot = self._base_images.get(path)
+
+            if self._expired(snapshot) or snapshot.mtime != mtime:
+                vol = pool_snapshot.pool.storageVolLookupByName(name)
+                snapshot = BaseImageSnapshot(path, mtime, self._parse(vol.XMLDesc()))
+                self._base_images[path] = snapshot
+
+            return snapshot
+
+    def invalidate_network(self, name):
+        with self._lock:
+            if self._networks.pop(name, None):
+                self.logger.debug("dropped cached network %s", name)
+
+    def invalidate_pool(self, name):
+        with self._lock:
+            snapshot = self._pools.pop(name, None)
+            if snapshot:
+                # along with the base images probed in it
+                prefix = f"{snapshot.path}/"
+                for path in [x for x in self._base_images if x.startswith(prefix)]:
+                    del self._base_images[path]
+
+                self.logger.debug("dropped cached pool %s", name)
+
+    def clear(self):
+        with self._lock:
+            self._networks.clear()
+            self._pools.clear()
+            self._base_images.clear()
+            self._host = None
+
+    def _network_event_cb(self, conn, net, event, detail, opaque):
+        # pylint: disable=unused-argument
+        self.invalidate_network(net.name())
+
+    def _pool_event_cb(self, conn, pool, event, detail, opaque):
+        # pylint: disable=unused-argument
+        self.invalidate_pool(pool.name())
+
+    def _pool_refresh_cb(self, conn, pool, opaque):
+        # pylint: disable=unused-argument
+        self.invalidate_pool(pool.name())
+
+    def register_events(self):
+        self._callback_ids.append(
+            (
+                self.driver.networkEventDeregisterAny,
+                self.driver.networkEventRegisterAny(
+                    None,
+                    libvirt.VIR_NETWORK_EVENT_ID_LIFECYCLE,
+                    self._network_event_cb,
+                    None,
+                ),
+            )
+        )
+
+        self._callback_ids.append(
+            (
+                self.driver.storagePoolEventDeregisterAny,
+                self.driver.storagePoolEventRegisterAny(
+                    None,
+                    libvirt.VIR_STORAGE_POOL_EVENT_ID_LIFECYCLE,
+                    self._pool_event_cb,
+                    None,
+                ),
+            )
+        )
+
+        # a replaced image on a remote host is picked up by a pool-refresh
+        self._callback_ids.append(
+            (
+                self.driver.storagePoolEventDeregisterAny,
+                self.driver.storagePoolEventRegisterAny(
+                    None,
+                    libvirt.VIR_STORAGE_POOL_EVENT_ID_REFRESH,
+                    self._pool_refresh_cb,
+                    None,
+                ),
+            )
+        )
+
+    def deregister_events(self):
+        while self._callback_ids:
+            deregister, callback_id = self._callback_ids.pop()
+            deregister(callback_id)
@@ -1,15 +1,21 @@
 import argparse
+import glob
 import logging
+import os
+import sys
 
-from .config import ConfigYAML
-from .driver import APIDriver
+from .daemon import DaemonClient
+from .errors import CloudvirtError, SpecError
 from .log import set_root_logger
-from .mkuser import MkUser
-from .util import ask_q
+from .util import ask_q, DEFAULT_JOBS, DEFAULT_WAIT_TIMEOUT, NET_UPDATE_MODES
+from .util import DEFAULT_OVERCOMMIT, RECLAIM_HEADROOM, RECLAIM_MIN_MEM
 
 from . import __version__ as pkg_version
 
 
+# subcommands import what they need themselves so that --help, mkuser and
+# talking to cloudvirtd do not pay for libvirt, pycdlib, passlib and yaml.
+# benchmarks/bench_startup.py holds them to benchmarks/startup_budget.json
 class CLI:
     def __init__(self):
         self.logger = None
@@ -18,8 +24,112 @@ class CLI:
         self.subparsers = None
 
         self.driver = None
+        self.client = None
 
     # - - parsing - - #
+    def _list_args(self):
+        list_subparser_desc = "list domains"
+
+        self.subparsers.add_parser(
+            "list", help=list_subparser_desc, description=list_subparser_desc
+        )
+
+    def _image_args(self):
+        image_subparser_desc = "manage base images"
+        image_import_desc = "decompress a local image, rewrite it to a read "
+        image_import_desc += "optimized qcow2 layout and upload it into a pool"
+        image_import_file_help = "image file to be imported"
+        image_import_pool_help = "volume pool to upload the image into"
+        image_import_name_help = "name of the volume, the file name if unset"
+
+        image_subparser = self.subparsers.add_parser(
+            "image", help=image_subparser_desc, description=image_subparser_desc
+        )
+        image_subparsers = image_subparser.add_subparsers(
+            dest="image_command", required=True
+        )
+
+        image_import_subparser = image_subparsers.add_parser(
+            "import", help=image_import_desc, description=image_import_desc
+        )
+        image_import_subparser.add_argument(
+            "image_file", type=str, help=image_import_file_help
+        )
+        image_import_subparser.add_argument(
+            "-p",
+            "--pool",
+            dest="pool",
+            required=True,
+            help=image_import_pool_help,
+        )
+        image_import_subparser.add_argument(
+            "-n",
+            "--name",
+            dest="vol_name",
+            required=False,
+            help=image_import_name_help,
+        )
+
+    def _reclaim_args(self):
+        reclaim_subparser_desc = "shrink the balloons of running vms down to the "
+        reclaim_subparser_desc += "memory they use"
+        reclaim_subparser_name_help = "names or glob patterns of the domains to "
+        reclaim_subparser_name_help += "consider, every running one if unset"
+        reclaim_subparser_regex_help = "treat the names as regular expressions"
+        reclaim_subparser_label_help = "only consider domains carrying this "
+        reclaim_subparser_label_help += "cloudvirt label, can be repeated"
+        reclaim_subparser_headroom_help = "fraction of the used memory to leave "
+        reclaim_subparser_headroom_help += f"on top (default: {RECLAIM_HEADROOM})"
+        reclaim_subparser_minmem_help = "never shrink a vm below this many MiB "
+        reclaim_subparser_minmem_help += f"(default: {RECLAIM_MIN_MEM})"
+        reclaim_subparser_dryrun_help = "only report what would be reclaimed"
+
+        reclaim_subparser = self.subparsers.add_parser(
+            "reclaim", help=reclaim_subparser_desc, description=reclaim_subparser_desc
+        )
+        reclaim_subparser.add_argument(
+            "names", nargs="*", type=str, help=reclaim_subparser_name_help
+        )
+        reclaim_subparser.add_argument(
+            "--regex",
+            action="store_true",
+            required=False,
+            help=reclaim_subparser_regex_help,
+        )
+        reclaim_subparser.add_argument(
+            "-l",
+            "--label",
+            dest="labels",
+            action="append",
+            default=[],
+            metavar="KEY=VALUE",
+            required=False,
+            help=reclaim_subparser_label_help,
+        )
+        reclaim_subparser.add_argument(
+            "--headroom",
+            dest="headroom",
+            type=float,
+            default=RECLAIM_HEADROOM,
+            required=False,
+            help=reclaim_subparser_headroom_help,
+        )
+        reclaim_subparser.add_argument(
+            "--min-mem",
+            dest="min_mem",
+            type=int,
+            default=RECLAIM_MIN_MEM,
+            required=False,
+            help=reclaim_subparser_minmem_help,
+        )
+        reclaim_subparser.add_argument(
+            "--dry-run",
+            dest="dry_run",
+            action="store_true",
+            required=False,
+            help=reclaim_subparser_dryrun_help,
+        )
+
     def _mkuser_args(self):
         mkuser_subparser_desc = "create a UserSpec yaml to be consumed by --userspec"
 
@@ -27,37 +137,185 @@ class CLI:
             "mkuser", help=mkuser_subparser_desc, description=mkuser_subparser_desc
         )
 
+    @staticmethod
+    def _add_net_update_arg(subparser):
+        net_update_help = "how to apply DHCP and DNS host changes: `live' "
+        net_update_help += "updates the running network, `redefine' merges all "
+        net_update_help += "of them into the network definition at once, which "
+        net_update_help += "an active network picks up on its next restart "
+        net_update_help += "(default: live)"
+
+        subparser.add_argument(
+            "--net-update",
+            dest="net_update",
+            choices=NET_UPDATE_MODES,
+            default="live",
+            required=False,
+            help=net_update_help,
+        )
+
     def _nuke_args(self):
-        nuke_subparser_desc = "nuke a vm"
-        nuke_subparser_name_help = "name of the domain to be nuked"
+        nuke_subparser_desc = "nuke one or more vms"
+        nuke_subparser_name_help = "names or glob patterns of the domains to be nuked"
+        nuke_subparser_regex_help = "treat the names as regular expressions"
+        nuke_subparser_label_help = "only select domains carrying this cloudvirt "
+        nuke_subparser_label_help += "label, can be repeated"
         nuke_subparser_noconfirm_help = "skip the confirmation dialogue"
+        nuke_subparser_jobs_help = "amount of vms to nuke concurrently "
+        nuke_subparser_jobs_help += f"(default: {DEFAULT_JOBS})"
 
         nuke_subparser = self.subparsers.add_parser(
             "nuke", help=nuke_subparser_desc, description=nuke_subparser_desc
         )
-        nuke_subparser.add_argument("name", type=str, help=nuke_subparser_name_help)
+        nuke_subparser.add_argument(
+            "names", nargs="*", type=str, help=nuke_subparser_name_help
+        )
+        nuke_subparser.add_argument(
+            "--regex",
+            action="store_true",
+            required=False,
+            help=nuke_subparser_regex_help,
+        )
+        nuke_subparser.add_argument(
+            "-l",
+            "--label",
+            dest="labels",
+            action="append",
+            default=[],
+            metavar="KEY=VALUE",
+            required=False,
+            help=nuke_subparser_label_help,
+        )
         nuke_subparser.add_argument(
             "--noconfirm",
             action="store_true",
             required=False,
             help=nuke_subparser_noconfirm_help,
         )
+        nuke_subparser.add_argument(
+            "-j",
+            "--jobs",
+            dest="jobs",
+            type=int,
+            default=DEFAULT_JOBS,
+            required=False,
+            help=nuke_subparser_jobs_help,
+        )
+        self._add_net_update_arg(nuke_subparser)
+
+    def _rollback_args(self):
+        rollback_subparser_desc = "undo what failed creates left behind instead "
+        rollback_subparser_desc += "of resuming them"
+        rollback_subparser_name_help = "names of the domains to roll back, every "
+        rollback_subparser_name_help += "journaled one if unset"
+        rollback_subparser_jobs_help = "amount of vms to roll back concurrently "
+        rollback_subparser_jobs_help += f"(default: {DEFAULT_JOBS})"
+
+        rollback_subparser = self.subparsers.add_parser(
+            "rollback",
+            help=rollback_subparser_desc,
+            description=rollback_subparser_desc,
+        )
+        rollback_subparser.add_argument(
+            "names", nargs="*", type=str, help=rollback_subparser_name_help
+        )
+        rollback_subparser.add_argument(
+            "-j",
+            "--jobs",
+            dest="jobs",
+            type=int,
+            default=DEFAULT_JOBS,
+            required=False,
+            help=rollback_subparser_jobs_help,
+        )
+        self._add_net_update_arg(rollback_subparser)
 
     def _create_args(self):
-        create_subparser_desc = "create a vm"
-        create_subparser_vmspec_help = "yaml file holding the vm config"
+        create_subparser_desc = "create one or more vms"
+        create_subparser_vmspec_help = "yaml file(s) holding the vm config(s), "
+        create_subparser_vmspec_help += "multiple documents per file are allowed"
         create_subparser_userspec_help = "yaml file holding the user config"
         create_subparser_userdata_help = "cloud-init user-data file"
+        create_subparser_jobs_help = "amount of vms to create concurrently "
+        create_subparser_jobs_help += f"(default: {DEFAULT_JOBS})"
+        create_subparser_wait_help = "wait for the guests to come up and report the "
+        create_subparser_wait_help += "boot timings, optionally for at most TIMEOUT "
+        create_subparser_wait_help += f"seconds (default: {DEFAULT_WAIT_TIMEOUT})"
+        create_subparser_host_help = "libvirt URI of a host to place vms on, can be "
+        create_subparser_host_help += "repeated, the one of --connect if unset"
+        create_subparser_overcommit_help = "how far the committed vcpus (cpu), "
+        create_subparser_overcommit_help += "memory (mem) and volume sizes (disk) "
+        create_subparser_overcommit_help += "may exceed the capacity of a host, can "
+        create_subparser_overcommit_help += "be repeated (default: "
+        create_subparser_overcommit_help += ", ".join(
+            f"{k}={v}" for k, v in DEFAULT_OVERCOMMIT.items()
+        )
+        create_subparser_overcommit_help += ")"
+        create_subparser_rollback_help = "undo what the failed creates left "
+        create_subparser_rollback_help += "behind instead of keeping it for the "
+        create_subparser_rollback_help += "next run to resume"
 
         create_subparser = self.subparsers.add_parser(
             "create", help=create_subparser_desc, description=create_subparser_desc
         )
 
         create_subparser.add_argument(
-            "vmspec_file",
+            "vmspec_files",
+            nargs="+",
             help=create_subparser_vmspec_help,
         )
 
+        create_subparser.add_argument(
+            "-j",
+            "--jobs",
+            dest="jobs",
+            type=int,
+            default=DEFAULT_JOBS,
+            required=False,
+            help=create_subparser_jobs_help,
+        )
+        self._add_net_update_arg(create_subparser)
+
+        create_subparser.add_argument(
+            "--wait",
+            dest="wait",
+            metavar="TIMEOUT",
+            type=int,
+            nargs="?",
+            const=DEFAULT_WAIT_TIMEOUT,
+            default=None,
+            required=False,
+            help=create_subparser_wait_help,
+        )
+
+        create_subparser.add_argument(
+            "--host",
+            dest="hosts",
+            action="append",
+            default=[],
+            metavar="URI",
+            required=False,
+            help=create_subparser_host_help,
+        )
+
+        create_subparser.add_argument(
+            "--overcommit",
+            dest="overcommit",
+            action="append",
+            default=[],
+            metavar="RESOURCE=RATIO",
+            required=False,
+            help=create_subparser_overcommit_help,
+        )
+
+        create_subparser.add_argument(
+            "--rollback",
+            dest="rollback",
+            action="store_true",
+            required=False,
+            help=create_subparser_rollback_help,
+        )
+
         create_subparser.add_argument(
             "--userdata",
             dest="userdata_file",
@@ -76,24 +334,119 @@ class CLI:
         parser_desc = f"cloudvirt VM orchestrator ver. {pkg_version}"
         parser_d_help = "enable debugging"
 
+        parser_socket_help = "unix socket of cloudvirtd, used when a daemon is "
+        parser_socket_help += "listening on it"
+        parser_connect_help = "libvirt URI to connect to (default: qemu:///system)"
+        parser_nodaemon_help = "do not hand the action over to cloudvirtd even if "
+        parser_nodaemon_help += "it is running"
+        parser_trace_help = "record the phases of every vm and every libvirt call "
+        parser_trace_help += "to FILE in the chrome trace event format, implies "
+        parser_trace_help += "--no-daemon"
+        parser_stats_help = "report the call counts and latencies of the libvirt "
+        parser_stats_help += "calls made, implies --no-daemon"
+
         parser = argparse.ArgumentParser(description=parser_desc)
         parser.add_argument("-d", dest="debug", action="store_true", help=parser_d_help)
+        parser.add_argument(
+            "-c",
+            "--connect",
+            dest="url",
+            default="qemu:///system",
+            required=False,
+            help=parser_connect_help,
+        )
+        parser.add_argument(
+            "--socket", dest="socket_path", required=False, help=parser_socket_help
+        )
+        parser.add_argument(
+            "--no-daemon",
+            dest="no_daemon",
+            action="store_true",
+            required=False,
+            help=parser_nodaemon_help,
+        )
+        parser.add_argument(
+            "--trace",
+            dest="trace_file",
+            metavar="FILE",
+            required=False,
+            help=parser_trace_help,
+        )
+        parser.add_argument(
+            "--stats",
+            dest="stats",
+            action="store_true",
+            required=False,
+            help=parser_stats_help,
+        )
 
         self.subparsers = parser.add_subparsers(dest="command", required=True)
 
         self._create_args()
         self._nuke_args()
+        self._rollback_args()
+        self._list_args()
+        self._reclaim_args()
+        self._image_args()
         self._mkuser_args()
         self.args = parser.parse_args()
 
     # - - driver actions - - #
+    def _select_domains(self):
+        labels = {}
+        for label in self.args.labels:
+            if "=" not in label:
+                raise SpecError(f"label {label} is not in the KEY=VALUE format")
+
+            key, value = label.split("=", 1)
+            labels[key] = value
+
+        if self.client:
+            return self._request(
+                command="select",
+                names=self.args.names,
+                regex=self.args.regex,
+                labels=labels,
+            )["dom_names"]
+
+        return self.driver.select_domains(
+            self.args.names, regex=self.args.regex, labels=labels
+        )
+
+    def _select_nuke_targets(self):
+        if not self.args.names and not self.args.labels:
+            raise SpecError("at least a name, a pattern or a label is required")
+
+        if self.args.jobs < 1:
+            raise SpecError("--jobs has to be at least 1")
+
+        dom_names = self._select_domains()
+
+        # plain names that matched nothing are most likely typos, bail out the
+        # same way a single nuke would
+        for name in self.args.names:
+            if not self.args.regex and name == glob.escape(name):
+                if name not in dom_names:
+                    raise SpecError(f"domain {name} does not exist.")
+
+        if not dom_names:
+            raise SpecError("no domains matched the selection")
+
+        return dom_names
+
     def _nuke(self):
+        dom_names = self._select_nuke_targets()
+
         if self.args.noconfirm:
             want_nuke = True
         else:
+            self.logger.info("selected %s domain(s):", len(dom_names))
+            for dom_name in dom_names:
+                self.logger.info("  %s", dom_name)
+
             while True:
                 consent = (
-                    ask_q(f"do you want {self.args.name} nuked? (y/n)")
+                    ask_q(f"do you want these {len(dom_names)} domain(s) nuked? (y/n)")
                     .lower()
                     .strip(" ")
                 )
@@ -108,24 +461,258 @@ class CLI:
                     break
 
         if want_nuke:
-            self.driver.nuke(self.args.name)
+            if self.client:
+                results = self._request(
+                    command="nuke",
+                    dom_names=dom_names,
+                    jobs=self.args.jobs,
+                    net_update=self.args.net_update,
+                )["results"]
+            else:
+                results = self.driver.nuke_many(
+                    dom_names, self.args.jobs, self.args.net_update
+                )
+
+            self._summarize("nuked", results)
         else:
             self.logger.warning("user cancelled action, bailing out.")
 
+    def _parse_overcommit(self):
+        overcommit = {}
+
+        for item in self.args.overcommit:
+            resource, _, ratio = item.partition("=")
+            if resource not in DEFAULT_OVERCOMMIT:
+                raise SpecError(
+                    "overcommit resource should be one of: "
+                    + ", ".join(DEFAULT_OVERCOMMIT)
+                )
+
+            try:
+                overcommit[resource] = float(ratio)
+            except ValueError as exc:
+                raise SpecError(f"{ratio} is not a valid ratio") from exc
+
+            if overcommit[resource] <= 0:
+                raise SpecError("overcommit ratios have to be positive")
+
+        return overcommit
+
     def _create(self):
+        if self.args.jobs < 1:
+            raise SpecError("--jobs has to be at least 1")
+
+        overcommit = self._parse_overcommit()
+
+        if not self.args.userspec_file and not self.args.userdata_file:
+            err_msg = "no users or user-data file was provided, bailing out as "
+            err_msg += "you may be unable to log in to an VMs created"
+            raise SpecError(err_msg)
+
+        if self.client:
+            # the daemon resolves the paths on its side
+            def abspath(path):
+                return os.path.abspath(path) if path else None
+
+            results = self._request(
+                command="create",
+                vmspec_files=[abspath(x) for x in self.args.vmspec_files],
+                userspec_file=abspath(self.args.userspec_file),
+                userdata_file=abspath(self.args.userdata_file),
+                jobs=self.args.jobs,
+                net_update=self.args.net_update,
+                wait=self.args.wait,
+                hosts=self.args.hosts,
+                overcommit=overcommit,
+                rollback=self.args.rollback,
+            )
+            self._report_timings(results["timings"])
+
+            return self._summarize("created", results["results"])
+
+        # pylint: disable=import-outside-toplevel
+        from .config import ConfigYAML
+        from .driver import APIDriver
+        from .journal import CreateJournal
+        from .scheduler import Scheduler
+
         config = ConfigYAML(
-            self.args.vmspec_file,
+            self.args.vmspec_files,
             self.args.userspec_file,
             self.args.userdata_file,
         )
         config.run()
 
-        if not self.args.userspec_file and not self.args.userdata_file:
-            err_msg = "no users or user-data file was provided, bailing out as "
-            err_msg += "you may be unable to log in to an VMs created"
-            self.logger.error(err_msg)
+        # a host given twice is still a single one
+        hosts = list(dict.fromkeys(self.args.hosts))
+
+        drivers = []
+        if not hosts or self.driver.url in hosts:
+            drivers.append(self.driver)
+
+        try:
+            for url in hosts:
+                if url != self.driver.url:
+                    driver = APIDriver(url)
+                    driver.tracer = self.driver.tracer
+                    driver.journal = CreateJournal(url)
+                    driver.connect()
+                    drivers.append(driver)
+
+            timings = {}
+            results = Scheduler(drivers, overcommit).create_many(
+                config.vmspecs,
+                self.args.jobs,
+                self.args.net_update,
+                wait=self.args.wait,
+                timings=timings,
+                rollback=self.args.rollback,
+            )
+        finally:
+            for driver in drivers:
+                if driver is not self.driver:
+                    driver.close()
+
+        self._report_timings(timings)
+        self._summarize("created", results)
+
+    def _rollback(self):
+        if self.args.jobs < 1:
+            raise SpecError("--jobs has to be at least 1")
+
+        dom_names = self.args.names or None
+
+        if self.client:
+            results = self._request(
+                command="rollback",
+                dom_names=dom_names,
+                jobs=self.args.jobs,
+                net_update=self.args.net_update,
+            )["results"]
+        else:
+            results = self.driver.rollback_many(
+                dom_names, self.args.jobs, self.args.net_update
+            )
+
+        if not results:
+            return self.logger.info("no failed creates to roll back")
+
+        self._summarize("rolled back", results)
+
+    def _image(self):
+        from .image import ImageImporter  # pylint: disable=import-outside-toplevel
+
+        importer = ImageImporter(self.driver, self.args.pool)
+        importer.run(self.args.image_file, self.args.vol_name)
+
+    def _reclaim(self):
+        if self.args.headroom < 0:
+            raise SpecError("--headroom cannot be negative")
+
+        dom_names = None
+        if self.args.names or self.args.labels:
+            dom_names = self._select_domains()
+
+        if self.client:
+            response = self._request(
+                command="reclaim",
+                dom_names=dom_names,
+                headroom=self.args.headroom,
+                min_mem=self.args.min_mem,
+                dry_run=self.args.dry_run,
+            )
+            targets, results = response["targets"], response["results"]
+        else:
+            from .density import Reclaimer  # pylint: disable=import-outside-toplevel
+
+            reclaimer = Reclaimer(self.driver, self.args.headroom, self.args.min_mem)
+            targets = reclaimer.plan(dom_names)
+            results = None if self.args.dry_run else reclaimer.apply(targets)
+
+        if not targets:
+            return self.logger.info("nothing to reclaim")
+
+        for dom_name, (current, target) in targets.items():
+            self.logger.info(
+                "  %s: %s -> %s MiB", dom_name, current >> 10, target >> 10
+            )
+
+        self.logger.info(
+            "%s MiB reclaimable",
+            sum(current - target for current, target in targets.values()) >> 10,
+        )
 
-        self.driver.create(config.vmspec)
+        if results is not None:
+            self._summarize("reclaimed", results)
+
+    def _list(self):
+        if self.client:
+            domains = self._request(command="list")["domains"]
+        else:
+            domains = self.driver.list_domains()
+
+        for dom in domains:
+            state = "running" if dom["active"] else "shut off"
+            self.logger.info("%-32s %s", dom["name"], state)
+
+    def _request(self, **request):
+        response = self.client.request(dict(request, url=self.args.url))
+
+        if not response["ok"]:
+            raise CloudvirtError(f"cloudvirtd: {response['error']}")
+
+        return response
+
+    def _report_timings(self, timings):
+        if not timings:
+            return
+
+        self.logger.info("boot timings, seconds since the domain got defined:")
+        for dom_name, phases in timings.items():
+            self.logger.info(
+                "  %s: %s",
+                dom_name,
+                ", ".join(f"{phase} {secs:.2f}" for phase, secs in phases.items()),
+            )
+
+    def _report_stats(self, tracer):
+        stats = tracer.stats()
+        if not stats:
+            return
+
+        self.logger.info(
+            "%-28s %6s %9s %9s %9s %9s",
+            "libvirt call",
+            "calls",
+            "p50",
+            "p95",
+            "p99",
+            "max",
+        )
+        for name, (calls, p50, p95, p99, p100) in stats.items():
+            self.logger.info(
+                "%-28s %6s %7.2fms %7.2fms %7.2fms %7.2fms",
+                name,
+                calls,
+                p50,
+                p95,
+                p99,
+                p100,
+            )
+
+    def _summarize(self, action, results):
+        failed = 0
+
+        self.logger.info("summary:")
+        for dom_name, err in results.items():
+            if err is None:
+                self.logger.info("  %s: %s", dom_name, action)
+            else:
+                self.logger.warning("  %s: failed: %s", dom_name, err)
+                failed += 1
+
+        if failed:
+            raise CloudvirtError(f"{failed} out of {len(results)} vms failed")
 
     # - - main - - #
     def run(self):
@@ -136,22 +723,78 @@ class CLI:
 
         self.logger.info("started cloudvirt ver. %s", pkg_version)
 
+        # the one place a failure turns into an exit
+        try:
+            self._run()
+        except CloudvirtError as exc:
+            self.logger.error("%s", exc)
+            sys.exit(1)
+
+    def _run(self):
         # - - mkuser - - #
         if self.args.command == "mkuser":
+            from .mkuser import MkUser  # pylint: disable=import-outside-toplevel
+
             mku = MkUser()
             return mku.run()
 
-        # - - driver action - - #
-        self.driver = APIDriver()
-        self.driver.connect()
+        # - - daemon - - #
+        # images are read from the local disk, they are not handed over. the
+        # calls to trace are the ones made by this process
+        tracing = self.args.trace_file or self.args.stats
+        if not self.args.no_daemon and not tracing and self.args.command != "image":
+            client = DaemonClient(self.args.socket_path)
 
-        if self.args.command == "create":
-            self._create()
-        elif self.args.command == "nuke":
-            self._nuke()
+            # only one connected to the very same libvirt takes the action
+            if client.serves(self.args.url):
+                self.logger.info("handing over to cloudvirtd at %s", client.socket_path)
+                self.client = client
 
-        self.logger.info("closing connection to the libVirt API")
-        self.driver.close()
+        # - - driver action - - #
+        if not self.client:
+            from .driver import APIDriver  # pylint: disable=import-outside-toplevel
+
+            self.driver = APIDriver(self.args.url)
+
+            if tracing:
+                from .trace import Tracer  # pylint: disable=import-outside-toplevel
+
+                self.driver.tracer = Tracer()
+
+            if self.args.command in ["create", "rollback"]:
+                # pylint: disable=import-outside-toplevel
+                from .journal import CreateJournal
+
+                self.driver.journal = CreateJournal(self.args.url)
+
+            self.driver.connect()
+
+        try:
+            if self.args.command == "create":
+                self._create()
+            elif self.args.command == "nuke":
+                self._nuke()
+            elif self.args.command == "rollback":
+                self._rollback()
+            elif self.args.command == "list":
+                self._list()
+            elif self.args.command == "reclaim":
+                self._reclaim()
+            elif self.args.command == "image":
+                self._image()
+        finally:
+            # failed runs are the ones worth looking at
+            if not self.client and self.driver.tracer:
+                if self.args.trace_file:
+                    self.driver.tracer.export(self.args.trace_file)
+                    self.logger.info("wrote the trace to %s", self.args.trace_file)
+
+                if self.args.stats:
+                    self._report_stats(self.driver.tracer)
+
+        if not self.client:
+            self.logger.info("closing connection to the libVirt API")
+            self.driver.close()
 
 
 def run():
@@ -1,9 +1,12 @@
 import io
 import logging
 
-import pycdlib
 import yaml
 
+from .errors import SpecError
+from .nic import guest_offloads
+from .seediso import write_seed_iso
+
 
 class CloudInit:
     def __init__(self, vmspec):
@@ -14,7 +17,6 @@ class CloudInit:
         self.udata = None
         self.mdata = None
         self.netconf = None
-        self.iso_path = None
 
     def _gen_netconf(self):
         self.logger.info("generating network_config")
@@ -27,19 +29,27 @@ class CloudInit:
         network["ethernets"] = {}
         network["ethernets"]["id0"] = {}
         network["ethernets"]["id0"]["match"] = {"macaddress": self.vmspec.mac_addr}
-        network["ethernets"]["id0"]["addresses"] = [
-            f"{self.vmspec.ip}/{self.vmspec.bridge_pfxlen}"
-        ]
-        network["ethernets"]["id0"]["nameservers"] = {
-            "addresses": ["1.1.1.1", "1.0.0.1"]
-        }
-        network["ethernets"]["id0"]["routes"] = [
-            {
-                "to": "0.0.0.0/0",
-                "via": self.vmspec.gateway,
-                "on-link": True,
+
+        if self.vmspec.ip is None:
+            network["ethernets"]["id0"]["dhcp4"] = True
+        else:
+            network["ethernets"]["id0"]["addresses"] = [
+                f"{self.vmspec.ip}/{self.vmspec.bridge_pfxlen}"
+            ]
+            network["ethernets"]["id0"]["nameservers"] = {
+                "addresses": ["1.1.1.1", "1.0.0.1"]
             }
-        ]
+            network["ethernets"]["id0"]["routes"] = [
+                {
+                    "to": "0.0.0.0/0",
+                    "via": self.vmspec.gateway,
+                    "on-link": True,
+                }
+            ]
+
+        # the same offloads the host side got, the queues need nothing as the
+        # guest kernel enables all of them by default
+        network["ethernets"]["id0"].update(guest_offloads(self.vmspec))
 
         self.netconf = yaml.dump(base, sort_keys=False).encode("utf-8")
 
@@ -58,10 +68,10 @@ class CloudInit:
                 "ssh_pwauth" in cloudinit_udata
                 and self.vmspec.sshpwauth != cloudinit_udata["ssh_pwauth"]
             ):
-                self.logger.error(
-                    'user-data has "ssh_pwauth" set to %s while the vmspec value is %s',
-                    cloudinit_udata["ssh_pwauth"],
-                    self.vmspec.sshpwauth,
+                raise SpecError(
+                    'user-data has "ssh_pwauth" set to '
+                    f"{cloudinit_udata['ssh_pwauth']} while the vmspec value is "
+                    f"{self.vmspec.sshpwauth}"
                 )
 
             # override
@@ -144,28 +154,42 @@ class CloudInit:
 
                 # check if anything remains
                 if not user_dict["ssh_authorized_keys"]:
-                    self.logger.error(
-                        "resulting ssh_authorized_keys for %s does not contain any keys",
-                        user_dict["name"],
+                    raise SpecError(
+                        f"resulting ssh_authorized_keys for {user_dict['name']} does "
+                        "not contain any keys"
                     )
             else:
                 # no passwd, no ssh keys == no auth
                 if "passwd" not in user_dict:
-                    self.logger.error(
-                        "user %s does not have a passwd or a ssh key", user_dict["name"]
+                    raise SpecError(
+                        f"user {user_dict['name']} does not have a passwd or a ssh key"
                     )
-                else:
-                    if (
-                        "ssh_pwauth" not in cloudinit_udata
-                        or not cloudinit_udata["ssh_pwauth"]
-                    ):
-                        err_msg = f"user {user_dict['name']} only has passwd "
-                        err_msg += "for auth but the ssh_pwauth is not defined "
-                        err_msg += "or set to false"
-                        self.logger.error(err_msg)
+
+                if (
+                    "ssh_pwauth" not in cloudinit_udata
+                    or not cloudinit_udata["ssh_pwauth"]
+                ):
+                    err_msg = f"user {user_dict['name']} only has passwd "
+                    err_msg += "for auth but the ssh_pwauth is not defined "
+                    err_msg += "or set to false"
+                    raise SpecError(err_msg)
 
         if not cloudinit_udata["users"]:
-            self.logger.error("resulting user-data contains no users")
+            raise SpecError("resulting user-data contains no users")
+
+        # user-data.packages (list), the channel alone does not get the agent
+        # installed on the stock cloud images
+        if self.vmspec.guest_agent:
+            if "packages" not in cloudinit_udata:
+                cloudinit_udata["packages"] = []
+
+            if "qemu-guest-agent" not in cloudinit_udata["packages"]:
+                cloudinit_udata["packages"].append("qemu-guest-agent")
+
+            if "runcmd" not in cloudinit_udata:
+                cloudinit_udata["runcmd"] = []
+
+            cloudinit_udata["runcmd"].append("systemctl start qemu-guest-agent")
 
         cloud_udata = yaml.dump(
             cloudinit_udata,
@@ -185,10 +209,28 @@ class CloudInit:
 
         self.mdata = yaml.dump(cloudinit_mdata, sort_keys=False).encode("utf-8")
 
-    def mkiso(self):
-        self.logger.info("creating cloud-init ISO")
+    def _gen_files(self):
+        # (iso9660 name, rock ridge/joliet name, contents)
+        self._gen_udata()
+        self._gen_mdata()
+
+        files = [
+            ("UDATA.;1", "user-data", self.udata),
+            ("MDATA.;1", "meta-data", self.mdata),
+        ]
+
+        # without one the image falls back to dhcp on whatever it finds
+        if self.vmspec.ip is not None or guest_offloads(self.vmspec):
+            self._gen_netconf()
+            files.append(("NDATA.;1", "network-config", self.netconf))
+
+        return files
+
+    @staticmethod
+    def _mkiso_pycdlib(files):
+        # imported here as it is only the fallback and slow to import
+        import pycdlib  # pylint: disable=import-outside-toplevel
 
-        # - - init iso - - #
         iso = pycdlib.PyCdlib()
         iso.new(
             interchange_level=4,  # unofficial but same as genisoimage
@@ -197,37 +239,31 @@ class CloudInit:
             vol_ident="CIDATA",
         )
 
-        # - - user data - - #
-        self._gen_udata()
-        iso.add_fp(
-            io.BytesIO(self.udata),
-            len(self.udata),
-            "/UDATA.;1",
-            rr_name="user-data",
-            joliet_path="/user-data",
-        )
-
-        # - - meta data - - #
-        self._gen_mdata()
-        iso.add_fp(
-            io.BytesIO(self.mdata),
-            len(self.mdata),
-            "/MDATA.;1",
-            rr_name="meta-data",
-            joliet_path="/meta-data",
-        )
-
-        # - - netplan - - #
-        if self.vmspec.ip is not None:
-            self._gen_netconf()
-
+        for iso_name, name, data in files:
             iso.add_fp(
-                io.BytesIO(self.netconf),
-                len(self.netconf),
-                "/NDATA.;1",
-                rr_name="network-config",
-                joliet_path="/network-config",
+                io.BytesIO(data),
+                len(data),
+                f"/{iso_name}",
+                rr_name=name,
+                joliet_path=f"/{name}",
             )
 
-        iso.write(self.iso_path)
+        iso_buf = io.BytesIO()
+        iso.write_fp(iso_buf)
         iso.close()
+
+        return iso_buf.getvalue()
+
+    def mkiso(self, fast=True):
+        self.logger.info("creating cloud-init ISO")
+
+        files = self._gen_files()
+
+        # built in memory so that the driver can stream it into any pool type
+        if fast:
+            try:
+                return write_seed_iso(files, vol_ident="CIDATA")
+            except ValueError as exc:
+                self.logger.warning("%s, falling back to pycdlib", exc)
+
+        return self._mkiso_pycdlib(files)
@@ -1,270 +1,524 @@
+import copy
 import ipaddress
 import logging
 import os
+import threading
 
 import yaml
 
+from .density import resolve_density_profile
+from .disk import resolve_disk_profile
+from .disk import VOL_CLUSTER_SIZES, VOL_EXTENDED_L2_MIN_CLUSTER_SIZE
+from .disk import VOL_PREALLOC_MODES
+from .errors import SpecError
+from .nic import resolve_net_profile
+from .placement import HUGEPAGE_SIZES, parse_cpuset
 from .spec import VMSpec, UserSpec
 
+# libyaml is many times faster on large fleets, the safe loaders only ever
+# build plain python objects out of the documents
+YAMLLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
-class ConfigYAML:
-    def __init__(self, vmspec_file, userspec_file, userdata_file):
-        self.vmspec_file = vmspec_file
-        self.userspec_file = userspec_file
-        self.userdata_file = userdata_file
+DEFAULT_BASE_IMAGE = "noble-server-cloudimg-amd64.img"
 
-        self.logger = logging.getLogger(self.__class__.__name__)
+# parsed userspec files by path, reused for as long as their modification
+# time and size stay the same. cloudvirtd reads the same one for every create
+_userspec_cache = {}
+_userspec_cache_lock = threading.Lock()
 
-        self.vmspec = None
 
-    def _parse_vmspec(self):
-        # - - load yaml - - #
-        self.logger.info("loading VMSpec() yaml")
+# - - value checks - - #
+# each returns the value as it ends up in the spec or raises ValueError with
+# what is wrong with it, prefixed by the key when reported
+def _str(value):
+    if isinstance(value, (dict, list)):
+        raise ValueError("should be a string")
 
-        if os.path.isfile(self.vmspec_file):
-            try:
-                with open(self.vmspec_file, "r", encoding="utf-8") as yaml_file:
-                    yaml_parsed = yaml.load(yaml_file.read(), Loader=yaml.Loader)
-            except:
-                self.logger.exception("%s parsing has failed", self.vmspec_file)
-        else:
-            self.logger.error("%s is not a file", self.vmspec_file)
+    return str(value)
 
-        # - - parse yaml - - #
-        self.logger.info("parsing VMSpec() yaml")
 
-        # fmt: off
-        try:
-            vmspec_yaml = yaml_parsed[ # pylint: disable=possibly-used-before-assignment
-                "vmspec"
-            ]
-        except KeyError:
-            self.logger.exception("vmspec section in the YAML file is missing")
+def _int(value):
+    if isinstance(value, bool):
+        raise ValueError("should be an int")
 
-        vmspec_must_have = [
-            "dom_name",
-            "dom_mem",
-            "dom_vcpu",
-            "net",
-            "vol_pool",
-            "vol_size",
-        ]
-        # fmt: on
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError("should be an int") from None
 
-        for item in vmspec_must_have:
-            if item not in vmspec_yaml.keys():
-                self.logger.error("%s is missing from the YAML", item)
-            if not vmspec_yaml[item]:
-                self.logger.error("%s cannot be blank", item)
 
-        # - - generate vmspec - - #
-        self.logger.info("creating VMSpec() for: %s", vmspec_yaml["dom_name"])
+def _positive_int(value):
+    value = _int(value)
+    if value < 1:
+        raise ValueError("should be a positive int")
 
-        self.vmspec = VMSpec()
+    return value
 
-        # vmspec.dom_name
-        self.vmspec.dom_name = str(vmspec_yaml["dom_name"])
 
-        # vmspec.dom_mem
-        self.vmspec.dom_mem = int(vmspec_yaml["dom_mem"])
+def _bool(value):
+    if not isinstance(value, bool):
+        raise ValueError("should be a bool")
 
-        # vmspec.dom_vcpu
-        self.vmspec.dom_vcpu = int(vmspec_yaml["dom_vcpu"])
+    return value
 
-        # vmspec.net
-        self.vmspec.net = str(vmspec_yaml["net"])
 
-        # vmspec.vol_pool
-        self.vmspec.vol_pool = str(vmspec_yaml["vol_pool"])
+def _one_of(choices):
+    def check(value):
+        if isinstance(value, (dict, list)) or value not in choices:
+            raise ValueError(f"should be one of: {', '.join(choices)}")
 
-        # vmspec.vol_size
-        self.vmspec.vol_size = int(vmspec_yaml["vol_size"])
+        return value
 
-        # vmspec.vol_name
-        self.vmspec.vol_name = f"{self.vmspec.dom_name}-vol.qcow2"
+    return check
 
-        # vmspec.base_image
-        try:
-            if vmspec_yaml["base_image"] is None:
-                self.logger.error("base_image cannot be specified then left blank")
-            else:
-                self.vmspec.base_image = str(vmspec_yaml["base_image"])
-        except KeyError:
-            self.vmspec.base_image = "noble-server-cloudimg-amd64.img"
-
-        # vmspec.ip
-        try:
-            if vmspec_yaml["ip"] is None:
-                self.logger.error("ip cannot be specified then left blank")
-            else:
-                self.vmspec.ip = str(vmspec_yaml["ip"])
-
-        except KeyError:
-            pass
-
-        if self.vmspec.ip:
-            try:
-                if "/" in self.vmspec.ip:
-                    ipaddress.ip_network(self.vmspec.ip)
-                else:
-                    ipaddress.ip_address(self.vmspec.ip)
-            except ValueError:
-                self.logger.exception("%s is not a valid ipv4 address.", self.vmspec.ip)
-
-            ip_parts = self.vmspec.ip.split("/")
-            self.vmspec.ip = ip_parts[0]
-
-            if len(ip_parts) == 2:
-                self.vmspec.bridge_pfxlen = ip_parts[1]
-
-        # vmspec.sshpwauth
+
+def _resolved(resolve):
+    def check(value):
         try:
-            if vmspec_yaml["sshpwauth"] is None:
-                self.logger.error("sshpwauth cannot be specified then left blank")
+            return resolve(value)
+        except ValueError as exc:
+            raise ValueError(f"is invalid: {exc}") from None
 
-            if type(vmspec_yaml["sshpwauth"]).__name__ != "bool":
-                self.logger.error("sshpwauth should be a bool.")
+    return check
 
-            self.vmspec.sshpwauth = vmspec_yaml["sshpwauth"]
-        except KeyError:
-            pass
 
-        # vmspec.gateway
-        try:
-            if vmspec_yaml["gateway"] is None:
-                self.logger.error("gateway cannot be specified then left blank")
+def _ip(value):
+    value = _str(value)
+    if value == "auto":
+        return value
 
-            self.vmspec.gateway = vmspec_yaml["gateway"]
-        except KeyError:
-            pass
+    try:
+        if "/" in value:
+            ipaddress.ip_interface(value)
+        else:
+            ipaddress.ip_address(value)
+    except ValueError:
+        raise ValueError(f"{value} is not a valid ipv4 address") from None
 
-    def _parse_userspec(self):
-        # - - load yaml - - #
-        if not self.userspec_file:
-            return self.logger.info("no userspec configuration was provided")
+    return value
 
-        self.logger.info("loading UserSpec() yaml")
 
-        if os.path.isfile(self.userspec_file):
-            try:
-                with open(self.userspec_file, "r", encoding="utf-8") as yaml_file:
-                    yaml_parsed = yaml.load(yaml_file.read(), Loader=yaml.Loader)
-            except:
-                self.logger.exception("%s parsing has failed", self.userspec_file)
-        else:
-            self.logger.error("%s is not a file", self.userspec_file)
+def _files(value):
+    if not isinstance(value, list):
+        raise ValueError("should be a list of files")
+
+    return [os.path.abspath(str(x)) for x in value]
 
-        # - - parse yaml - - #
-        self.logger.info("parsing UserSpec() yaml")
+
+def _cpuset(value):
+    try:
+        parse_cpuset(value)
+    except ValueError as exc:
+        raise ValueError(f"{value} is not a valid cpu list: {exc}") from None
+
+    return str(value)
+
+
+def _numa_node(value):
+    if value != "auto" and (not isinstance(value, int) or isinstance(value, bool)):
+        raise ValueError("should be a node number or auto")
+
+    return value
+
+
+def _cluster_size(value):
+    if value not in VOL_CLUSTER_SIZES or isinstance(value, bool):
+        raise ValueError(
+            "should be a power of two between "
+            f"{VOL_CLUSTER_SIZES[0]} and {VOL_CLUSTER_SIZES[-1]} KiB"
+        )
+
+    return value
+
+
+def _labels(value):
+    if not isinstance(value, dict):
+        raise ValueError("should be a mapping of keys to values")
+
+    for key, label in value.items():
+        if label is None:
+            raise ValueError(f"{key} cannot be left blank")
+
+    return {str(k): str(v) for k, v in value.items()}
+
+
+def _ssh_keys(value):
+    if not isinstance(value, list) or not value:
+        raise ValueError("should be a list of at least one key")
+
+    if any(x is None for x in value):
+        raise ValueError("cannot contain empty elements")
+
+    return [str(x) for x in value]
+
+
+# - - schemas - - #
+# key: (required, check), every key is the attribute of the spec it sets
+VMSPEC_SCHEMA = {
+    # domain
+    "dom_name": (True, _str),
+    "dom_mem": (True, _positive_int),
+    "dom_mem_current": (False, _positive_int),
+    "dom_vcpu": (True, _positive_int),
+    "cpu_mode": (False, _str),
+    "cpu_baseline_hosts": (False, _files),
+    # placement
+    "cpuset": (False, _cpuset),
+    "emulator_cpuset": (False, _cpuset),
+    "numa_node": (False, _numa_node),
+    "hugepages": (False, _one_of(HUGEPAGE_SIZES)),
+    "density_profile": (False, _resolved(resolve_density_profile)),
+    # networking
+    "net": (True, _str),
+    "ip": (False, _ip),
+    "gateway": (False, _str),
+    "net_profile": (False, _resolved(resolve_net_profile)),
+    # storage
+    "vol_pool": (True, _str),
+    "vol_size": (True, _positive_int),
+    "base_image": (False, _str),
+    "vol_prealloc": (False, _one_of(VOL_PREALLOC_MODES)),
+    "vol_cluster_size": (False, _cluster_size),
+    "vol_extended_l2": (False, _bool),
+    "disk_profile": (False, _resolved(resolve_disk_profile)),
+    # misc
+    "sshpwauth": (False, _bool),
+    "labels": (False, _labels),
+    "guest_agent": (False, _bool),
+}
+
+USERSPEC_SCHEMA = {
+    "name": (True, _str),
+    "password_hash": (False, _str),
+    "ssh_keys": (False, _ssh_keys),
+    "sudo_god_mode": (False, _bool),
+}
+
+
+def _apply_schema(schema, doc, spec):
+    # sets every valid key of doc on spec in a single pass, returns what is
+    # wrong with the rest along with the keys the schema does not know of
+    if not isinstance(doc, dict):
+        return ["should be a mapping"], []
+
+    errors = []
+    for key, (required, check) in schema.items():
+        if key not in doc:
+            if required:
+                errors.append(f"{key} is missing")
+
+            continue
+
+        if doc[key] is None or doc[key] == "":
+            errors.append(f"{key} cannot be left blank")
+            continue
 
         try:
-            userspec_yaml = (
-                yaml_parsed[  # pylint: disable=possibly-used-before-assignment
-                    "userspec"
-                ]
+            setattr(spec, key, check(doc[key]))
+        except ValueError as exc:
+            errors.append(f"{key} {exc}")
+
+    return errors, [str(x) for x in doc if x not in schema]
+
+
+def _check_vmspec(vmspec, vmspec_doc):
+    # the keys that depend on each other, left alone if either was invalid
+    errors = []
+
+    if vmspec.ip == "auto" and "gateway" in vmspec_doc:
+        errors.append("gateway cannot be specified with ip: auto")
+
+    if "cpu_baseline_hosts" in vmspec_doc and vmspec.cpu_mode != "baseline":
+        errors.append("cpu_baseline_hosts requires cpu_mode: baseline")
+
+    if vmspec.hugepages is not None and vmspec.dom_mem is not None:
+        if (vmspec.dom_mem * 1024) % HUGEPAGE_SIZES[vmspec.hugepages]:
+            errors.append(
+                f"dom_mem has to be a multiple of the {vmspec.hugepages} "
+                "hugepage size"
             )
-        except KeyError:
-            self.logger.exception("userspec section in the YAML file is missing")
 
-        userspec_must_have = ["name"]
+    # the qcow2 default is 64 KiB
+    if (
+        vmspec.vol_extended_l2
+        and (vmspec.vol_cluster_size or 64) < VOL_EXTENDED_L2_MIN_CLUSTER_SIZE
+    ):
+        errors.append(
+            "vol_extended_l2 requires a vol_cluster_size of at least "
+            f"{VOL_EXTENDED_L2_MIN_CLUSTER_SIZE} KiB"
+        )
 
-        for user in userspec_yaml:
-            for item in userspec_must_have:
-                if item not in user.keys():
-                    self.logger.error("%s is missing from the YAML", item)
-                if not user[item]:
-                    self.logger.error("%s cannot be blank", item)
+    density_profile = vmspec.density_profile or resolve_density_profile()
 
-            # - - create userspec - - #
-            self.logger.info("creating UserSpec() for: %s", user["name"])
+    # hugetlbfs backed memory is never merged
+    if density_profile["ksm"] and vmspec.hugepages is not None:
+        errors.append("ksm cannot be enabled for hugepages backed memory")
 
-            userspec = UserSpec()
+    if vmspec.dom_mem_current is not None:
+        if vmspec.dom_mem is not None and vmspec.dom_mem_current > vmspec.dom_mem:
+            errors.append("dom_mem_current should be between 1 and dom_mem")
 
-            # userspec.name
-            userspec.name = str(user["name"])
-
-            # userspec.password_hash
-            try:
-                if user["password_hash"] is None:
-                    self.logger.error(
-                        "password_hash cannot be specified then left blank"
-                    )
-
-                userspec.password_hash = str(user["password_hash"])
-            except KeyError:
-                pass
-
-            # userspec.ssh_keys
-            try:
-                for key in user["ssh_keys"]:
-                    if key is None:
-                        self.logger.error(
-                            "ssh_keys cannot be specified then contain empty elements"
-                        )
-
-                    userspec.ssh_keys.append(str(key))
-            except TypeError:
-                self.logger.exception(
-                    "ssh_keys cannot be specified and have no elements"
-                )
-            except KeyError:
-                pass
+        # nothing else could give the rest of it to the guest later on
+        if not density_profile["balloon"]:
+            errors.append("dom_mem_current requires the balloon")
+
+    return errors
+
+
+class Config:
+    # vmspecs and users parsed and validated off of the documents the yaml
+    # files hold: the vmspec sections, the list of the userspec section and
+    # the user-data, as plain python objects. every error is collected and
+    # reported at once
+    def __init__(self, vmspec_docs, userspec_docs=None, userdata=None):
+        self.vmspec_docs = vmspec_docs
+        self.userspec_docs = userspec_docs
+        self.userdata = userdata
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.vmspecs = []
+        self.users = []
+
+    def _parse_vmspec(self, vmspec_doc):
+        vmspec = VMSpec()
+        vmspec.base_image = DEFAULT_BASE_IMAGE
+
+        errors, unknown = _apply_schema(VMSPEC_SCHEMA, vmspec_doc, vmspec)
+        if unknown:
+            self.logger.warning(
+                "ignoring unknown vmspec keys of %s: %s",
+                vmspec.dom_name,
+                ", ".join(unknown),
+            )
+
+        if errors and not isinstance(vmspec_doc, dict):
+            return vmspec, errors
 
-            # userspec.sudo_god_mode
-            try:
-                if user["sudo_god_mode"] is None:
-                    self.logger.error(
-                        "sudo_god_mode cannot be specified then left blank"
-                    )
+        errors += _check_vmspec(vmspec, vmspec_doc)
 
-                if type(user["sudo_god_mode"]).__name__ != "bool":
-                    self.logger.error("sudo_god_mode should be a bool.")
+        if vmspec.dom_name is not None:
+            vmspec.vol_name = f"{vmspec.dom_name}-vol.qcow2"
 
-                userspec.sudo_god_mode = user["sudo_god_mode"]
-            except KeyError:
-                pass
+        if vmspec.ip is not None and "/" in vmspec.ip:
+            vmspec.ip, vmspec.bridge_pfxlen = vmspec.ip.split("/")
 
-            if not userspec.ssh_keys and not self.userdata_file:
-                # no way of authing is possible
+        return vmspec, errors
+
+    def _parse_userspec(self):
+        if self.userspec_docs is None:
+            self.logger.info("no userspec configuration was provided")
+            return []
+
+        if not isinstance(self.userspec_docs, list):
+            return ["userspec should be a list of users"]
+
+        errors = []
+        for index, user_doc in enumerate(self.userspec_docs):
+            userspec = UserSpec()
+
+            user_errors, unknown = _apply_schema(USERSPEC_SCHEMA, user_doc, userspec)
+            where = userspec.name or f"user #{index + 1}"
+
+            if unknown:
+                self.logger.warning(
+                    "ignoring unknown userspec keys of %s: %s",
+                    where,
+                    ", ".join(unknown),
+                )
+
+            # no way of authing is possible
+            if not user_errors and not userspec.ssh_keys and self.userdata is None:
                 if not userspec.password_hash:
                     err_msg = "no ssh keys, a password hash, or a user-data "
-                    err_msg += "file that may contain them for the user "
-                    err_msg += f"{userspec.name} is present, bailing out"
-                    self.logger.error(err_msg)
-                else:
-                    # passwd is only auth but no sshpwauth
-                    if not self.vmspec.sshpwauth:
-                        err_msg = "passwd is the only auth mechanism possible "
-                        err_msg += f"for user {userspec.name} but sshpwauth in "
-                        err_msg += f"vmspec is set to {self.vmspec.sshpwauth} "
-                        err_msg += "and no user-data file that may contain the "
-                        err_msg += "key with the value set to True was "
-                        err_msg += "provided, bailing out"
-                        self.logger.error(err_msg)
-
-            self.vmspec.users.append(userspec)
-
-    def _parse_userdata(self):
-        # - - load yaml - - #
-        if not self.userdata_file:
-            return self.logger.info("no arbitrary user-data was provided")
+                    err_msg += "file that may contain them is present"
+                    user_errors.append(err_msg)
+
+            errors += [f"user {where}: {x}" for x in user_errors]
+            self.users.append(userspec)
+
+        return errors
+
+    def _check_user_auth(self):
+        # passwd is the only auth of a user but the vms do not allow it
+        errors = []
+
+        if self.userdata is not None:
+            return errors
+
+        no_pwauth = [x.dom_name for x in self.vmspecs if not x.sshpwauth]
+        if not no_pwauth:
+            return errors
+
+        for userspec in self.users:
+            if userspec.ssh_keys or not userspec.password_hash:
+                continue
+
+            err_msg = "passwd is the only auth mechanism possible for user "
+            err_msg += f"{userspec.name} but sshpwauth is not enabled and no "
+            err_msg += "user-data file that may enable it was provided for: "
+            err_msg += ", ".join(no_pwauth)
+            errors.append(err_msg)
+
+        return errors
+
+    def _check_fleet(self):
+        # names and static ips have to be unique within a fleet, libvirt would
+        # only catch these halfway through the creation
+        errors = []
+        dom_names, ips = set(), set()
+
+        for vmspec in self.vmspecs:
+            if vmspec.dom_name is None:
+                continue
+
+            if vmspec.dom_name in dom_names:
+                errors.append(f"{vmspec.dom_name} is specified more than once")
+
+            dom_names.add(vmspec.dom_name)
+
+            if vmspec.ip is None or vmspec.ip == "auto":
+                continue
+
+            if (vmspec.net, vmspec.ip) in ips:
+                errors.append(f"{vmspec.ip} is assigned more than once in {vmspec.net}")
+
+            ips.add((vmspec.net, vmspec.ip))
+
+        return errors
+
+    def run(self):
+        if not self.vmspec_docs:
+            raise SpecError("no vmspecs were provided")
+
+        self.logger.info("parsing %s VMSpec() yaml(s)", len(self.vmspec_docs))
+
+        errors = []
+        for index, vmspec_doc in enumerate(self.vmspec_docs):
+            vmspec, vmspec_errors = self._parse_vmspec(vmspec_doc)
+
+            where = vmspec.dom_name or f"vmspec #{index + 1}"
+            errors += [f"{where}: {x}" for x in vmspec_errors]
+
+            self.vmspecs.append(vmspec)
+
+        errors += self._check_fleet()
+        errors += self._parse_userspec()
+
+        if self.userdata is None:
+            self.logger.info("no arbitrary user-data was provided")
+
+        # only meaningful once every spec is valid
+        if not errors:
+            errors += self._check_user_auth()
+
+        if errors:
+            if len(errors) == 1:
+                raise SpecError(errors[0])
+
+            raise SpecError(
+                f"{len(errors)} errors in the specs:\n"
+                + "\n".join(f"  {x}" for x in errors)
+            )
+
+        for vmspec in self.vmspecs:
+            vmspec.users = list(self.users)
+
+            # CloudInit() merges into the user-data in place, every vm needs
+            # its own copy
+            vmspec.userdata = copy.deepcopy(self.userdata)
+
+
+class ConfigYAML(Config):
+    def __init__(self, vmspec_files, userspec_file, userdata_file):
+        # a single path is accepted for compatibility with one-off creates
+        if isinstance(vmspec_files, str):
+            vmspec_files = [vmspec_files]
+
+        super().__init__([])
+
+        self.vmspec_files = vmspec_files
+        self.userspec_file = userspec_file
+        self.userdata_file = userdata_file
+
+    @staticmethod
+    def _read_yaml(path, multi=False):
+        if not os.path.isfile(path):
+            raise SpecError(f"{path} is not a file")
+
+        try:
+            with open(path, "r", encoding="utf-8") as yaml_file:
+                if multi:
+                    return list(yaml.load_all(yaml_file, Loader=YAMLLoader))
+
+                return yaml.load(yaml_file, Loader=YAMLLoader)
+        except (OSError, yaml.YAMLError) as exc:
+            raise SpecError(f"{path} parsing has failed: {exc}") from exc
+
+    def _load_vmspec_docs(self):
+        # every file may hold a single vmspec or a fleet of them as a
+        # multi-document yaml stream separated by `---'
+        vmspec_docs = []
+
+        for vmspec_file in self.vmspec_files:
+            self.logger.info("loading VMSpec() yaml: %s", vmspec_file)
+
+            for doc in self._read_yaml(vmspec_file, multi=True):
+                # skip empty documents, e.g. a trailing `---'
+                if doc is None:
+                    continue
+
+                try:
+                    vmspec_docs.append(doc["vmspec"])
+                except (KeyError, TypeError):
+                    raise SpecError(
+                        f"vmspec section in {vmspec_file} is missing"
+                    ) from None
+
+        return vmspec_docs
+
+    def _load_userspec_docs(self):
+        if not self.userspec_file:
+            return None
+
+        path = os.path.abspath(self.userspec_file)
+        try:
+            stat = os.stat(path)
+            key = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            key = None
+
+        with _userspec_cache_lock:
+            cached = _userspec_cache.get(path)
+
+        if key is not None and cached is not None and cached[0] == key:
+            self.logger.info("using the cached UserSpec() yaml")
+            return cached[1]
 
         self.logger.info("loading UserSpec() yaml")
 
-        if os.path.isfile(self.userdata_file):
-            try:
-                with open(self.userdata_file, "r", encoding="utf-8") as yaml_file:
-                    yaml_parsed = yaml.load(yaml_file.read(), Loader=yaml.Loader)
-            except:
-                self.logger.exception("%s parsing has failed", self.userdata_file)
-        else:
-            self.logger.error("%s is not a file", self.userdata_file)
+        try:
+            userspec_docs = self._read_yaml(path)["userspec"]
+        except (KeyError, TypeError):
+            raise SpecError("userspec section in the YAML file is missing") from None
 
-        self.vmspec.userdata = (
-            yaml_parsed  # pylint: disable=possibly-used-before-assignment
-        )
+        if key is not None:
+            with _userspec_cache_lock:
+                _userspec_cache[path] = (key, userspec_docs)
+
+        return userspec_docs
+
+    def _load_userdata(self):
+        if not self.userdata_file:
+            return None
+
+        self.logger.info("loading user-data yaml")
+
+        return self._read_yaml(self.userdata_file)
 
     def run(self):
-        self._parse_vmspec()
-        self._parse_userspec()
-        self._parse_userdata()
+        self.vmspec_docs = self._load_vmspec_docs()
+        self.userspec_docs = self._load_userspec_docs()
+        self.userdata = self._load_userdata()
+
+        super().run()
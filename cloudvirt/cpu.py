@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import os
+import threading
+import xml.etree.ElementTree as ET
+
+from .errors import SpecError
+from .util import cache_dir, replace_file
+
+# the cpu model vms were always created with, kept as the default as it runs
+# on anything x86_64-v2
+LEGACY_MODEL = "qemu64"
+LEGACY_FEATURES = [
+    "cx16",
+    "popcnt",
+    "sse4.1",
+    "sse4.2",
+    "ssse3",
+    "avx",
+    "hypervisor",
+    "lahf_lm",
+]
+
+
+class CPUBaseline:
+    # the cpu model and features every host in a set supports, computed by
+    # libvirt once per set of host cpu descriptions and kept on disk along
+    # with the libvirt and hypervisor versions it came from, as neither
+    # changes without a hardware, libvirt or qemu upgrade
+    def __init__(self, driver):
+        self.driver = driver
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self._baselines = {}
+        self._versions = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host_cpu_xml(xml):
+        # accepts both a bare <cpu> and the full `virsh capabilities' output
+        root = ET.fromstring(xml)
+        if root.tag != "cpu":
+            root = root.find("host/cpu")
+
+        return ET.tostring(root, encoding="unicode")
+
+    def _load_host_cpus(self, host_cpu_files):
+        if not host_cpu_files:
+            return [self._host_cpu_xml(self.driver.getCapabilities())]
+
+        host_cpus = []
+        for path in host_cpu_files:
+            try:
+                with open(path, "r", encoding="utf-8") as cpu_file:
+                    host_cpus.append(self._host_cpu_xml(cpu_file.read()))
+            except (OSError, ET.ParseError, TypeError) as exc:
+                raise SpecError(
+                    f"cannot read a host cpu description from {path}: {exc}"
+                ) from exc
+
+        return host_cpus
+
+    def _get_versions(self):
+        # fetched once per connection
+        if self._versions is None:
+            self._versions = [
+                str(self.driver.getLibVersion()),
+                str(self.driver.getVersion()),
+            ]
+
+        return self._versions
+
+    def get(self, host_cpu_files=None):
+        host_cpus = self._load_host_cpus(host_cpu_files)
+
+        key = "\0".join(self._get_versions() + sorted(host_cpus))
+        key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        cache_path = os.path.join(cache_dir(), f"cpu-baseline-{key[:16]}.xml")
+
+        with self._lock:
+            if key in self._baselines:
+                return self._baselines[key]
+
+            if os.path.isfile(cache_path):
+                with open(cache_path, "r", encoding="utf-8") as cache_file:
+                    baseline = cache_file.read()
+            else:
+                self.logger.info(
+                    "computing the baseline of %s host cpu(s)", len(host_cpus)
+                )
+
+                baseline = self.driver.baselineHypervisorCPU(
+                    None, "x86_64", "q35", "kvm", host_cpus, 0
+                )
+
+                replace_file(cache_path, baseline)
+
+            self._baselines[key] = baseline
+
+        return baseline
+
+
+def gen_cpu(cpu_mode, baseline=None):
+    # <cpu> element of the domain for a VMSpec().cpu_mode
+    if cpu_mode in ["host-passthrough", "host-model"]:
+        return ET.Element("cpu", {"mode": cpu_mode})
+
+    if cpu_mode == "baseline":
+        domxml_cpu = ET.fromstring(baseline)
+        domxml_cpu.attrib.update({"mode": "custom", "match": "exact"})
+
+        return domxml_cpu
+
+    domxml_cpu = ET.Element(
+        "cpu", {"mode": "custom", "match": "exact", "check": "partial"}
+    )
+    ET.SubElement(domxml_cpu, "model", {"fallback": "forbid"}).text = (
+        cpu_mode or LEGACY_MODEL
+    )
+
+    # the features only make sense on top of the model they were picked for
+    if cpu_mode is None:
+        for feat in LEGACY_FEATURES:
+            ET.SubElement(domxml_cpu, "feature", {"policy": "require", "name": feat})
+        ET.SubElement(domxml_cpu, "feature", {"policy": "disable", "name": "svm"})
+
+    return domxml_cpu
@@ -0,0 +1,362 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+
+from .errors import CloudvirtError, ConflictError
+from .log import set_root_logger
+from .util import CACHE_MAX_AGE, DEFAULT_JOBS, RECLAIM_HEADROOM, RECLAIM_MIN_MEM
+
+from . import __version__ as pkg_version
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "cloudvirtd.sock")
+
+    return f"/tmp/cloudvirtd-{os.getuid()}.sock"
+
+
+# the cli imports this module for DaemonClient alone, the driver and the
+# config parser are only imported by the daemon itself
+class DaemonClient:
+    # requests and responses are single lines of json, one request per
+    # connection
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or default_socket_path()
+
+    def _check_owner(self):
+        # a socket someone else created or can write to, e.g. planted under
+        # /tmp, gets neither the specs nor the user-data
+        sock_stat = os.stat(self.socket_path)
+
+        if sock_stat.st_uid != os.getuid():
+            raise PermissionError(f"{self.socket_path} is not owned by us")
+
+        if sock_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise PermissionError(f"{self.socket_path} is group or world writable")
+
+    def _connect(self):
+        self._check_owner()
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+
+        return sock
+
+    def available(self):
+        try:
+            self._connect().close()
+        except OSError:
+            return False
+
+        return True
+
+    def request(self, payload):
+        with self._connect() as sock:
+            sock.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+
+            with sock.makefile("rb") as sock_file:
+                return json.loads(sock_file.readline())
+
+    def serves(self, url):
+        # whether a daemon is listening and is connected to the libvirt at url
+        try:
+            response = self.request({"command": "info"})
+        except (OSError, ValueError):
+            return False
+
+        return response.get("ok", False) and response.get("url") == url
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        daemon = self.server.cloudvirtd
+
+        line = self.rfile.readline()
+
+        # DaemonClient.available() probing the socket
+        if not line:
+            return
+
+        try:
+            request = json.loads(line)
+            response = daemon.dispatch(request)
+        except CloudvirtError as exc:
+            # a bad request must not take the daemon and its warm connection
+            # down with it
+            response = {"ok": False, "error": str(exc)}
+        except Exception as exc:
+            daemon.logger.warning("request failed: %s", exc)
+            response = {"ok": False, "error": str(exc)}
+
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, cloudvirtd):
+        self.cloudvirtd = cloudvirtd
+        super().__init__(socket_path, DaemonRequestHandler)
+
+
+class Daemon:
+    def __init__(self, socket_path=None, url="qemu:///system", warm_pool_file=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.url = url
+        self.warm_pool_file = warm_pool_file
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.driver = None
+        self._server = None
+
+        # connections to the other hosts create requests were scheduled on
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _new_driver(self, url):
+        # pylint: disable=import-outside-toplevel
+        from .driver import APIDriver
+        from .journal import CreateJournal
+
+        driver = APIDriver(url)
+        driver.cache.max_age = CACHE_MAX_AGE
+        driver.journal = CreateJournal(url)
+        driver.connect()
+
+        return driver
+
+    def _drivers(self, urls):
+        if not urls:
+            return [self.driver]
+
+        drivers = []
+        with self._hosts_lock:
+            for url in dict.fromkeys(urls):
+                if url == self.driver.url:
+                    drivers.append(self.driver)
+                    continue
+
+                if url not in self._hosts:
+                    self._hosts[url] = self._new_driver(url)
+
+                drivers.append(self._hosts[url])
+
+        return drivers
+
+    # - - requests - - #
+    def _create(self, request):
+        from .config import ConfigYAML  # pylint: disable=import-outside-toplevel
+
+        config = ConfigYAML(
+            request["vmspec_files"],
+            request.get("userspec_file"),
+            request.get("userdata_file"),
+        )
+        config.run()
+
+        from .scheduler import Scheduler  # pylint: disable=import-outside-toplevel
+
+        scheduler = Scheduler(
+            self._drivers(request.get("hosts")), request.get("overcommit")
+        )
+
+        timings = {}
+        results = scheduler.create_many(
+            config.vmspecs,
+            request.get("jobs", DEFAULT_JOBS),
+            request.get("net_update", "live"),
+            wait=request.get("wait"),
+            timings=timings,
+            rollback=request.get("rollback", False),
+        )
+
+        return {"ok": True, "results": results, "timings": timings}
+
+    def _rollback(self, request):
+        return {
+            "ok": True,
+            "results": self.driver.rollback_many(
+                request.get("dom_names"),
+                request.get("jobs", DEFAULT_JOBS),
+                request.get("net_update", "live"),
+            ),
+        }
+
+    def _select(self, request):
+        return {
+            "ok": True,
+            "dom_names": self.driver.select_domains(
+                request.get("names", []),
+                regex=request.get("regex", False),
+                labels=request.get("labels", {}),
+            ),
+        }
+
+    def _nuke(self, request):
+        return {
+            "ok": True,
+            "results": self.driver.nuke_many(
+                request["dom_names"],
+                request.get("jobs", DEFAULT_JOBS),
+                request.get("net_update", "live"),
+            ),
+        }
+
+    def _reclaim(self, request):
+        from .density import Reclaimer  # pylint: disable=import-outside-toplevel
+
+        reclaimer = Reclaimer(
+            self.driver,
+            request.get("headroom", RECLAIM_HEADROOM),
+            request.get("min_mem", RECLAIM_MIN_MEM),
+        )
+        targets = reclaimer.plan(request.get("dom_names"))
+
+        results = None
+        if not request.get("dry_run"):
+            results = reclaimer.apply(targets)
+
+        return {"ok": True, "targets": targets, "results": results}
+
+    def _list(self, request):  # pylint: disable=unused-argument
+        return {"ok": True, "domains": self.driver.list_domains()}
+
+    def _info(self, request):  # pylint: disable=unused-argument
+        return {"ok": True, "url": self.driver.url, "version": pkg_version}
+
+    def dispatch(self, request):
+        handlers = {
+            "create": self._create,
+            "select": self._select,
+            "nuke": self._nuke,
+            "list": self._list,
+            "reclaim": self._reclaim,
+            "rollback": self._rollback,
+            "info": self._info,
+        }
+
+        command = request.get("command")
+        if command not in handlers:
+            return {"ok": False, "error": f"unknown command: {command}"}
+
+        # a request meant for another host must never act on this one
+        url = request.get("url", self.driver.url)
+        if url != self.driver.url:
+            raise ConflictError(f"connected to {self.driver.url}, not to {url}")
+
+        self.logger.info("handling %s request", command)
+
+        return handlers[command](request)
+
+    # - - lifecycle - - #
+    def _bind(self):
+        if os.path.exists(self.socket_path):
+            if DaemonClient(self.socket_path).available():
+                raise ConflictError(
+                    f"a daemon is already listening on {self.socket_path}"
+                )
+
+            # left behind by a daemon that did not shut down cleanly
+            os.unlink(self.socket_path)
+
+        old_umask = os.umask(0o077)
+        try:
+            self._server = DaemonServer(self.socket_path, self)
+        finally:
+            os.umask(old_umask)
+
+    def _shutdown(self, signum, frame):  # pylint: disable=unused-argument
+        self.logger.info("received signal %s, shutting down", signum)
+
+        # shutdown() blocks until serve_forever() returns, which runs in this
+        # very thread
+        threading.Thread(target=self._server.shutdown).start()
+
+    def run(self):
+        self.driver = self._new_driver(self.url)
+
+        if self.warm_pool_file:
+            # pylint: disable=import-outside-toplevel
+            from .warmpool import WarmPool, load_profiles
+
+            self.driver.warm_pool = WarmPool(
+                self.driver, load_profiles(self.warm_pool_file)
+            )
+            self.driver.warm_pool.start()
+
+        self._bind()
+
+        signal.signal(signal.SIGTERM, self._shutdown)
+        signal.signal(signal.SIGINT, self._shutdown)
+
+        self.logger.info("listening on %s", self.socket_path)
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.unlink(self.socket_path)
+
+            if self.driver.warm_pool is not None:
+                self.driver.warm_pool.stop()
+
+            self.logger.info("closing connection to the libVirt API")
+            self.driver.close()
+
+            for driver in self._hosts.values():
+                driver.close()
+
+
+def run():
+    parser_desc = f"cloudvirt daemon ver. {pkg_version}"
+    parser_d_help = "enable debugging"
+    parser_socket_help = f"unix socket to listen on (default: {default_socket_path()})"
+    parser_connect_help = "libvirt URI to connect to (default: qemu:///system)"
+    parser_warmpool_help = "yaml file describing the profiles and sizes of the "
+    parser_warmpool_help += "warm pool to keep topped up"
+
+    parser = argparse.ArgumentParser(description=parser_desc)
+    parser.add_argument("-d", dest="debug", action="store_true", help=parser_d_help)
+    parser.add_argument(
+        "--socket", dest="socket_path", required=False, help=parser_socket_help
+    )
+    parser.add_argument(
+        "-c",
+        "--connect",
+        dest="url",
+        default="qemu:///system",
+        required=False,
+        help=parser_connect_help,
+    )
+    parser.add_argument(
+        "--warm-pool",
+        dest="warm_pool_file",
+        required=False,
+        help=parser_warmpool_help,
+    )
+    args = parser.parse_args()
+
+    set_root_logger(args.debug)
+
+    logger = logging.getLogger("cloudvirtd")
+    logger.info("started cloudvirtd ver. %s", pkg_version)
+
+    try:
+        Daemon(args.socket_path, args.url, args.warm_pool_file).run()
+    except CloudvirtError as exc:
+        logger.error("%s", exc)
+        sys.exit(1)
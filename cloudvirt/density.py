@@ -0,0 +1,130 @@
+import logging
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from .util import RECLAIM_HEADROOM, RECLAIM_MIN_MEM, merge_profile
+
+# a virtio balloon handing the pages the guest frees back to the host and
+# reporting the memory statistics `cloudvirt reclaim' works off of. ksm left
+# at None keeps the qemu default of mergeable memory
+DEFAULT_DENSITY_PROFILE = {
+    "balloon": True,
+    "free_page_reporting": True,
+    "stats_period": 10,
+    "ksm": None,
+}
+
+# MiB, smaller savings are not worth inflating the balloon for
+RECLAIM_MIN_STEP = 128
+
+
+def resolve_density_profile(overrides=None):
+    profile = merge_profile("density_profile", DEFAULT_DENSITY_PROFILE, overrides)
+
+    for key in ["balloon", "free_page_reporting"]:
+        if not isinstance(profile[key], bool):
+            raise ValueError(f"{key} should be a bool")
+
+    if profile["ksm"] is not None and not isinstance(profile["ksm"], bool):
+        raise ValueError("ksm should be a bool")
+
+    if not isinstance(profile["stats_period"], int) or profile["stats_period"] < 0:
+        raise ValueError("stats_period should be an int of seconds, 0 disables it")
+
+    if profile["free_page_reporting"] and not profile["balloon"]:
+        raise ValueError("free_page_reporting requires the balloon")
+
+    return profile
+
+
+def gen_density(domxml_root, domxml_dev, vmspec):
+    # <currentMemory>, the ksm part of <memoryBacking> and the <memballoon>
+    profile = vmspec.density_profile or resolve_density_profile()
+
+    if vmspec.dom_mem_current is not None:
+        domxml_current = ET.Element("currentMemory", {"unit": "M"})
+        domxml_current.text = str(vmspec.dom_mem_current)
+
+        # goes right after <memory>, where libvirt puts it
+        domxml_root.insert(
+            list(domxml_root).index(domxml_root.find("memory")) + 1, domxml_current
+        )
+
+    if profile["ksm"] is False:
+        domxml_backing = domxml_root.find("memoryBacking")
+        if domxml_backing is None:
+            domxml_backing = ET.SubElement(domxml_root, "memoryBacking")
+
+        ET.SubElement(domxml_backing, "nosharepages")
+
+    # libvirt adds a balloon without stats if there is no <memballoon> at all
+    if not profile["balloon"]:
+        ET.SubElement(domxml_dev, "memballoon", {"model": "none"})
+        return
+
+    domxml_balloon = ET.SubElement(
+        domxml_dev,
+        "memballoon",
+        {
+            "model": "virtio",
+            "autodeflate": "on",
+            "freePageReporting": "on" if profile["free_page_reporting"] else "off",
+        },
+    )
+
+    if profile["stats_period"]:
+        ET.SubElement(domxml_balloon, "stats", {"period": str(profile["stats_period"])})
+
+
+class Reclaimer:
+    # shrinks the balloon targets of running guests down to what they use
+    # plus the headroom, off of the statistics of a single bulk call
+    def __init__(self, driver, headroom=RECLAIM_HEADROOM, min_mem=RECLAIM_MIN_MEM):
+        self.driver = driver
+        self.headroom = headroom
+        self.min_mem = min_mem
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def plan(self, dom_names=None):
+        # {dom_name: (current KiB, target KiB)} of the guests worth shrinking
+        targets = {}
+
+        for dom, stats in self.driver.getAllDomainStats(
+            libvirt.VIR_DOMAIN_STATS_BALLOON,
+            libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE,
+        ):
+            dom_name = dom.name()
+            if dom_names is not None and dom_name not in dom_names:
+                continue
+
+            # no stats period or no balloon driver in the guest yet
+            if "balloon.usable" not in stats or not stats.get("balloon.last-update"):
+                self.logger.debug("%s reports no balloon statistics", dom_name)
+                continue
+
+            current = stats["balloon.current"]
+            used = stats["balloon.available"] - stats["balloon.usable"]
+
+            target = max(int(used * (1 + self.headroom)), self.min_mem * 1024)
+            if current - target < RECLAIM_MIN_STEP * 1024:
+                continue
+
+            targets[dom_name] = (current, target)
+
+        return targets
+
+    def apply(self, targets):
+        results = {}
+
+        for dom_name, (_, target) in targets.items():
+            try:
+                self.driver.lookupByName(dom_name).setMemoryFlags(
+                    target, libvirt.VIR_DOMAIN_AFFECT_LIVE
+                )
+                results[dom_name] = None
+            except libvirt.libvirtError as exc:
+                results[dom_name] = str(exc)
+
+        return results
@@ -0,0 +1,110 @@
+import xml.etree.ElementTree as ET
+
+from .util import merge_profile
+
+DISK_CACHE_MODES = ["none", "directsync", "writethrough", "writeback", "unsafe"]
+DISK_IO_MODES = ["native", "io_uring", "threads"]
+DISK_DISCARD_MODES = ["unmap", "ignore"]
+DISK_DETECT_ZEROES_MODES = ["unmap", "on", "off"]
+
+# of the qcow2 overlay, falloc reserves the space for the data as well. there
+# is no full, libvirt only ever asks qemu-img for metadata or falloc
+VOL_PREALLOC_MODES = ["metadata", "falloc"]
+
+# KiB, qemu takes powers of two from 512 bytes to 2 MiB, the sizes are given in
+# KiB so the list starts at 1. subclusters need at least 16 KiB
+VOL_CLUSTER_SIZES = [2**x for x in range(0, 12)]
+VOL_EXTENDED_L2_MIN_CLUSTER_SIZE = 16
+
+# bypass the host page cache with native aio, pass the guest trims down to the
+# overlay and serve the disk from a dedicated iothread with a queue per vcpu.
+# queues left at None follow dom_vcpu
+DEFAULT_DISK_PROFILE = {
+    "cache": "none",
+    "io": "native",
+    "discard": "unmap",
+    "detect_zeroes": "unmap",
+    "iothreads": 1,
+    "queues": None,
+}
+
+
+def resolve_disk_profile(overrides=None):
+    profile = merge_profile("disk_profile", DEFAULT_DISK_PROFILE, overrides)
+
+    for key, modes in [
+        ("cache", DISK_CACHE_MODES),
+        ("io", DISK_IO_MODES),
+        ("discard", DISK_DISCARD_MODES),
+        ("detect_zeroes", DISK_DETECT_ZEROES_MODES),
+    ]:
+        if profile[key] not in modes:
+            raise ValueError(f"{key} should be one of: {', '.join(modes)}")
+
+    for key in ["iothreads", "queues"]:
+        if profile[key] is None and key == "queues":
+            continue
+
+        if not isinstance(profile[key], int) or isinstance(profile[key], bool):
+            raise ValueError(f"{key} should be an int")
+
+    if profile["iothreads"] < 0:
+        raise ValueError("iothreads cannot be negative")
+
+    if profile["queues"] is not None and profile["queues"] < 1:
+        raise ValueError("queues has to be at least 1")
+
+    # qemu refuses native aio on top of the page cache
+    if profile["io"] == "native" and profile["cache"] not in ["none", "directsync"]:
+        raise ValueError("io: native requires cache: none or directsync")
+
+    if profile["detect_zeroes"] == "unmap" and profile["discard"] != "unmap":
+        raise ValueError("detect_zeroes: unmap requires discard: unmap")
+
+    return profile
+
+
+def gen_disk_driver(domxml_root, domxml_dev_disk, vmspec):
+    # <iothreads> of the domain and the <driver> of the root disk
+    profile = vmspec.disk_profile or resolve_disk_profile()
+
+    queues = profile["queues"] or vmspec.dom_vcpu
+    iothreads = profile["iothreads"]
+
+    domxml_driver = ET.SubElement(
+        domxml_dev_disk,
+        "driver",
+        {
+            "name": "qemu",
+            "type": "qcow2",
+            "cache": profile["cache"],
+            "io": profile["io"],
+            "discard": profile["discard"],
+            "detect_zeroes": profile["detect_zeroes"],
+            "queues": str(queues),
+        },
+    )
+
+    if not iothreads:
+        return
+
+    # goes right after <vcpu>, where libvirt puts it
+    domxml_iothreads = ET.Element("iothreads")
+    domxml_iothreads.text = str(iothreads)
+    domxml_root.insert(
+        list(domxml_root).index(domxml_root.find("vcpu")) + 1, domxml_iothreads
+    )
+
+    if iothreads == 1:
+        domxml_driver.attrib["iothread"] = "1"
+        return
+
+    # spread the queues over the iothreads round robin
+    domxml_driver_iothreads = ET.SubElement(domxml_driver, "iothreads")
+    for iothread in range(1, min(iothreads, queues) + 1):
+        domxml_iothread = ET.SubElement(
+            domxml_driver_iothreads, "iothread", {"id": str(iothread)}
+        )
+
+        for queue in range(iothread - 1, queues, iothreads):
+            ET.SubElement(domxml_iothread, "queue", {"id": str(queue)})
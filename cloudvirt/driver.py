@@ -4,94 +4,114 @@ import logging
 import os
 import pwd
 import random
+import re
+import threading
+import time
 import xml.etree.ElementTree as ET
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from fnmatch import fnmatchcase
 from functools import wraps
 
 import libvirt
 
+from .cache import APIDriverCache
 from .cloudinit import CloudInit
+from .cpu import CPUBaseline, gen_cpu
+from .density import gen_density
+from .disk import gen_disk_driver
+from .errors import CloudvirtError, ConflictError, CapacityError, LibvirtError
+from .errors import SpecError
+from .netbatch import NetworkUpdateBatch
+from .nic import gen_iface_driver
+from .placement import Placement, gen_tuning
+from .log import DomainLoggerAdapter
+from .readiness import ReadinessWatcher
+from .util import DEFAULT_JOBS
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+_event_loop_lock = threading.Lock()
+_event_loop_started = threading.Event()
+
+# namespace of the cloudvirt owned <metadata/> element in the domain xml
+METADATA_NS = "https://github.com/gottaeat/cloudvirt"
+ET.register_namespace("cloudvirt", METADATA_NS)
+
+
+def seed_iso_name(dom_name):
+    return f"{dom_name}-cloudinit.iso"
+
+
+def _run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
+
+def start_event_loop(register_impl=None):
+    # one per process, shared by every connection. register_impl replaces the
+    # default implementation and the thread running it, e.g. with the asyncio
+    # one of libvirtaio
+    with _event_loop_lock:
+        if _event_loop_started.is_set():
+            return
+
+        if register_impl:
+            register_impl()
+        else:
+            libvirt.virEventRegisterDefaultImpl()
+            threading.Thread(
+                target=_run_event_loop, name="libvirt-events", daemon=True
+            ).start()
+
+        _event_loop_started.set()
 
 
 class APIDriverVMNuker:
-    def __init__(self, driver, dom_name):
+    def __init__(self, driver, dom_name, net_batch=None):
         self.driver = driver
         self.dom_name = dom_name
 
-        self.logger = logging.getLogger(self.__class__.__name__)
+        # nukers of a batch share one, a lone nuker flushes its own
+        self._own_net_batch = net_batch is None
+        self.net_batch = net_batch or NetworkUpdateBatch(driver)
+
+        self.logger = DomainLoggerAdapter(
+            logging.getLogger(self.__class__.__name__), {"dom_name": dom_name}
+        )
 
         self._dom = None
         self._domxml_root = None
+        self._disks = []
+
+        # (pool, volume) of every volume deleted
+        self.volumes = []
+
+    @property
+    def dom_net(self):
+        return self._domxml_root.findall("devices/interface/source")[0].attrib[
+            "network"
+        ]
 
     def _dom_exists_precheck(self):
         try:
-            self.driver.lookupByName(self.dom_name)
+            self._dom = self.driver.lookupByName(self.dom_name)
         except libvirt.libvirtError:
-            self.logger.error("domain %s does not exist.", self.dom_name)
+            raise SpecError(f"domain {self.dom_name} does not exist.") from None
 
     def _get_dom_xml(self):
         self.logger.info("getting domain XML")
 
-        self._dom = self.driver.lookupByName(self.dom_name)
-
-        dom_xml = self._dom.XMLDesc()
-        domxml_tree = ET.ElementTree(ET.fromstring(dom_xml))
-        self._domxml_root = domxml_tree.getroot()
-
-    def _nuke_dns_entries(self, network, netxml_root):
-        for hostname in netxml_root.findall("dns/host/hostname"):
-            if hostname.text == self.dom_name:
-                self.logger.info("nuking DNS entried")
-
-                dnsupdxml_root = ET.Element("host")
-                ET.SubElement(dnsupdxml_root, "hostname").text = self.dom_name
-                dnsupdxml = ET.tostring(dnsupdxml_root, encoding="unicode")
-
-                network.update(
-                    libvirt.VIR_NETWORK_UPDATE_COMMAND_DELETE,
-                    libvirt.VIR_NETWORK_SECTION_DNS_HOST,
-                    -1,
-                    dnsupdxml,
-                    libvirt.VIR_NETWORK_UPDATE_AFFECT_LIVE
-                    | libvirt.VIR_NETWORK_UPDATE_AFFECT_CONFIG,
-                )
-
-    def _nuke_dhcp_entries(self, network, netxml_root):
-        for res in netxml_root.findall("ip/dhcp/host"):
-            if res.attrib["name"] == self.dom_name:
-                self.logger.info("nuking DHCP entries")
-
-                netupdxml_root = ET.Element("host", {"name": self.dom_name})
-                netupdxml = ET.tostring(netupdxml_root, encoding="unicode")
-
-                network.update(
-                    libvirt.VIR_NETWORK_UPDATE_COMMAND_DELETE,
-                    libvirt.VIR_NETWORK_SECTION_IP_DHCP_HOST,
-                    -1,
-                    netupdxml,
-                    libvirt.VIR_NETWORK_UPDATE_AFFECT_LIVE
-                    | libvirt.VIR_NETWORK_UPDATE_AFFECT_CONFIG,
-                )
+        self._domxml_root = ET.fromstring(self._dom.XMLDesc())
 
     def _nuke_net_entries(self):
-        dom_net = self._domxml_root.findall("devices/interface/source")[0].attrib[
-            "network"
-        ]
-
-        network = self.driver.networkLookupByName(dom_net)
-        network_xml = network.XMLDesc()
-        netxml_tree = ET.ElementTree(ET.fromstring(network_xml))
-        netxml_root = netxml_tree.getroot()
-
-        network_type = netxml_root.find("forward")
-        if "mode" not in network_type.attrib or network_type.attrib["mode"] not in [
-            "route",
-            "nat",
-        ]:
-            return
+        self.net_batch.remove_host(self.dom_net, self.dom_name)
 
-        self._nuke_dns_entries(network, netxml_root)
-        self._nuke_dhcp_entries(network, netxml_root)
+        if self._own_net_batch:
+            err = self.net_batch.flush().get(self.dom_name)
+            if err:
+                raise LibvirtError(f"failed to nuke the DHCP and DNS entries: {err}")
 
     def _nuke_vm(self):
         if self._dom.isActive():
@@ -101,50 +121,90 @@ class APIDriverVMNuker:
         self.logger.info("nuking domain")
         self._dom.undefine()
 
+    def _get_dom_disks(self):
+        # checked before the domain is touched, disks cloudvirt did not create
+        # have no pool to delete them from
+        for source in self._domxml_root.findall("devices/disk/source"):
+            if "pool" not in source.attrib or "volume" not in source.attrib:
+                path = source.get("file") or source.get("dev") or source.get("name")
+                raise SpecError(f"{path} is not a volume of a pool, not nuking it")
+
+            self._disks.append((source.attrib["pool"], source.attrib["volume"]))
+
     def _nuke_volumes(self):
         self.logger.info("nuking associated volumes")
 
-        dom_disks = self._domxml_root.findall("devices/disk/source")
-        for source in enumerate(dom_disks):
-            disk = dom_disks[source[0]].attrib
-            pool = self.driver.storagePoolLookupByName(disk["pool"])
-            vol = pool.storageVolLookupByName(disk["volume"])
-            vol.delete()
+        for pool_name, vol_name in self._disks:
+            pool = self.driver.storagePoolLookupByName(pool_name)
+            pool.storageVolLookupByName(vol_name).delete()
 
-    def nuke(self):
+            self.volumes.append((pool_name, vol_name))
+
+    def prepare(self):
         self.logger.info("nuking VM: %s", self.dom_name)
-        self._dom_exists_precheck()
-        self._get_dom_xml()
-        self._nuke_net_entries()
-        self._nuke_vm()
-        self._nuke_volumes()
+
+        with self.driver.span("precheck", dom=self.dom_name):
+            self._dom_exists_precheck()
+            self._get_dom_xml()
+            self._get_dom_disks()
+
+        with self.driver.span("net", dom=self.dom_name):
+            self._nuke_net_entries()
+
+    def finish(self):
+        with self.driver.span("undefine", dom=self.dom_name):
+            self._nuke_vm()
+
+        with self.driver.span("volume", dom=self.dom_name):
+            self._nuke_volumes()
+
+    def nuke(self):
+        self.prepare()
+        self.finish()
 
 
 class APIDriverVMCreator:
-    def __init__(self, driver, vmspec):
+    def __init__(self, driver, vmspec, net_batch=None):
         self.driver = driver
         self.vmspec = vmspec
 
-        self.logger = logging.getLogger(self.__class__.__name__)
+        # creators of a fleet share one, a lone creator flushes its own
+        self._own_net_batch = net_batch is None
+        self.net_batch = net_batch or NetworkUpdateBatch(driver)
+
+        self.logger = DomainLoggerAdapter(
+            logging.getLogger(self.__class__.__name__),
+            {"dom_name": vmspec.dom_name},
+        )
 
         self._pool_path = None
         self._pool = None
+        self._base_image = None
         self._cloudinit_iso = None
+        self._defined_at = None
+
+        # seconds from define to each boot phase, filled in by --wait
+        self.timings = {}
         self._network = None
+        self._net_snapshot = None
+
+        # journal entry of the create and the phases done by an earlier run
+        self._entry = None
+        self._resumed = []
+        self._net_queued = False
+
+        # the address picked or claimed by the prechecks, held by the dhcp
+        # host entry once that is in place
+        self._ip_claimed = False
+        self._net_applied = False
 
     def _genmac(self):
         self.logger.info("generating mac address")
 
-        i, vmmac = 0, "52:54:"
-        while i < 4:
-            col = hex(random.randint(0, 255)).lstrip("0x")
-            if len(col) < 2:
-                col = f"{col}0"
-            vmmac += f"{col}:"
+        # zero padded, the way libvirt reports it back in the leases
+        octets = [f"{random.randint(0, 255):02x}" for _ in range(4)]
 
-            i += 1
-
-        return str(vmmac.rstrip(":"))
+        return ":".join(["52", "54"] + octets)
 
     def _dom_exists_precheck(self):
         try:
@@ -152,23 +212,27 @@ class APIDriverVMCreator:
         except libvirt.libvirtError:
             pass
         else:
-            self.logger.error("domain %s already exists", self.vmspec.dom_name)
+            raise ConflictError(f"domain {self.vmspec.dom_name} already exists")
 
     def _network_precheck(self):
         self.logger.info("starting network pre-checks")
 
         needs_net_update = False
-        network = self.driver.networkLookupByName(self.vmspec.net)
-        self._network = network
+        self._net_snapshot = self.driver.cache.network(self.vmspec.net)
+        self._network = self._net_snapshot.network
 
-        network_xml = network.XMLDesc()
-        netxml_tree = ET.ElementTree(ET.fromstring(network_xml))
-        netxml_root = netxml_tree.getroot()
+        netxml_root = self._net_snapshot.xml_root
 
         network_type = netxml_root.find("forward")
 
         if network_type is None:
-            self.logger.error("%s does not have a `forward' element.", self.vmspec.net)
+            raise SpecError(f"{self.vmspec.net} does not have a `forward' element.")
+
+        if self.vmspec.ip == "auto" and network_type.attrib.get("mode") not in [
+            "route",
+            "nat",
+        ]:
+            raise SpecError("ip: auto is only supported on route and nat networks")
 
         if "mode" not in network_type.attrib or network_type.attrib["mode"] not in [
             "route",
@@ -177,10 +241,10 @@ class APIDriverVMCreator:
             self.logger.info("prechecks are not used for the route and nat modes")
 
             if self.vmspec.gateway is None:
-                self.logger.error("driver cannot derive the gateway")
+                raise SpecError("driver cannot derive the gateway")
 
             if self.vmspec.bridge_pfxlen is None:
-                self.logger.error("ip needs to be in CIDR notation")
+                raise SpecError("ip needs to be in CIDR notation")
 
             return needs_net_update
 
@@ -188,75 +252,97 @@ class APIDriverVMCreator:
         if self.vmspec.ip is not None:
             needs_net_update = True
 
-            # check if already leased or reserved
-            active_leases = []
-            for lease in network.DHCPLeases():
-                active_leases.append(lease["ipaddr"])
-
-            if self.vmspec.ip in active_leases:
-                self.logger.error(
-                    "%s is already leased in %s", self.vmspec.ip, self.vmspec.net
-                )
-
-            reserved_leases = []
-            for lease in netxml_root.findall("ip/dhcp/host"):
-                reserved_leases.append(lease.attrib["ip"])
-
-            if self.vmspec.ip in reserved_leases:
-                self.logger.error(
-                    "%s is already reserved in %s", self.vmspec.ip, self.vmspec.net
-                )
+            net_ip = netxml_root.find("ip")
+            if net_ip is None:
+                raise SpecError(f"{self.vmspec.net} does not have an `ip' element.")
 
-            # check if within the subnet
-            net_ip = netxml_root.findall("ip")[0].attrib
-
-            net_ip_addr = net_ip["address"]
-            net_ip_mask = net_ip["netmask"]
+            net_ip = net_ip.attrib
 
             net_net = ipaddress.IPv4Network(
-                f"{net_ip_addr}/{net_ip_mask}", strict=False
+                f"{net_ip['address']}/{net_ip['netmask']}", strict=False
             )
 
             self.vmspec.gateway = self.vmspec.gateway or net_ip["address"]
             self.vmspec.bridge_pfxlen = net_net.prefixlen
 
-            if ipaddress.ip_address(self.vmspec.ip) not in ipaddress.ip_network(
-                net_net
+            allocator = self._net_snapshot.ip_allocator
+
+            if self.vmspec.ip == "auto":
+                self.vmspec.ip = allocator.allocate()
+
+                if self.vmspec.ip is None:
+                    raise CapacityError(
+                        f"no free addresses left in the DHCP range of {self.vmspec.net}"
+                    )
+
+                self._ip_claimed = True
+                self.logger.info("allocated %s", self.vmspec.ip)
+
+                return needs_net_update
+
+            ip = int(ipaddress.IPv4Address(self.vmspec.ip))
+
+            # check if within the subnet
+            if not (
+                int(net_net.network_address) <= ip <= int(net_net.broadcast_address)
             ):
-                self.logger.error(
-                    "% is not within %s: %s", self.vmspec.ip, self.vmspec.net, net_net
+                raise SpecError(
+                    f"{self.vmspec.ip} is not within {self.vmspec.net}: {net_net}"
                 )
 
-            # check if within the dhcp range
-            net_dhcp = netxml_root.findall("ip/dhcp/range")[0].attrib
-            net_dhcp_start = int(
-                ipaddress.ip_address(net_dhcp["start"]).packed.hex(), 16
-            )
-            net_dhcp_end = int(ipaddress.ip_address(net_dhcp["end"]).packed.hex(), 16)
-
-            dhcp_range = []
-            for ip in range(net_dhcp_start, net_dhcp_end):
-                dhcp_range.append(ipaddress.ip_address(ip).exploded)
-
-            if self.vmspec.ip not in dhcp_range:
-                self.logger.error(
-                    "%s is not within the DHCP range of %s. (%s - %s)",
-                    self.vmspec.ip,
-                    self.vmspec.net,
-                    net_dhcp["start"],
-                    net_dhcp["end"],
-                )
+            # within the dhcp range and neither leased, reserved nor claimed
+            allocator.take(self.vmspec.ip, self.vmspec.net)
+
+            self._ip_claimed = True
 
             return needs_net_update
 
+        return needs_net_update
+
     def _gen_cloudinit_iso(self):
-        self._cloudinit_iso = f"{self.vmspec.dom_name}-cloudinit.iso"
+        self._cloudinit_iso = seed_iso_name(self.vmspec.dom_name)
 
         clinit = CloudInit(self.vmspec)
-        clinit.iso_path = f"{self._pool_path}/{self._cloudinit_iso}"
-        clinit.mkiso()
+        iso = clinit.mkiso()
+
+        self.logger.info("uploading cloud-init ISO")
 
-        self._pool.refresh()
+        # creating the volume through the pool and streaming into it saves a
+        # pool.refresh(), which rescans and reprobes every volume in the pool
+        volxml_root = ET.Element("volume")
+        ET.SubElement(volxml_root, "name").text = self._cloudinit_iso
+        ET.SubElement(volxml_root, "capacity", {"unit": "bytes"}).text = str(len(iso))
+        volxml_target = ET.SubElement(volxml_root, "target")
+        ET.SubElement(volxml_target, "format", {"type": "raw"})
+        volxml = ET.tostring(volxml_root, encoding="unicode")
+
+        vol = self._pool.createXML(volxml, 0)
+
+        stream = self.driver.newStream(0)
+        try:
+            vol.upload(stream, 0, len(iso), 0)
+
+            view, offset = memoryview(iso), 0
+            while offset < len(iso):
+                offset += stream.send(view[offset : offset + STREAM_CHUNK_SIZE])
+
+            stream.finish()
+        except libvirt.libvirtError:
+            stream.abort()
+            vol.delete()
+            raise
+
+    def _base_image_precheck(self, pool_snapshot):
+        self._base_image = self.driver.cache.base_image(
+            pool_snapshot, self.vmspec.base_image
+        )
+
+        if self.vmspec.vol_size * 1024**3 < self._base_image.capacity:
+            raise SpecError(
+                f"vol_size of {self.vmspec.vol_size}G is smaller than the "
+                f"{self._base_image.capacity / 1024**3:.2f}G virtual size of "
+                f"{self.vmspec.base_image}"
+            )
 
     def _gen_volume(self):
         self.logger.info("generating volumes")
@@ -266,20 +352,47 @@ class APIDriverVMCreator:
         ET.SubElement(volxml_root, "capacity", {"unit": "G"}).text = str(
             self.vmspec.vol_size
         )
+
+        # libvirt fallocates the whole overlay if the allocation matches the
+        # capacity, and only writes the metadata otherwise
+        flags = 0
+        if self.vmspec.vol_prealloc is not None:
+            flags |= libvirt.VIR_STORAGE_VOL_CREATE_PREALLOC_METADATA
+
+        if self.vmspec.vol_prealloc == "falloc":
+            ET.SubElement(volxml_root, "allocation", {"unit": "G"}).text = str(
+                self.vmspec.vol_size
+            )
+
         volxml_target = ET.SubElement(volxml_root, "target")
         ET.SubElement(volxml_target, "path").text = (
             f"{self._pool_path}/{self.vmspec.vol_name}"
         )
         ET.SubElement(volxml_target, "format", {"type": "qcow2"})
 
+        if self.vmspec.vol_cluster_size is not None:
+            ET.SubElement(volxml_target, "clusterSize", {"unit": "KiB"}).text = str(
+                self.vmspec.vol_cluster_size
+            )
+
+        if self.vmspec.vol_extended_l2:
+            ET.SubElement(ET.SubElement(volxml_target, "features"), "extended_l2")
+
         volxml_backingstore = ET.SubElement(volxml_root, "backingStore")
-        ET.SubElement(volxml_backingstore, "path").text = (
-            f"{self._pool_path}/{self.vmspec.base_image}"
-        )
-        ET.SubElement(volxml_backingstore, "format", {"type": "qcow2"})
+        ET.SubElement(volxml_backingstore, "path").text = self._base_image.path
+        ET.SubElement(volxml_backingstore, "format", {"type": self._base_image.format})
         volxml = ET.tostring(volxml_root, encoding="unicode")
 
-        self._pool.createXML(volxml, 0)
+        self._pool.createXML(volxml, flags)
+
+    def _gen_labels(self):
+        domxml_meta = ET.Element(f"{{{METADATA_NS}}}cloudvirt")
+        for key, value in self.vmspec.labels.items():
+            ET.SubElement(
+                domxml_meta, f"{{{METADATA_NS}}}label", {"key": key, "value": value}
+            )
+
+        return domxml_meta
 
     def _gen_dom(self):
         self.logger.info("generating the domain")
@@ -287,6 +400,10 @@ class APIDriverVMCreator:
         domxml_root = ET.Element("domain", {"type": "kvm"})
 
         ET.SubElement(domxml_root, "name").text = self.vmspec.dom_name
+
+        if self.vmspec.labels:
+            ET.SubElement(domxml_root, "metadata").append(self._gen_labels())
+
         ET.SubElement(domxml_root, "memory", {"unit": "M"}).text = str(
             self.vmspec.dom_mem
         )
@@ -298,29 +415,25 @@ class APIDriverVMCreator:
         )
         ET.SubElement(domxml_os, "boot", {"dev": "hd"})
 
-        domxml_cpu = ET.SubElement(
-            domxml_root, "cpu", {"mode": "custom", "match": "exact", "check": "partial"}
-        )
-        ET.SubElement(domxml_cpu, "model", {"fallback": "forbid"}).text = "qemu64"
-        for feat in [
-            "cx16",
-            "popcnt",
-            "sse4.1",
-            "sse4.2",
-            "ssse3",
-            "avx",
-            "hypervisor",
-            "lahf_lm",
-        ]:
-            ET.SubElement(domxml_cpu, "feature", {"policy": "require", "name": feat})
-        ET.SubElement(domxml_cpu, "feature", {"policy": "disable", "name": "svm"})
+        baseline = None
+        if self.vmspec.cpu_mode == "baseline":
+            baseline = self.driver.cpu_baseline.get(self.vmspec.cpu_baseline_hosts)
+
+        domxml_root.append(gen_cpu(self.vmspec.cpu_mode, baseline))
+
+        if self.vmspec.numa_node is not None:
+            self.logger.info(
+                "placed on NUMA node %s", self.driver.placement.place(self.vmspec)
+            )
+
+        gen_tuning(domxml_root, self.vmspec)
 
         domxml_dev = ET.SubElement(domxml_root, "devices")
 
         domxml_dev_disk = ET.SubElement(
             domxml_dev, "disk", {"type": "volume", "device": "disk"}
         )
-        ET.SubElement(domxml_dev_disk, "driver", {"name": "qemu", "type": "qcow2"})
+        gen_disk_driver(domxml_root, domxml_dev_disk, self.vmspec)
         ET.SubElement(
             domxml_dev_disk,
             "source",
@@ -333,11 +446,15 @@ class APIDriverVMCreator:
             domxml_dev, "disk", {"type": "volume", "device": "cdrom"}
         )
         ET.SubElement(domxml_dev_iso, "driver", {"name": "qemu", "type": "raw"})
-        ET.SubElement(
-            domxml_dev_iso,
-            "source",
-            {"pool": self.vmspec.vol_pool, "volume": self._cloudinit_iso},
-        )
+
+        # warm pool vms are defined with an empty drive, the seed is inserted
+        # once they get claimed
+        if self._cloudinit_iso:
+            ET.SubElement(
+                domxml_dev_iso,
+                "source",
+                {"pool": self.vmspec.vol_pool, "volume": self._cloudinit_iso},
+            )
         ET.SubElement(domxml_dev_iso, "target", {"dev": "sda", "bus": "sata"})
         ET.SubElement(domxml_dev_iso, "readonly")
 
@@ -345,62 +462,53 @@ class APIDriverVMCreator:
         ET.SubElement(domxml_dev_iface, "source", {"network": self.vmspec.net})
         ET.SubElement(domxml_dev_iface, "mac", {"address": self.vmspec.mac_addr})
         ET.SubElement(domxml_dev_iface, "model", {"type": "virtio"})
+        gen_iface_driver(domxml_dev_iface, self.vmspec)
 
         ET.SubElement(domxml_dev, "serial", {"type": "pty"})
 
+        if self.vmspec.guest_agent:
+            domxml_dev_agent = ET.SubElement(domxml_dev, "channel", {"type": "unix"})
+            ET.SubElement(
+                domxml_dev_agent,
+                "target",
+                {"type": "virtio", "name": "org.qemu.guest_agent.0"},
+            )
+
+        gen_density(domxml_root, domxml_dev, self.vmspec)
+
         domxml = ET.tostring(domxml_root, encoding="unicode")
 
         self.driver.defineXML(domxml)
+        self._defined_at = time.monotonic()
 
-    def _update_dhcp(self):
-        self.logger.info("updating DHCP")
+    def _update_net(self):
+        self.logger.info("queueing DHCP and DNS updates")
 
-        netupdxml_root = ET.Element(
-            "host",
-            {
-                "mac": self.vmspec.mac_addr,
-                "name": self.vmspec.dom_name,
-                "ip": self.vmspec.ip,
-            },
-        )
-        netupdxml = ET.tostring(netupdxml_root, encoding="unicode")
-
-        # virNetworkUpdate
-        # (virNetworkPtr network,
-        #       unsigned int command,
-        #       unsigned int section,
-        #       int parentIndex,
-        #       const char * xml,
-        #       unsigned int flags)
-        #
-        # parentIndex:
-        # which parent element, if there are multiple parents of the same type
-        # (e.g. which <ip> element when modifying a <dhcp>/<host> element), or
-        # "-1" for "don't care" or "automatically find appropriate one".
-        self._network.update(
-            libvirt.VIR_NETWORK_UPDATE_COMMAND_ADD_FIRST,
-            libvirt.VIR_NETWORK_SECTION_IP_DHCP_HOST,
-            -1,
-            netupdxml,
-            libvirt.VIR_NETWORK_UPDATE_AFFECT_LIVE
-            | libvirt.VIR_NETWORK_UPDATE_AFFECT_CONFIG,
+        self.net_batch.add_host(
+            self.vmspec.net, self.vmspec.dom_name, self.vmspec.mac_addr, self.vmspec.ip
         )
+        self._net_queued = True
 
-    def _update_dns(self):
-        self.logger.info("updating DNS")
+        if self._own_net_batch:
+            err = self.net_batch.flush().get(self.vmspec.dom_name)
+            if err:
+                raise LibvirtError(f"failed to update DHCP and DNS: {err}")
 
-        dnsupdxml_root = ET.Element("host", {"ip": self.vmspec.ip})
-        ET.SubElement(dnsupdxml_root, "hostname").text = self.vmspec.dom_name
-        dnsupdxml = ET.tostring(dnsupdxml_root, encoding="unicode")
+            self.net_flushed()
 
-        self._network.update(
-            libvirt.VIR_NETWORK_UPDATE_COMMAND_ADD_FIRST,
-            libvirt.VIR_NETWORK_SECTION_DNS_HOST,
-            -1,
-            dnsupdxml,
-            libvirt.VIR_NETWORK_UPDATE_AFFECT_LIVE
-            | libvirt.VIR_NETWORK_UPDATE_AFFECT_CONFIG,
-        )
+    def net_flushed(self):
+        # the updates queued into the batch of a fleet went through
+        if self._net_queued:
+            self._net_applied = True
+            self._done("net")
+
+    def release(self):
+        # what a create holds on to until it is done or has failed
+        self.driver.placement.release(self.vmspec.dom_name)
+
+        if self._ip_claimed and not self._net_applied:
+            self._net_snapshot.ip_allocator.release(self.vmspec.ip)
+            self._ip_claimed = False
 
     def _start_dom(self):
         self.logger.info("starting domain")
@@ -408,32 +516,187 @@ class APIDriverVMCreator:
         domstart = self.driver.lookupByName(self.vmspec.dom_name)
         domstart.create()
 
-    def create(self):
+        return domstart
+
+    def _has_lease(self, dom):
+        try:
+            ifaces = dom.interfaceAddresses(
+                libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_LEASE
+            )
+        except libvirt.libvirtError:
+            return False
+
+        for iface in ifaces.values():
+            if iface["hwaddr"].lower() == self.vmspec.mac_addr and iface["addrs"]:
+                self.logger.info("leased %s", iface["addrs"][0]["addr"])
+                return True
+
+        return False
+
+    @staticmethod
+    def _agent_responds(dom):
+        try:
+            dom.interfaceAddresses(libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_AGENT)
+        except libvirt.libvirtError:
+            return False
+
+        return True
+
+    def _wait_ready(self, dom, waiter, timeout):
+        self.logger.info("waiting up to %ss for the guest to come up", timeout)
+
+        deadline = time.monotonic() + timeout
+
+        # create() only returns once the domain runs, do not wait on an event
+        # that may have been dispatched to a loop that is not running
+        if not waiter.started.is_set() and dom.isActive():
+            waiter.mark("started")
+            waiter.started.set()
+
+        if not waiter.wait_started(deadline):
+            raise LibvirtError(f"domain did not start within {timeout}s")
+
+        # only guests without a static address configured through cloud-init
+        # ask the dnsmasq of the network for a lease
+        if self.vmspec.ip is None and self._net_snapshot.forward_mode in [
+            "route",
+            "nat",
+        ]:
+            if not waiter.backoff(lambda: self._has_lease(dom), deadline):
+                raise LibvirtError("guest did not acquire a DHCP lease")
+
+            waiter.mark("lease")
+
+        if self.vmspec.guest_agent:
+            if not waiter.wait_agent(deadline) or not waiter.backoff(
+                lambda: self._agent_responds(dom), deadline
+            ):
+                raise LibvirtError("guest agent did not respond")
+
+            waiter.mark("agent")
+
+        self.timings = dict(waiter.timings)
+        self.logger.info(
+            "ready, %s",
+            ", ".join(f"{k} after {v:.2f}s" for k, v in self.timings.items()),
+        )
+
+    def _resume(self):
+        # phases an earlier failed create of the very same vmspec got through
+        journal = self.driver.journal
+        if journal is None:
+            return []
+
+        entry = self._entry = journal.resume(
+            self.driver, self.vmspec, seed_iso_name(self.vmspec.dom_name)
+        )
+        if not entry["phases"]:
+            return []
+
+        self.logger.info("resuming the failed create after %s", entry["phases"][-1])
+
+        # what the seed iso and the domain were generated with
+        self.vmspec.mac_addr = entry["mac_addr"]
+        self.vmspec.ip = entry["ip"] or self.vmspec.ip
+        self._cloudinit_iso = entry["iso"]
+
+        return entry["phases"]
+
+    def _done(self, phase):
+        if self._entry is not None:
+            self.driver.journal.record(self._entry, phase, self.vmspec)
+
+    def prepare(self):
         self.logger.info("creating VM: %s", self.vmspec.dom_name)
 
-        self._dom_exists_precheck()
-        needs_net_update = self._network_precheck()
+        dom_name = self.vmspec.dom_name
+        done = self._resumed = self._resume()
+
+        with self.driver.span("precheck", dom=dom_name):
+            if "define" not in done:
+                self._dom_exists_precheck()
+
+            # already in the dhcp/dns hosts of the network
+            if "net" in done:
+                self._net_snapshot = self.driver.cache.network(self.vmspec.net)
+                self._network = self._net_snapshot.network
+                needs_net_update = False
+            else:
+                needs_net_update = self._network_precheck()
+
+            # gen mac
+            self.vmspec.mac_addr = self.vmspec.mac_addr or self._genmac()
+
+            # get _pool_path
+            pool_snapshot = self.driver.cache.pool(self.vmspec.vol_pool)
+            self._pool = pool_snapshot.pool
+            self._pool_path = pool_snapshot.path
+            self._base_image_precheck(pool_snapshot)
 
-        # gen mac
-        self.vmspec.mac_addr = self._genmac()
+        if "iso" not in done:
+            with self.driver.span("iso", dom=dom_name):
+                self._gen_cloudinit_iso()
 
-        # get _pool_path
-        self._pool = self.driver.storagePoolLookupByName(self.vmspec.vol_pool)
+            self._done("iso")
 
-        pool_xml = self._pool.XMLDesc()
-        poolxml_tree = ET.ElementTree(ET.fromstring(pool_xml))
-        poolxml_root = poolxml_tree.getroot()
+        if "volume" not in done:
+            with self.driver.span("volume", dom=dom_name):
+                self._gen_volume()
 
-        self._pool_path = poolxml_root.findall("target/path")[0].text
-        self._gen_cloudinit_iso()
-        self._gen_volume()
-        self._gen_dom()
+            self._done("volume")
+
+        if "define" not in done:
+            with self.driver.span("define", dom=dom_name):
+                self._gen_dom()
+
+            self._done("define")
 
         if needs_net_update:
-            self._update_dhcp()
-            self._update_dns()
+            with self.driver.span("net", dom=dom_name):
+                self._update_net()
+
+    def _start_once(self):
+        if "start" in self._resumed:
+            self.logger.info("domain got started by the failed create")
+            return self.driver.lookupByName(self.vmspec.dom_name)
+
+        with self.driver.span("start", dom=self.vmspec.dom_name):
+            dom = self._start_dom()
+
+        self._done("start")
+
+        return dom
+
+    def start(self, wait=None):
+        # the memory of a started vm shows up in the free memory of its node
+        try:
+            if wait is None:
+                self._start_once()
+            else:
+                readiness = self.driver.readiness
+                waiter = readiness.watch(
+                    self.vmspec.dom_name, self._defined_at or time.monotonic()
+                )
 
-        self._start_dom()
+                try:
+                    dom = self._start_once()
+
+                    with self.driver.span("wait", dom=self.vmspec.dom_name):
+                        self._wait_ready(dom, waiter, wait)
+                finally:
+                    readiness.unwatch(self.vmspec.dom_name)
+
+            if self._entry is not None:
+                self.driver.journal.forget(self.vmspec.dom_name)
+        finally:
+            self.driver.placement.release(self.vmspec.dom_name)
+
+    def create(self, wait=None):
+        try:
+            self.prepare()
+            self.start(wait)
+        finally:
+            self.release()
 
 
 class APIDriver:
@@ -445,28 +708,72 @@ class APIDriver:
         self.conn = None
         self._libvirt_gid = None
 
+        self.cache = APIDriverCache(self)
+        self.readiness = ReadinessWatcher(self)
+        self.cpu_baseline = CPUBaseline(self)
+        self.placement = Placement(self)
+
+        # set to a warmpool.WarmPool to have matching vms claimed from it
+        self.warm_pool = None
+
+        # set to a trace.Tracer to record the phases and the libvirt calls
+        self.tracer = None
+
+        # set to a journal.CreateJournal to have failed creates resumed or
+        # rolled back
+        self.journal = None
+
+        # proxies of the connection methods, by name
+        self._proxies = {}
+
     def __getattribute__(self, name):
         try:
-            attr = object.__getattribute__(self, name)
-
-            return attr
+            return object.__getattribute__(self, name)
         except AttributeError:
             pass
 
+        proxies = object.__getattribute__(self, "_proxies")
+        if name in proxies:
+            return proxies[name]
+
         attr = self.conn.__getattribute__(name)
-        if hasattr(attr, "__call__"):
+        if not hasattr(attr, "__call__"):
+            return attr
+
+        proxies[name] = self._proxy(name, attr)
+
+        return proxies[name]
+
+    def _proxy(self, name, attr):
+        # built once per method, the method is looked up on whatever
+        # connection is open at call time
+        @wraps(attr)
+        def newfunc(*args, **kwargs):
+            func = getattr(self.conn, name)
+            tracer = self.tracer
+
+            self.logger.debug("before calling %s", name)
+
+            if tracer is None:
+                result = func(*args, **kwargs)
+            else:
+                start = time.perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    tracer.add(name, "libvirt", start, time.perf_counter())
 
-            @wraps(attr)
-            def newfunc(*args, **kwargs):
-                self.logger.debug("before calling %s", attr.__name__)
-                result = attr(*args, **kwargs)
-                self.logger.debug("done calling %s", attr.__name__)
+            self.logger.debug("done calling %s", name)
 
-                return result
+            return result
 
-            return newfunc
+        return newfunc
 
-        return attr
+    def span(self, name, **args):
+        if self.tracer is None:
+            return nullcontext()
+
+        return self.tracer.span(name, **args)
 
     def _check_perms(self):
         uid = os.getuid()
@@ -479,23 +786,189 @@ class APIDriver:
             try:
                 libvirt_gid = grp.getgrnam("libvirt").gr_gid
             except KeyError:
-                self.logger.exception("libVirt access group does not exist")
+                raise LibvirtError("libVirt access group does not exist") from None
 
         if libvirt_gid not in usergroups:
-            err_msg = f"{user.pw_name} is not a member of the libVirt access"
-            err_msg += "group. cannot call qemu:///system."
+            err_msg = f"{user.pw_name} is not a member of the libVirt access "
+            err_msg += f"group. cannot call {self.url}."
 
-            self.logger.error("%s", err_msg)
+            raise LibvirtError(err_msg)
 
         self._libvirt_gid = libvirt_gid
 
+    def run_many(self, func, items, jobs):
+        # the libvirt connection is thread safe and the calls release the GIL,
+        # so the workers share it and a batch takes as long as its slowest item
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(items)))) as pool:
+            futures = {pool.submit(func, item): key for key, item in items.items()}
+
+            for future in as_completed(futures):
+                key = futures[future]
+
+                try:
+                    future.result()
+                except (CloudvirtError, libvirt.libvirtError) as exc:
+                    results[key] = str(exc)
+                except Exception as exc:
+                    # a bug, kept from taking the results of the rest of the
+                    # batch with it but logged with its traceback
+                    self.logger.exception("%s: unexpected error", key)
+                    results[key] = f"{exc.__class__.__name__}: {exc}"
+                else:
+                    results[key] = None
+
+        # keep the input order for the summary
+        return {key: results[key] for key in items}
+
+    def list_domains(self):
+        domains = []
+
+        for dom in self.listAllDomains(0):
+            domains.append({"name": dom.name(), "active": bool(dom.isActive())})
+
+        return sorted(domains, key=lambda x: x["name"])
+
+    def select_domains(self, patterns, regex=False, labels=None):
+        labels = labels or {}
+        selected = []
+
+        for dom in self.listAllDomains(0):
+            dom_name = dom.name()
+
+            if patterns:
+                if regex:
+                    matched = any(re.fullmatch(pat, dom_name) for pat in patterns)
+                else:
+                    matched = any(fnmatchcase(dom_name, pat) for pat in patterns)
+
+                if not matched:
+                    continue
+
+            if labels:
+                try:
+                    metadata = dom.metadata(
+                        libvirt.VIR_DOMAIN_METADATA_ELEMENT, METADATA_NS
+                    )
+                except libvirt.libvirtError:
+                    # not created by cloudvirt or created without labels
+                    continue
+
+                dom_labels = {
+                    label.attrib["key"]: label.attrib["value"]
+                    for label in ET.fromstring(metadata).findall(
+                        f"{{{METADATA_NS}}}label"
+                    )
+                }
+
+                if any(dom_labels.get(k) != v for k, v in labels.items()):
+                    continue
+
+            selected.append(dom_name)
+
+        return sorted(selected)
+
     def nuke(self, dom_name):
         nuker = APIDriverVMNuker(self, dom_name)
         nuker.nuke()
 
-    def create(self, vmspec):
-        creator = APIDriverVMCreator(self, vmspec)
-        creator.create()
+    def flush_net_batch(self, net_batch, results):
+        with self.span("net_flush"):
+            errors = net_batch.flush()
+
+        for dom_name, err in errors.items():
+            if err and results.get(dom_name) is None:
+                results[dom_name] = err
+
+    def nuke_many(self, dom_names, jobs=DEFAULT_JOBS, net_update="live", volumes=None):
+        # volumes: filled with the (pool, volume) pairs every nuke deleted
+        net_batch = NetworkUpdateBatch(self, net_update)
+        nukers = {
+            dom_name: APIDriverVMNuker(self, dom_name, net_batch)
+            for dom_name in dom_names
+        }
+
+        results = self.run_many(lambda nuker: nuker.prepare(), nukers, jobs)
+
+        # dhcp/dns entries of every domain are removed in one pass per network
+        self.flush_net_batch(net_batch, results)
+
+        prepared = {k: v for k, v in nukers.items() if results[k] is None}
+        results.update(self.run_many(lambda nuker: nuker.finish(), prepared, jobs))
+
+        if volumes is not None:
+            for dom_name, nuker in prepared.items():
+                volumes[dom_name] = nuker.volumes
+
+        return results
+
+    def rollback_many(self, dom_names, jobs=DEFAULT_JOBS, net_update="live"):
+        return self.journal.rollback_many(self, dom_names, jobs, net_update)
+
+    def _new_creator(self, vmspec, net_batch=None):
+        # an earlier failed create under the same name is left to a regular
+        # creator to resume or undo
+        journaled = self.journal is not None and self.journal.load(vmspec.dom_name)
+
+        if self.warm_pool is not None and not journaled:
+            claimer = self.warm_pool.claimer(vmspec, net_batch)
+            if claimer is not None:
+                return claimer
+
+        return APIDriverVMCreator(self, vmspec, net_batch)
+
+    def create(self, vmspec, wait=None):
+        creator = self._new_creator(vmspec)
+        creator.create(wait)
+
+        return creator.timings
+
+    def create_many(
+        self,
+        vmspecs,
+        jobs=DEFAULT_JOBS,
+        net_update="live",
+        *,
+        wait=None,
+        timings=None,
+        rollback=False,
+    ):
+        # wait: seconds to wait for each guest to come up, timings: filled
+        # with the boot timings of every vm that got started, rollback: undo
+        # the failed ones instead of keeping them journaled for the next run
+        net_batch = NetworkUpdateBatch(self, net_update)
+        creators = {
+            vmspec.dom_name: self._new_creator(vmspec, net_batch) for vmspec in vmspecs
+        }
+
+        results = self.run_many(lambda creator: creator.prepare(), creators, jobs)
+
+        # dhcp/dns entries of the whole fleet are applied in one pass per
+        # network before any of the vms boots
+        self.flush_net_batch(net_batch, results)
+
+        prepared = {k: v for k, v in creators.items() if results[k] is None}
+        for dom_name, creator in creators.items():
+            if dom_name not in prepared:
+                creator.release()
+
+        for creator in prepared.values():
+            creator.net_flushed()
+
+        results.update(
+            self.run_many(lambda creator: creator.start(wait), prepared, jobs)
+        )
+
+        if rollback and self.journal is not None:
+            self.journal.rollback_failed(self, results, jobs, net_update)
+
+        if timings is not None:
+            for dom_name, creator in prepared.items():
+                if creator.timings:
+                    timings[dom_name] = creator.timings
+
+        return results
 
     @staticmethod
     def _libvirt_callback(userdata, err):
@@ -508,6 +981,19 @@ class APIDriver:
         # message for some reason, hijack the handler instead
         libvirt.registerErrorHandler(f=self._libvirt_callback, ctx=None)
 
-        self.logger.info("connecting to the libVirt API")
+        # events are only delivered if an event loop implementation was
+        # registered before the connection got opened
+        start_event_loop()
+
+        self.logger.info("connecting to the libVirt API at %s", self.url)
+
+        self.conn = libvirt.open(self.url)
+
+        self.cache.register_events()
+
+    def close(self):
+        self.readiness.deregister_events()
+        self.cache.deregister_events()
+        self.cache.clear()
 
-        self.conn = libvirt.open("qemu:///system")
+        self.conn.close()
@@ -0,0 +1,28 @@
+class CloudvirtError(Exception):
+    # everything cloudvirt fails on by design, the message is what ends up in
+    # the summary of a batch or in the response of cloudvirtd. only the cli
+    # and the daemon entry points turn these into an exit
+    pass
+
+
+class SpecError(CloudvirtError):
+    # the vmspec, userspec, warm pool or arguments are invalid or name
+    # something that does not exist, retrying without changing them is futile
+    pass
+
+
+class ConflictError(CloudvirtError):
+    # clashes with what already exists: a domain, a volume or a claimed,
+    # leased or reserved address
+    pass
+
+
+class CapacityError(CloudvirtError):
+    # valid, but does not fit in what is left of the host, the pool or the
+    # DHCP range
+    pass
+
+
+class LibvirtError(CloudvirtError):
+    # libvirt, the host or the guest did not do what was asked of it
+    pass
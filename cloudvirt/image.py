@@ -0,0 +1,215 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from .driver import STREAM_CHUNK_SIZE
+from .errors import CloudvirtError, ConflictError, SpecError
+from .util import cache_dir, replace_file
+
+# base images are only ever read through the overlays, so they are stored
+# uncompressed and with the largest cluster size qemu allows, which keeps the
+# l2 tables of a whole image in a handful of clusters
+IMAGE_CLUSTER_SIZE = "2M"
+IMAGE_CONVERT_OPTS = f"cluster_size={IMAGE_CLUSTER_SIZE},compat=1.1"
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as image_file:
+        while chunk := image_file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def qemu_img(*args):
+    # raises FileNotFoundError without qemu-img, CalledProcessError on failure
+    if shutil.which("qemu-img") is None:
+        raise FileNotFoundError("qemu-img is not installed")
+
+    return subprocess.run(
+        ["qemu-img", *args], check=True, capture_output=True, text=True
+    ).stdout
+
+
+def image_info(path):
+    # format and virtual size as read from the image header
+    info = json.loads(qemu_img("info", "--output=json", path))
+
+    return info["format"], int(info["virtual-size"])
+
+
+def optimize_image(src_path, src_format, dst_path):
+    # decompresses the clusters while rewriting them in the read layout
+    qemu_img(
+        "convert",
+        "-f",
+        src_format,
+        "-O",
+        "qcow2",
+        "-o",
+        IMAGE_CONVERT_OPTS,
+        "-W",
+        src_path,
+        dst_path,
+    )
+
+
+class ImageRegistry:
+    # content hashes of the imported images, per libvirt url and pool, kept on
+    # disk next to the cpu baselines
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir(), "images.json")
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as registry_file:
+                return json.load(registry_file)
+        except FileNotFoundError:
+            return {}
+
+    def _save(self, registry):
+        replace_file(self.path, json.dumps(registry, indent=2, sort_keys=True))
+
+    def lookup(self, sha256, url, pool):
+        return self._load().get(sha256, {}).get(f"{url} {pool}")
+
+    def record(self, sha256, url, pool, vol_name):
+        registry = self._load()
+        registry.setdefault(sha256, {})[f"{url} {pool}"] = vol_name
+        self._save(registry)
+
+    def forget(self, sha256, url, pool):
+        registry = self._load()
+        registry.get(sha256, {}).pop(f"{url} {pool}", None)
+        self._save(registry)
+
+
+class ImageImporter:
+    def __init__(self, driver, pool_name, registry=None):
+        self.driver = driver
+        self.pool_name = pool_name
+        self.registry = registry or ImageRegistry()
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self._pool = None
+
+    def _vol_exists(self, vol_name):
+        try:
+            self._pool.storageVolLookupByName(vol_name)
+        except libvirt.libvirtError:
+            return False
+
+        return True
+
+    def _imported_as(self, sha256):
+        vol_name = self.registry.lookup(sha256, self.driver.url, self.pool_name)
+        if vol_name is None:
+            return None
+
+        # deleted behind our back, import it again
+        if not self._vol_exists(vol_name):
+            self.registry.forget(sha256, self.driver.url, self.pool_name)
+            return None
+
+        return vol_name
+
+    def _optimize(self, path, tmp_dir):
+        try:
+            src_format, virtual_size = image_info(path)
+        except FileNotFoundError as exc:
+            raise CloudvirtError(str(exc)) from exc
+        except (subprocess.CalledProcessError, ValueError, KeyError) as exc:
+            raise SpecError(f"cannot probe {path}: {exc}") from exc
+
+        self.logger.info(
+            "converting the %s image of %.2fG to the optimized qcow2 layout",
+            src_format,
+            virtual_size / 1024**3,
+        )
+
+        dst_path = os.path.join(tmp_dir, "image.qcow2")
+        try:
+            optimize_image(path, src_format, dst_path)
+        except subprocess.CalledProcessError as exc:
+            raise CloudvirtError(
+                f"qemu-img convert failed: {exc.stderr.strip()}"
+            ) from exc
+
+        return dst_path
+
+    def _upload(self, path, vol_name):
+        size = os.path.getsize(path)
+
+        self.logger.info("uploading %.2fM into %s", size / 1024**2, self.pool_name)
+
+        # created as raw so that libvirt does not lay down a qcow2 header of
+        # its own, the format is probed again once the upload finishes
+        volxml_root = ET.Element("volume")
+        ET.SubElement(volxml_root, "name").text = vol_name
+        ET.SubElement(volxml_root, "capacity", {"unit": "bytes"}).text = str(size)
+        volxml_target = ET.SubElement(volxml_root, "target")
+        ET.SubElement(volxml_target, "format", {"type": "raw"})
+        volxml = ET.tostring(volxml_root, encoding="unicode")
+
+        vol = self._pool.createXML(volxml, 0)
+
+        stream = self.driver.newStream(0)
+        try:
+            vol.upload(stream, 0, size, 0)
+
+            with open(path, "rb") as image_file:
+                while chunk := image_file.read(STREAM_CHUNK_SIZE):
+                    view, offset = memoryview(chunk), 0
+                    while offset < len(chunk):
+                        offset += stream.send(view[offset:])
+
+            stream.finish()
+        except libvirt.libvirtError:
+            stream.abort()
+            vol.delete()
+            raise
+
+    def run(self, path, vol_name=None):
+        if not os.path.isfile(path):
+            raise SpecError(f"{path} is not a file")
+
+        vol_name = vol_name or os.path.basename(path)
+        self._pool = self.driver.cache.pool(self.pool_name).pool
+
+        self.logger.info("hashing %s", path)
+        sha256 = file_sha256(path)
+
+        imported_as = self._imported_as(sha256)
+        if imported_as is not None:
+            self.logger.info(
+                "%s is already imported into %s as %s",
+                path,
+                self.pool_name,
+                imported_as,
+            )
+            return imported_as
+
+        if self._vol_exists(vol_name):
+            raise ConflictError(
+                f"a different {vol_name} already exists in {self.pool_name}"
+            )
+
+        with tempfile.TemporaryDirectory(prefix="cloudvirt-image-") as tmp_dir:
+            self._upload(self._optimize(path, tmp_dir), vol_name)
+
+        self.registry.record(sha256, self.driver.url, self.pool_name, vol_name)
+        self.logger.info("imported %s into %s as %s", path, self.pool_name, vol_name)
+
+        return vol_name
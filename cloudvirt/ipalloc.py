@@ -0,0 +1,96 @@
+import ipaddress
+import threading
+
+from .errors import ConflictError, SpecError
+
+
+class IPAllocator:
+    # bitmap over the DHCP range of a network, built once per network from the
+    # active leases and the <ip/dhcp/host> reservations. addresses are handled
+    # as integers so that neither validation nor allocation has to materialize
+    # the range.
+    def __init__(self, dhcp_start, dhcp_end):
+        self.start = int(ipaddress.IPv4Address(dhcp_start))
+        self.end = int(ipaddress.IPv4Address(dhcp_end))
+
+        self.leased = set()
+        self.reserved = set()
+
+        self._bitmap = bytearray(max(0, self.end - self.start + 1))
+        self._cursor = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, ip):
+        return self.start <= int(ipaddress.IPv4Address(ip)) <= self.end
+
+    def _mark(self, ip):
+        if self.start <= ip <= self.end:
+            self._bitmap[ip - self.start] = 1
+
+    def add_lease(self, ip):
+        ip = int(ipaddress.IPv4Address(ip))
+        self.leased.add(ip)
+        self._mark(ip)
+
+    def add_reservation(self, ip):
+        ip = int(ipaddress.IPv4Address(ip))
+        self.reserved.add(ip)
+        self._mark(ip)
+
+    def release(self, ip):
+        ip = int(ipaddress.IPv4Address(ip))
+        self.leased.discard(ip)
+        self.reserved.discard(ip)
+
+        with self._lock:
+            if self.start <= ip <= self.end:
+                self._bitmap[ip - self.start] = 0
+                self._cursor = min(self._cursor, ip - self.start)
+
+    def claim(self, ip):
+        # returns False if the address is already taken, so that two vms of a
+        # fleet asking for the same address cannot both pass the prechecks
+        ip = int(ipaddress.IPv4Address(ip))
+
+        if not self.start <= ip <= self.end:
+            return False
+
+        with self._lock:
+            if self._bitmap[ip - self.start]:
+                return False
+
+            self._bitmap[ip - self.start] = 1
+
+        return True
+
+    def take(self, ip, net_name):
+        # claim() of an address a vmspec asked for, raises with the reason it
+        # cannot have it
+        if ip not in self:
+            raise SpecError(
+                f"{ip} is not within the DHCP range of {net_name}. "
+                f"({ipaddress.IPv4Address(self.start)} - "
+                f"{ipaddress.IPv4Address(self.end)})"
+            )
+
+        if int(ipaddress.IPv4Address(ip)) in self.leased:
+            raise ConflictError(f"{ip} is already leased in {net_name}")
+
+        if int(ipaddress.IPv4Address(ip)) in self.reserved:
+            raise ConflictError(f"{ip} is already reserved in {net_name}")
+
+        if not self.claim(ip):
+            raise ConflictError(f"{ip} is already claimed in {net_name}")
+
+    def allocate(self):
+        with self._lock:
+            # everything below the cursor is taken, release() moves it back
+            idx = self._bitmap.find(0, self._cursor)
+
+            if idx == -1:
+                return None
+
+            self._bitmap[idx] = 1
+            self._cursor = idx + 1
+
+        return str(ipaddress.IPv4Address(self.start + idx))
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import logging
+import os
+
+from urllib.parse import quote
+
+import libvirt
+
+from .errors import LibvirtError
+from .log import DomainLoggerAdapter
+from .netbatch import NetworkUpdateBatch
+from .util import DEFAULT_JOBS, replace_file, state_dir
+
+# vmspec fields the creator fills in, along with what they hold when they are
+# left to it
+FILLED_IN = {
+    "mac_addr": None,
+    "ip": "auto",
+    "gateway": None,
+    "bridge_pfxlen": None,
+    "numa_node": "auto",
+    "cpuset": None,
+}
+
+
+def vmspec_digest(vmspec):
+    # of what was handed over alone, the fields the creator fills in are
+    # checked against the entry instead, so that the vmspec of a failed create
+    # matches its entry filled in or not
+    spec = {k: v for k, v in vars(vmspec).items() if k not in FILLED_IN}
+    spec = json.dumps(spec, sort_keys=True, default=vars)
+
+    return hashlib.sha256(spec.encode("utf-8")).hexdigest()
+
+
+def _filled_in_alike(vmspec, entry):
+    # every one either left to the creator or the same as what the failed
+    # create got
+    for key, unset in FILLED_IN.items():
+        value = getattr(vmspec, key)
+        if value not in (unset, None) and key in entry and value != entry[key]:
+            return False
+
+    return True
+
+
+class APIDriverVMRollback:
+    # undoes what a journaled create got through. pieces that are already
+    # gone are skipped, so that a rollback failing half way can be rerun
+    def __init__(self, driver, entry, net_batch=None):
+        self.driver = driver
+        self.entry = entry
+
+        # rollbacks of a batch share one, a lone rollback flushes its own
+        self._own_net_batch = net_batch is None
+        self.net_batch = net_batch or NetworkUpdateBatch(driver)
+
+        self.logger = DomainLoggerAdapter(
+            logging.getLogger(self.__class__.__name__),
+            {"dom_name": entry["dom_name"]},
+        )
+
+    def _undefine(self):
+        try:
+            dom = self.driver.lookupByName(self.entry["dom_name"])
+        except libvirt.libvirtError:
+            return
+
+        if dom.isActive():
+            self.logger.info("stopping domain")
+            dom.destroy()
+
+        self.logger.info("undefining domain")
+        dom.undefine()
+
+    def _remove_net_entries(self):
+        self.net_batch.remove_host(self.entry["net"], self.entry["dom_name"])
+
+        if self._own_net_batch:
+            err = self.net_batch.flush().get(self.entry["dom_name"])
+            if err:
+                raise LibvirtError(f"failed to remove the DHCP and DNS entries: {err}")
+
+    def _delete_volumes(self):
+        pool = self.driver.cache.pool(self.entry["vol_pool"]).pool
+        phases = set(self.entry["phases"])
+
+        # a claimed warm vm came with its overlay
+        for created_by, vol_name in [
+            ({"volume", "claim"}, self.entry["vol_name"]),
+            ({"iso"}, self.entry["iso"]),
+        ]:
+            if not created_by & phases:
+                continue
+
+            try:
+                vol = pool.storageVolLookupByName(vol_name)
+            except libvirt.libvirtError:
+                continue
+
+            self.logger.info("deleting %s", vol_name)
+            vol.delete()
+
+    def prepare(self):
+        self.logger.info("rolling back the failed create of %s", self.entry["dom_name"])
+
+        # the name was ours only once the domain got defined, a create that
+        # failed on an existing domain must not touch its entries
+        if {"define", "claim", "net"} & set(self.entry["phases"]):
+            self._undefine()
+            self._remove_net_entries()
+
+    def finish(self):
+        self._delete_volumes()
+        self.driver.journal.forget(self.entry["dom_name"])
+
+    def rollback(self):
+        self.prepare()
+        self.finish()
+
+
+class CreateJournal:
+    # the phases every create got through along with what it takes to resume
+    # or undo it, a json file per domain under a directory per libvirt url.
+    # nothing is written until the first phase completes, and the entry is
+    # dropped once the vm is up
+    def __init__(self, url, path=None):
+        self.path = path or os.path.join(state_dir(), "journal", quote(url, safe=""))
+        os.makedirs(self.path, exist_ok=True)
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def _entry_path(self, dom_name):
+        return os.path.join(self.path, f"{dom_name}.json")
+
+    def _save(self, entry):
+        replace_file(
+            self._entry_path(entry["dom_name"]),
+            json.dumps(entry, indent=2, sort_keys=True),
+        )
+
+    def load(self, dom_name):
+        try:
+            with open(self._entry_path(dom_name), "r", encoding="utf-8") as entry_file:
+                return json.load(entry_file)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def begin(vmspec, digest, iso_name):
+        return {
+            "dom_name": vmspec.dom_name,
+            "digest": digest,
+            "phases": [],
+            "net": vmspec.net,
+            "vol_pool": vmspec.vol_pool,
+            "vol_name": vmspec.vol_name,
+            "iso": iso_name,
+        }
+
+    def record(self, entry, phase, vmspec):
+        # along with what the fields left to the creator got filled in with
+        entry["phases"].append(phase)
+        entry.update({key: getattr(vmspec, key) for key in FILLED_IN})
+        entry["vol_name"] = vmspec.vol_name
+
+        self._save(entry)
+
+    def forget(self, dom_name):
+        try:
+            os.remove(self._entry_path(dom_name))
+        except FileNotFoundError:
+            pass
+
+    def dom_names(self):
+        return sorted(
+            x[: -len(".json")] for x in os.listdir(self.path) if x.endswith(".json")
+        )
+
+    def resume(self, driver, vmspec, iso_name):
+        # the entry of an earlier failed create of the very same vmspec, the
+        # leftovers of a different vmspec under the same name or of a claim
+        # are undone
+        digest = vmspec_digest(vmspec)
+        entry = self.load(vmspec.dom_name)
+
+        if entry is not None and (
+            entry["digest"] != digest
+            or not _filled_in_alike(vmspec, entry)
+            or "claim" in entry["phases"]
+        ):
+            self.logger.warning(
+                "cannot resume the failed create of %s, rolling back",
+                vmspec.dom_name,
+            )
+            APIDriverVMRollback(driver, entry).rollback()
+            entry = None
+
+        return entry or self.begin(vmspec, digest, iso_name)
+
+    def rollback_many(self, driver, dom_names, jobs=DEFAULT_JOBS, net_update="live"):
+        # the journaled creates among dom_names, every one of them if None
+        if dom_names is None:
+            dom_names = self.dom_names()
+
+        net_batch = NetworkUpdateBatch(driver, net_update)
+        rollbacks = {}
+        for dom_name in dom_names:
+            entry = self.load(dom_name)
+            if entry is not None:
+                rollbacks[dom_name] = APIDriverVMRollback(driver, entry, net_batch)
+
+        results = driver.run_many(lambda rollback: rollback.prepare(), rollbacks, jobs)
+
+        driver.flush_net_batch(net_batch, results)
+
+        prepared = {k: v for k, v in rollbacks.items() if results[k] is None}
+        results.update(
+            driver.run_many(lambda rollback: rollback.finish(), prepared, jobs)
+        )
+
+        return results
+
+    def rollback_failed(self, driver, results, jobs=DEFAULT_JOBS, net_update="live"):
+        # undoes the creates of a batch that failed instead of keeping them
+        # journaled for the next run
+        failed = [k for k, v in results.items() if v is not None]
+        if failed:
+            self.logger.info("rolling back %s failed create(s)", len(failed))
+
+        errors = self.rollback_many(driver, failed, jobs, net_update)
+        for dom_name, err in errors.items():
+            if err is not None:
+                self.logger.warning("%s: rollback failed: %s", dom_name, err)
@@ -1,5 +1,4 @@
 import logging
-import sys
 
 
 class ANSIColors:
@@ -30,10 +29,11 @@ class ANSIColors:
 c = ANSIColors()
 
 
-class ShutdownHandler(logging.StreamHandler):
-    def emit(self, record):
-        if record.levelno >= logging.ERROR:
-            sys.exit(1)
+class DomainLoggerAdapter(logging.LoggerAdapter):
+    # prefix every message with the domain name so that interleaved output of
+    # concurrent creators and nukers stays readable
+    def process(self, msg, kwargs):
+        return f"{self.extra['dom_name']}: {msg}", kwargs
 
 
 class CloudvirtFormatter(logging.Formatter):
@@ -68,4 +68,3 @@ def set_root_logger(debug=False):
     handler.setFormatter(formatter)
 
     logger.addHandler(handler)
-    logger.addHandler(ShutdownHandler())
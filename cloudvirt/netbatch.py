@@ -0,0 +1,247 @@
+import logging
+import threading
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from .errors import CloudvirtError, SpecError
+
+
+class NetworkUpdateBatch:
+    # collects the dhcp/dns host additions and deletions of many creators and
+    # nukers and applies them per network in one go.
+    #
+    # every live network.update() makes libvirt rewrite the dnsmasq host files
+    # and signal dnsmasq. in the `live' mode opposing changes cancel out, no-op
+    # changes are dropped and the rest is issued back to back at flush time
+    # rather than interleaved with the rest of the creation. libvirt takes a
+    # single host per update, so that is as far as an active network goes
+    # without a restart. the `redefine' mode merges everything into the
+    # persistent network definition with a single networkDefineXML(), dnsmasq
+    # of an active network only picks the changes up the next time the
+    # network is restarted. an inactive network has no dnsmasq to update, it
+    # is redefined in either mode.
+    def __init__(self, driver, mode="live"):
+        self.driver = driver
+        self.mode = mode
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        # net_name -> {dom_name: (mac, ip)} and net_name -> {dom_name}
+        self._adds = {}
+        self._removes = {}
+        self._lock = threading.Lock()
+
+    def add_host(self, net_name, dom_name, mac, ip):
+        with self._lock:
+            self._adds.setdefault(net_name, {})[dom_name] = (mac, ip)
+
+    def remove_host(self, net_name, dom_name):
+        with self._lock:
+            adds = self._adds.get(net_name, {})
+
+            # added and removed before ever being applied
+            if dom_name in adds:
+                del adds[dom_name]
+                return
+
+            self._removes.setdefault(net_name, set()).add(dom_name)
+
+    @staticmethod
+    def _dhcp_host_xml(dom_name, mac=None, ip=None):
+        attrib = {"name": dom_name}
+        if mac:
+            attrib["mac"] = mac
+        if ip:
+            attrib["ip"] = ip
+
+        return ET.Element("host", attrib)
+
+    @staticmethod
+    def _dns_host_xml(dom_name, ip=None):
+        dns_host = ET.Element("host", {"ip": ip} if ip else {})
+        ET.SubElement(dns_host, "hostname").text = dom_name
+
+        return dns_host
+
+    @staticmethod
+    def _existing(net_root):
+        dhcp = {
+            x.attrib["name"]: x.attrib
+            for x in net_root.findall("ip/dhcp/host")
+            if "name" in x.attrib
+        }
+        dns = {
+            hostname.text: host.attrib.get("ip")
+            for host in net_root.findall("dns/host")
+            for hostname in host.findall("hostname")
+        }
+
+        return dhcp, dns
+
+    def _plan(self, net_root, adds, removes):
+        dhcp, dns = self._existing(net_root)
+        plan = []
+
+        # deletions first so that a re-added name does not collide
+        for dom_name in sorted(removes):
+            if dom_name in dns:
+                plan.append((dom_name, "delete", "dns", self._dns_host_xml(dom_name)))
+            if dom_name in dhcp:
+                plan.append((dom_name, "delete", "dhcp", self._dhcp_host_xml(dom_name)))
+
+        for dom_name, (mac, ip) in adds.items():
+            replaced = dom_name in removes
+
+            if replaced or dhcp.get(dom_name) != {
+                "mac": mac,
+                "name": dom_name,
+                "ip": ip,
+            }:
+                plan.append(
+                    (dom_name, "add", "dhcp", self._dhcp_host_xml(dom_name, mac, ip))
+                )
+            if replaced or dns.get(dom_name) != ip:
+                plan.append((dom_name, "add", "dns", self._dns_host_xml(dom_name, ip)))
+
+        return plan
+
+    def _mirror(self, net_snapshot, dom_name, command, section, xml):
+        if section == "dhcp":
+            if command == "delete":
+                net_snapshot.remove_dhcp_host(dom_name)
+            else:
+                net_snapshot.add_dhcp_host(xml.attrib)
+        else:
+            if command == "delete":
+                net_snapshot.remove_dns_host(dom_name)
+            else:
+                net_snapshot.add_dns_host(xml.attrib["ip"], dom_name)
+
+    def _flush_live(self, net_name, net_snapshot, plan, results):
+        commands = {
+            "add": libvirt.VIR_NETWORK_UPDATE_COMMAND_ADD_FIRST,
+            "delete": libvirt.VIR_NETWORK_UPDATE_COMMAND_DELETE,
+        }
+        sections = {
+            "dhcp": libvirt.VIR_NETWORK_SECTION_IP_DHCP_HOST,
+            "dns": libvirt.VIR_NETWORK_SECTION_DNS_HOST,
+        }
+
+        for dom_name, command, section, xml in plan:
+            if results.get(dom_name):
+                continue
+
+            self.logger.info(
+                "%s: %s %s entry in %s", dom_name, command, section, net_name
+            )
+
+            # parentIndex of -1 lets libvirt pick the <ip> element that holds
+            # the <dhcp> section
+            try:
+                net_snapshot.network.update(
+                    commands[command],
+                    sections[section],
+                    -1,
+                    ET.tostring(xml, encoding="unicode"),
+                    libvirt.VIR_NETWORK_UPDATE_AFFECT_LIVE
+                    | libvirt.VIR_NETWORK_UPDATE_AFFECT_CONFIG,
+                )
+            except libvirt.libvirtError as exc:
+                self.logger.warning("%s: %s", dom_name, exc)
+                results[dom_name] = str(exc)
+                continue
+
+            self._mirror(net_snapshot, dom_name, command, section, xml)
+
+    def _flush_redefine(self, net_name, net_snapshot, plan, results):
+        network = net_snapshot.network
+
+        # work on the persistent definition, the live one may carry transient
+        # changes that should not end up in the config
+        net_root = ET.fromstring(network.XMLDesc(libvirt.VIR_NETWORK_XML_INACTIVE))
+
+        for dom_name, command, section, xml in plan:
+            if section == "dhcp":
+                parent = net_root.find("ip/dhcp")
+                if parent is None:
+                    raise SpecError(f"{net_name} has no DHCP section for the hosts")
+
+                matches = [
+                    x
+                    for x in parent.findall("host")
+                    if x.attrib.get("name") == dom_name
+                ]
+            else:
+                parent = net_root.find("dns")
+                if parent is None:
+                    parent = ET.SubElement(net_root, "dns")
+                matches = [
+                    x
+                    for x in parent.findall("host")
+                    if dom_name in [y.text for y in x.findall("hostname")]
+                ]
+
+            for match in matches:
+                parent.remove(match)
+
+            if command == "add":
+                parent.append(xml)
+
+        self.logger.info(
+            "redefining %s with %s dhcp/dns host change(s)", net_name, len(plan)
+        )
+
+        try:
+            self.driver.networkDefineXML(ET.tostring(net_root, encoding="unicode"))
+        except libvirt.libvirtError as exc:
+            self.logger.warning("redefining %s failed: %s", net_name, exc)
+            for dom_name, _, _, _ in plan:
+                results[dom_name] = str(exc)
+            return
+
+        for entry in plan:
+            self._mirror(net_snapshot, *entry)
+
+        if network.isActive():
+            self.logger.warning(
+                "%s is active, its DHCP and DNS hosts take effect on the next restart",
+                net_name,
+            )
+
+    def flush(self):
+        # returns {dom_name: error message or None} for every host touched
+        with self._lock:
+            adds, self._adds = self._adds, {}
+            removes, self._removes = self._removes, {}
+
+        results = {}
+
+        for net_name in list(dict.fromkeys(list(removes) + list(adds))):
+            net_adds = adds.get(net_name, {})
+            net_removes = removes.get(net_name, set())
+
+            for dom_name in list(net_adds) + list(net_removes):
+                results[dom_name] = None
+
+            net_snapshot = self.driver.cache.network(net_name)
+            plan = self._plan(net_snapshot.xml_root, net_adds, net_removes)
+
+            if not plan:
+                continue
+
+            try:
+                if self.mode == "redefine" or not net_snapshot.network.isActive():
+                    self._flush_redefine(net_name, net_snapshot, plan, results)
+                else:
+                    self._flush_live(net_name, net_snapshot, plan, results)
+            except CloudvirtError as exc:
+                self.logger.warning("%s: %s", net_name, exc)
+                for dom_name, _, _, _ in plan:
+                    results[dom_name] = str(exc)
+
+            # the cached copy is out of sync with libvirt once anything failed
+            if any(results[dom_name] for dom_name, _, _, _ in plan):
+                self.driver.cache.invalidate_network(net_name)
+
+        return results
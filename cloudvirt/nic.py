@@ -0,0 +1,100 @@
+import xml.etree.ElementTree as ET
+
+from .util import merge_profile
+
+NET_BACKENDS = ["vhost", "qemu"]
+NET_RING_SIZES = [256, 512, 1024]
+
+# offloads of the tap device on the host, and the netplan keys toggling the
+# same ones inside the guest where there is one
+NET_OFFLOADS = {
+    "csum": "transmit-checksum-offload",
+    "gso": "generic-segmentation-offload",
+    "tso4": "tcp-segmentation-offload",
+    "tso6": "tcp6-segmentation-offload",
+    "ecn": None,
+    "ufo": None,
+    "mrg_rxbuf": None,
+}
+
+# in-kernel vhost with a queue pair per vcpu and the largest rx ring, the
+# offloads are left at what qemu negotiates. queues left at None follow
+# dom_vcpu
+DEFAULT_NET_PROFILE = {
+    "backend": "vhost",
+    "queues": None,
+    "rx_queue_size": 1024,
+    "tx_queue_size": None,
+    "offloads": {},
+}
+
+
+def resolve_net_profile(overrides=None):
+    profile = merge_profile("net_profile", DEFAULT_NET_PROFILE, overrides)
+
+    if profile["backend"] not in NET_BACKENDS:
+        raise ValueError(f"backend should be one of: {', '.join(NET_BACKENDS)}")
+
+    # qemu silently caps it at 256 for anything but vhost-user
+    if profile["tx_queue_size"] is not None and profile["backend"] != "vhost-user":
+        raise ValueError("tx_queue_size is only honoured by vhost-user interfaces")
+
+    if profile["queues"] is not None:
+        if not isinstance(profile["queues"], int) or profile["queues"] < 1:
+            raise ValueError("queues has to be an int of at least 1")
+
+    for key in ["rx_queue_size", "tx_queue_size"]:
+        if profile[key] is not None and profile[key] not in NET_RING_SIZES:
+            raise ValueError(
+                f"{key} should be one of: {', '.join(str(x) for x in NET_RING_SIZES)}"
+            )
+
+    if not isinstance(profile["offloads"], dict):
+        raise ValueError("offloads should be a mapping of offloads to bools")
+
+    for key, value in profile["offloads"].items():
+        if key not in NET_OFFLOADS:
+            raise ValueError(f"offloads should be any of: {', '.join(NET_OFFLOADS)}")
+
+        if not isinstance(value, bool):
+            raise ValueError(f"offload {key} should be a bool")
+
+    # sorted so that equal profiles compare and serialize the same
+    profile["offloads"] = dict(sorted(profile["offloads"].items()))
+
+    return profile
+
+
+def gen_iface_driver(domxml_dev_iface, vmspec):
+    # the <driver> of the primary interface, the guest side offloads are left
+    # to the netplan so that they can be changed without a redefine
+    profile = vmspec.net_profile or resolve_net_profile()
+
+    queues = profile["queues"] or vmspec.dom_vcpu
+
+    domxml_driver = ET.SubElement(
+        domxml_dev_iface, "driver", {"name": profile["backend"]}
+    )
+
+    if queues > 1:
+        domxml_driver.attrib["queues"] = str(queues)
+
+    for key in ["rx_queue_size", "tx_queue_size"]:
+        if profile[key] is not None:
+            domxml_driver.attrib[key] = str(profile[key])
+
+    if profile["offloads"]:
+        ET.SubElement(
+            domxml_driver,
+            "host",
+            {k: "on" if v else "off" for k, v in profile["offloads"].items()},
+        )
+
+
+def guest_offloads(vmspec):
+    # netplan keys of the offloads toggled by the net profile
+    profile = vmspec.net_profile or resolve_net_profile()
+
+    return {
+        NET_OFFLOADS[k]: v for k, v in profile["offloads"].items() if NET_OFFLOADS[k]
+    }
@@ -0,0 +1,188 @@
+import logging
+import threading
+import xml.etree.ElementTree as ET
+
+from .disk import resolve_disk_profile
+from .errors import LibvirtError, SpecError
+
+# KiB, as libvirt wants them
+HUGEPAGE_SIZES = {"2M": 2048, "1G": 1048576}
+
+
+def parse_cpuset(cpuset):
+    # "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11], raises ValueError
+    cpus = set()
+
+    for part in str(cpuset).split(","):
+        if "-" in part:
+            first, last = part.split("-", 1)
+            if int(first) > int(last):
+                raise ValueError(f"{part} is not a valid range")
+
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+
+    return sorted(cpus)
+
+
+def format_cpuset(cpus):
+    return ",".join(str(x) for x in cpus)
+
+
+def gen_tuning(domxml_root, vmspec):
+    # <cputune>, <numatune> and <memoryBacking> out of the resolved vmspec
+    domxml_cputune = ET.Element("cputune")
+
+    if vmspec.cpuset is not None:
+        cpus = parse_cpuset(vmspec.cpuset)
+
+        if len(cpus) >= vmspec.dom_vcpu:
+            for vcpu, cpu in enumerate(cpus[: vmspec.dom_vcpu]):
+                ET.SubElement(
+                    domxml_cputune, "vcpupin", {"vcpu": str(vcpu), "cpuset": str(cpu)}
+                )
+        else:
+            # fewer cpus than vcpus, let them float over the set
+            domxml_root.find("vcpu").attrib["cpuset"] = format_cpuset(cpus)
+
+    if vmspec.emulator_cpuset is not None:
+        ET.SubElement(
+            domxml_cputune,
+            "emulatorpin",
+            {"cpuset": format_cpuset(parse_cpuset(vmspec.emulator_cpuset))},
+        )
+
+        # the iothreads do the disk io on behalf of the emulator
+        disk_profile = vmspec.disk_profile or resolve_disk_profile()
+        for iothread in range(1, disk_profile["iothreads"] + 1):
+            ET.SubElement(
+                domxml_cputune,
+                "iothreadpin",
+                {
+                    "iothread": str(iothread),
+                    "cpuset": format_cpuset(parse_cpuset(vmspec.emulator_cpuset)),
+                },
+            )
+
+    if len(domxml_cputune):
+        domxml_root.append(domxml_cputune)
+
+    if vmspec.numa_node is not None:
+        domxml_numatune = ET.SubElement(domxml_root, "numatune")
+        ET.SubElement(
+            domxml_numatune,
+            "memory",
+            {"mode": "strict", "nodeset": str(vmspec.numa_node)},
+        )
+
+    if vmspec.hugepages is not None:
+        domxml_hugepages = ET.SubElement(
+            ET.SubElement(domxml_root, "memoryBacking"), "hugepages"
+        )
+        ET.SubElement(
+            domxml_hugepages,
+            "page",
+            {"size": str(HUGEPAGE_SIZES[vmspec.hugepages]), "unit": "KiB"},
+        )
+
+
+class Placement:
+    # resolves `numa_node: auto' to the host numa node with the most free
+    # memory, hugepages if the vm is backed by them, and any numa node to the
+    # least pinned cpus of it. placements handed out by this driver count
+    # against a node until the vm got started
+    def __init__(self, driver):
+        self.driver = driver
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        # dom_name -> (node, memory in bytes, cpus)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _cells(self):
+        caps_root = ET.fromstring(self.driver.getCapabilities())
+
+        cells = {}
+        for cell in caps_root.findall("host/topology/cells/cell"):
+            cells[int(cell.attrib["id"])] = [
+                int(x.attrib["id"]) for x in cell.findall("cpus/cpu")
+            ]
+
+        return cells
+
+    def _free_memory(self, cells, hugepages):
+        first, count = min(cells), len(cells)
+
+        if hugepages is None:
+            free = self.driver.getCellsFreeMemory(first, count)
+            return {first + i: x for i, x in enumerate(free)}
+
+        size = HUGEPAGE_SIZES[hugepages]
+        free = self.driver.getFreePages([size], first, count, 0)
+
+        return {cell: pages[size] * size * 1024 for cell, pages in free.items()}
+
+    def _pinned_cpus(self):
+        pinned = {}
+
+        for dom in self.driver.listAllDomains(0):
+            dom_root = ET.fromstring(dom.XMLDesc())
+
+            for pin in dom_root.findall("cputune/vcpupin"):
+                for cpu in parse_cpuset(pin.attrib["cpuset"]):
+                    pinned[cpu] = pinned.get(cpu, 0) + 1
+
+        return pinned
+
+    def place(self, vmspec):
+        with self._lock:
+            cells = self._cells()
+            if not cells:
+                raise LibvirtError("libVirt does not report the host NUMA topology")
+
+            free = self._free_memory(cells, vmspec.hugepages)
+            pinned = self._pinned_cpus()
+
+            for node, mem, cpus in self._pending.values():
+                free[node] = free.get(node, 0) - mem
+                for cpu in cpus:
+                    pinned[cpu] = pinned.get(cpu, 0) + 1
+
+            if vmspec.numa_node == "auto":
+                # most free memory first, least pinned cpus second
+                node = max(
+                    cells,
+                    key=lambda x: (
+                        free.get(x, 0),
+                        -sum(pinned.get(cpu, 0) for cpu in cells[x]),
+                    ),
+                )
+            else:
+                node = int(vmspec.numa_node)
+
+                if node not in cells:
+                    raise SpecError(f"host has no NUMA node {node}")
+
+            mem = vmspec.dom_mem * 1024 * 1024
+            if free.get(node, 0) < mem:
+                self.logger.warning(
+                    "NUMA node %s only has %s MiB free", node, free.get(node, 0) >> 20
+                )
+
+            cpus = []
+            if vmspec.cpuset is None:
+                # stable on ties so that vcpus end up on neighbouring cpus
+                cpus = sorted(cells[node], key=lambda x: pinned.get(x, 0))
+                cpus = sorted(cpus[: vmspec.dom_vcpu])
+                vmspec.cpuset = format_cpuset(cpus)
+
+            vmspec.numa_node = node
+            self._pending[vmspec.dom_name] = (node, mem, cpus)
+
+        return node
+
+    def release(self, dom_name):
+        with self._lock:
+            self._pending.pop(dom_name, None)
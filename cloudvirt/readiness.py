@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+import libvirt
+
+# lease checks back off up to this many seconds, there is no event for them
+LEASE_BACKOFF_MAX = 2.0
+LEASE_BACKOFF_START = 0.25
+
+
+class DomainWaiter:
+    # boot progress of a single domain, fed by the callbacks of the watcher.
+    # phases are recorded in seconds since the domain got defined
+    def __init__(self, dom_name, defined_at):
+        self.dom_name = dom_name
+        self.defined_at = defined_at
+
+        self.timings = {}
+
+        self.started = threading.Event()
+        self.agent_connected = threading.Event()
+        self.stopped = threading.Event()
+
+    def mark(self, phase):
+        self.timings.setdefault(phase, round(time.monotonic() - self.defined_at, 3))
+
+    def _remaining(self, deadline):
+        return max(0, deadline - time.monotonic())
+
+    def wait_started(self, deadline):
+        return self.started.wait(self._remaining(deadline))
+
+    def wait_agent(self, deadline):
+        # woken up by either the agent connecting or the domain going down
+        while not self.agent_connected.is_set() and not self.stopped.is_set():
+            if not self._remaining(deadline):
+                return False
+
+            self.agent_connected.wait(min(LEASE_BACKOFF_MAX, self._remaining(deadline)))
+
+        return self.agent_connected.is_set()
+
+    def backoff(self, check, deadline):
+        # for the checks libvirt has no event for, sleeps are cut short if the
+        # domain stops in the meantime
+        delay = LEASE_BACKOFF_START
+
+        while not self.stopped.is_set():
+            if check():
+                return True
+
+            if not self._remaining(deadline):
+                return False
+
+            self.stopped.wait(min(delay, self._remaining(deadline)))
+            delay = min(delay * 2, LEASE_BACKOFF_MAX)
+
+        return False
+
+
+class ReadinessWatcher:
+    # a single set of domain lifecycle and guest agent callbacks per
+    # connection, dispatched to the waiters of the domains being created.
+    # registered the first time a creator waits
+    def __init__(self, driver):
+        self.driver = driver
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+        self._callback_ids = []
+
+    def _lifecycle_cb(self, conn, dom, event, detail, opaque):
+        # pylint: disable=unused-argument
+        waiter = self._waiters.get(dom.name())
+        if waiter is None:
+            return
+
+        if event == libvirt.VIR_DOMAIN_EVENT_STARTED:
+            waiter.mark("started")
+            waiter.started.set()
+        elif event == libvirt.VIR_DOMAIN_EVENT_STOPPED:
+            waiter.stopped.set()
+
+    def _agent_cb(self, conn, dom, state, reason, opaque):
+        # pylint: disable=unused-argument
+        waiter = self._waiters.get(dom.name())
+        if waiter is None:
+            return
+
+        if state == libvirt.VIR_CONNECT_DOMAIN_EVENT_AGENT_LIFECYCLE_STATE_CONNECTED:
+            waiter.agent_connected.set()
+
+    def _register_events(self):
+        for event_id, callback in [
+            (libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._lifecycle_cb),
+            (libvirt.VIR_DOMAIN_EVENT_ID_AGENT_LIFECYCLE, self._agent_cb),
+        ]:
+            self._callback_ids.append(
+                self.driver.domainEventRegisterAny(None, event_id, callback, None)
+            )
+
+    def deregister_events(self):
+        with self._lock:
+            while self._callback_ids:
+                self.driver.domainEventDeregisterAny(self._callback_ids.pop())
+
+    def watch(self, dom_name, defined_at):
+        # has to be called before the domain is started, or the started event
+        # may be missed
+        with self._lock:
+            if not self._callback_ids:
+                self._register_events()
+
+            waiter = DomainWaiter(dom_name, defined_at)
+            self._waiters[dom_name] = waiter
+
+        return waiter
+
+    def unwatch(self, dom_name):
+        with self._lock:
+            self._waiters.pop(dom_name, None)
@@ -0,0 +1,123 @@
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+import libvirt
+
+from .util import DEFAULT_JOBS, DEFAULT_OVERCOMMIT
+
+
+class Scheduler:
+    # admits the vms of a fleet against the cached capacity snapshots of the
+    # hosts and places each on the one left with the most room, the largest
+    # vms first. placed vms are reserved on the snapshots, so that a fleet
+    # costs a single round of capacity calls per host
+    def __init__(self, drivers, overcommit=None):
+        self.drivers = drivers
+        self.overcommit = dict(DEFAULT_OVERCOMMIT, **(overcommit or {}))
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def _room(self, driver, vmspec):
+        # (fraction of the tightest resource left after placing the vm, free
+        # memory) or the name of the resource it does not fit in
+        try:
+            host = driver.cache.host()
+            pool = driver.cache.pool(vmspec.vol_pool)
+        except libvirt.libvirtError as exc:
+            return str(exc)
+
+        usage = {
+            "cpu": (host.cpus, host.committed_vcpus + vmspec.dom_vcpu),
+            "mem": (host.memory, host.committed_memory + vmspec.dom_mem * 1024),
+            "disk": (pool.available, pool.reserved + vmspec.vol_size * 1024**3),
+        }
+
+        room = {}
+        for resource, (capacity, used) in usage.items():
+            limit = capacity * self.overcommit[resource]
+            if not limit or used > limit:
+                return resource
+
+            room[resource] = (limit - used) / limit
+
+        return min(room.values()), host.free_memory
+
+    @staticmethod
+    def _reserve(driver, vmspec, sign=1):
+        driver.cache.host().reserve(
+            sign * vmspec.dom_vcpu, sign * vmspec.dom_mem * 1024
+        )
+        driver.cache.pool(vmspec.vol_pool).reserve(sign * vmspec.vol_size * 1024**3)
+
+    def schedule(self, vmspecs):
+        # ({driver: [vmspec]}, {dom_name: error} of the ones that fit nowhere)
+        placements, errors = {}, {}
+
+        for vmspec in sorted(
+            vmspecs, key=lambda x: (x.dom_mem, x.dom_vcpu), reverse=True
+        ):
+            best_room, best_driver, short = None, None, []
+
+            for driver in self.drivers:
+                room = self._room(driver, vmspec)
+
+                if isinstance(room, str):
+                    short.append(f"{driver.url}: {room}")
+                elif best_driver is None or room > best_room:
+                    best_room, best_driver = room, driver
+
+            if best_driver is None:
+                errors[vmspec.dom_name] = (
+                    f"no host has room for it ({', '.join(short)})"
+                )
+                continue
+
+            self._reserve(best_driver, vmspec)
+            placements.setdefault(best_driver, []).append(vmspec)
+
+        return placements, errors
+
+    def create_many(
+        self,
+        vmspecs,
+        jobs=DEFAULT_JOBS,
+        net_update="live",
+        *,
+        wait=None,
+        timings=None,
+        rollback=False,
+    ):
+        placements, errors = self.schedule(vmspecs)
+
+        for driver, host_vmspecs in placements.items():
+            self.logger.info("placing %s vm(s) on %s", len(host_vmspecs), driver.url)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(placements))) as executor:
+            futures = {
+                driver: executor.submit(
+                    driver.create_many,
+                    host_vmspecs,
+                    jobs,
+                    net_update,
+                    wait=wait,
+                    timings=timings,
+                    rollback=rollback,
+                )
+                for driver, host_vmspecs in placements.items()
+            }
+
+            for driver, future in futures.items():
+                host_results = future.result()
+                results.update(host_results)
+
+                # the ones that failed do not take up anything
+                for vmspec in placements[driver]:
+                    if host_results[vmspec.dom_name] is not None:
+                        self._reserve(driver, vmspec, -1)
+
+        results.update(errors)
+
+        # keep the input order for the summary
+        return {vmspec.dom_name: results[vmspec.dom_name] for vmspec in vmspecs}
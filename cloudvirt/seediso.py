@@ -0,0 +1,184 @@
+import struct
+import time
+
+# purpose built ISO9660 + Joliet writer for the fixed NoCloud CIDATA layout:
+# a single root directory holding at most a handful of small files. there is
+# no rock ridge, readers fall back to the joliet names which are the ones the
+# pycdlib fallback gives as rock ridge names. the image is laid out in a
+# preallocated buffer in one pass:
+#
+#   0-15   system area
+#   16     primary volume descriptor
+#   17     joliet supplementary volume descriptor
+#   18     volume descriptor set terminator
+#   19-22  L and M path tables, primary then joliet
+#   23     primary root directory
+#   24     joliet root directory
+#   25-    file extents, shared by both directory trees
+
+SECTOR_SIZE = 2048
+
+_PVD_LBA = 16
+_PATH_TABLE_LBA = 19
+_ROOT_LBA = 23
+_DATA_LBA = 25
+
+_PATH_TABLE_SIZE = 10
+
+
+def _both16(value):
+    return struct.pack("<H", value) + struct.pack(">H", value)
+
+
+def _both32(value):
+    return struct.pack("<I", value) + struct.pack(">I", value)
+
+
+def _dir_date(now):
+    return bytes(
+        [
+            now.tm_year - 1900,
+            now.tm_mon,
+            now.tm_mday,
+            now.tm_hour,
+            now.tm_min,
+            now.tm_sec,
+            0,
+        ]
+    )
+
+
+def _vol_date(now):
+    if now is None:
+        return b"0" * 16 + b"\x00"
+
+    return time.strftime("%Y%m%d%H%M%S00", now).encode("ascii") + b"\x00"
+
+
+def _dir_record(name, extent, size, date, is_dir=False):
+    rec_len = 33 + len(name) + (1 - len(name) % 2)
+
+    rec = bytearray(rec_len)
+    rec[0] = rec_len
+    rec[2:10] = _both32(extent)
+    rec[10:18] = _both32(size)
+    rec[18:25] = date
+    rec[25] = 2 if is_dir else 0
+    rec[28:32] = _both16(1)
+    rec[32] = len(name)
+    rec[33 : 33 + len(name)] = name
+
+    return rec
+
+
+def _pad(text, length, joliet=False):
+    # joliet fields are padded with UCS-2 spaces
+    if joliet:
+        return (text.encode("utf-16-be") + b"\x00 " * length)[:length]
+
+    return text.encode("ascii").ljust(length, b" ")[:length]
+
+
+def _volume_descriptor(
+    buf, lba, total, path_table_lba, root, *, vol_ident, now, joliet
+):
+    off = lba * SECTOR_SIZE
+
+    buf[off] = 2 if joliet else 1
+    buf[off + 1 : off + 6] = b"CD001"
+    buf[off + 6] = 1
+    buf[off + 8 : off + 40] = _pad("", 32, joliet)
+    buf[off + 40 : off + 72] = _pad(vol_ident, 32, joliet)
+    buf[off + 80 : off + 88] = _both32(total)
+
+    # UCS-2 level 3 escape sequence
+    if joliet:
+        buf[off + 88 : off + 91] = b"%/E"
+
+    buf[off + 120 : off + 124] = _both16(1)
+    buf[off + 124 : off + 128] = _both16(1)
+    buf[off + 128 : off + 132] = _both16(SECTOR_SIZE)
+    buf[off + 132 : off + 140] = _both32(_PATH_TABLE_SIZE)
+    buf[off + 140 : off + 144] = struct.pack("<I", path_table_lba)
+    buf[off + 148 : off + 152] = struct.pack(">I", path_table_lba + 1)
+    buf[off + 156 : off + 190] = root
+
+    for start in [190, 318, 446, 574]:
+        buf[off + start : off + start + 128] = _pad("", 128, joliet)
+
+    for start in [702, 739, 776]:
+        buf[off + start : off + start + 37] = _pad("", 37, joliet)
+
+    buf[off + 813 : off + 830] = _vol_date(now)
+    buf[off + 830 : off + 847] = _vol_date(now)
+    buf[off + 847 : off + 864] = _vol_date(None)
+    buf[off + 864 : off + 881] = _vol_date(None)
+    buf[off + 881] = 1
+
+
+def _path_tables(buf, lba, root_lba):
+    # only the root directory, as a little endian and a big endian table
+    for table_lba, fmt in [(lba, "<"), (lba + 1, ">")]:
+        off = table_lba * SECTOR_SIZE
+        buf[off] = 1
+        buf[off + 2 : off + 6] = struct.pack(f"{fmt}I", root_lba)
+        buf[off + 6 : off + 8] = struct.pack(f"{fmt}H", 1)
+
+
+def write_seed_iso(files, vol_ident="CIDATA"):
+    # files: list of (iso9660 name, joliet name, bytes), iso9660 names have to
+    # be level 1 conformant (e.g. "UDATA.;1")
+    now = time.gmtime()
+    date = _dir_date(now)
+
+    # - - extents - - #
+    extents, lba = [], _DATA_LBA
+    for _, _, data in files:
+        extents.append(lba if data else 0)
+        lba += -(-len(data) // SECTOR_SIZE)
+
+    total = lba
+    buf = bytearray(total * SECTOR_SIZE)
+
+    # - - directories - - #
+    for root_lba, joliet in [(_ROOT_LBA, False), (_ROOT_LBA + 1, True)]:
+        entries = []
+        for (name, jname, data), extent in zip(files, extents):
+            ident = jname.encode("utf-16-be") if joliet else name.encode("ascii")
+            entries.append((ident, extent, len(data)))
+
+        records = _dir_record(b"\x00", root_lba, SECTOR_SIZE, date, True)
+        records += _dir_record(b"\x01", root_lba, SECTOR_SIZE, date, True)
+        for name, extent, size in sorted(entries):
+            records += _dir_record(name, extent, size, date)
+
+        if len(records) > SECTOR_SIZE:
+            raise ValueError("too many files for a single sector root directory")
+
+        off = root_lba * SECTOR_SIZE
+        buf[off : off + len(records)] = records
+
+        _path_tables(buf, _PATH_TABLE_LBA + 2 * int(joliet), root_lba)
+        _volume_descriptor(
+            buf,
+            _PVD_LBA + int(joliet),
+            total,
+            _PATH_TABLE_LBA + 2 * int(joliet),
+            _dir_record(b"\x00", root_lba, SECTOR_SIZE, date, True),
+            vol_ident=vol_ident,
+            now=now,
+            joliet=joliet,
+        )
+
+    # - - terminator - - #
+    off = (_PVD_LBA + 2) * SECTOR_SIZE
+    buf[off] = 255
+    buf[off + 1 : off + 6] = b"CD001"
+    buf[off + 6] = 1
+
+    # - - file data - - #
+    for (_, _, data), extent in zip(files, extents):
+        off = extent * SECTOR_SIZE
+        buf[off : off + len(data)] = data
+
+    return bytes(buf)
@@ -3,7 +3,17 @@ class VMSpec:
         # domain
         self.dom_name = None
         self.dom_mem = None
+        self.dom_mem_current = None
         self.dom_vcpu = None
+        self.cpu_mode = None
+        self.cpu_baseline_hosts = []
+
+        # placement
+        self.cpuset = None
+        self.emulator_cpuset = None
+        self.numa_node = None
+        self.hugepages = None
+        self.density_profile = None
 
         # networking
         self.net = None
@@ -11,15 +21,22 @@ class VMSpec:
         self.ip = None
         self.gateway = None
         self.bridge_pfxlen = None
+        self.net_profile = None
 
         # storage
         self.vol_pool = None
         self.vol_size = None
         self.vol_name = None
         self.base_image = None
+        self.vol_prealloc = None
+        self.vol_cluster_size = None
+        self.vol_extended_l2 = False
+        self.disk_profile = None
 
         # misc
         self.sshpwauth = None
+        self.labels = {}
+        self.guest_agent = False
 
         # UserSpec
         self.users = []
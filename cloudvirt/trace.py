@@ -0,0 +1,96 @@
+import json
+import math
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+def percentile(samples, pct):
+    # nearest rank of an already sorted list
+    return samples[max(0, math.ceil(pct / 100 * len(samples)) - 1)]
+
+
+class Tracer:
+    # spans of the creator and nuker phases and of every libvirt call made
+    # through the APIDriver proxy, exported in the chrome trace event format
+    # that chrome://tracing and perfetto load. times are in microseconds
+    # since the tracer got created
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+        self.calls = {}
+
+        self._start = time.perf_counter()
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def _ts(self, when):
+        return (when - self._start) * 1e6
+
+    def add(self, name, cat, start, end, args=None):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": self._ts(start),
+            "dur": (end - start) * 1e6,
+            "pid": self.pid,
+            "tid": thread.ident,
+        }
+
+        if args:
+            event["args"] = args
+
+        with self._lock:
+            self.events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+            if cat == "libvirt":
+                self.calls.setdefault(name, []).append(end - start)
+
+    @contextmanager
+    def span(self, name, cat="phase", **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, cat, start, time.perf_counter(), args)
+
+    def export(self, path):
+        # worker threads show up by name instead of by ident
+        with self._lock:
+            events = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": self.pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for tid, name in self._threads.items()
+            ] + list(self.events)
+
+        with open(path, "w", encoding="utf-8") as trace_file:
+            json.dump(
+                {"traceEvents": events, "displayTimeUnit": "ms"}, trace_file, indent=1
+            )
+
+    def stats(self):
+        # {method: (calls, p50, p95, p99, max)} of the libvirt calls, in
+        # milliseconds, the busiest first
+        with self._lock:
+            calls = {k: sorted(v) for k, v in self.calls.items()}
+
+        return {
+            name: (
+                len(samples),
+                percentile(samples, 50) * 1e3,
+                percentile(samples, 95) * 1e3,
+                percentile(samples, 99) * 1e3,
+                samples[-1] * 1e3,
+            )
+            for name, samples in sorted(calls.items(), key=lambda x: (-len(x[1]), x[0]))
+        }
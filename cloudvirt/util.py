@@ -1,6 +1,75 @@
 import getpass
 import inspect
 import logging
+import os
+import threading
+
+from .errors import CloudvirtError
+
+# defaults shared by the cli and the daemon, kept here so that parsing the
+# arguments does not have to import the libvirt bindings
+DEFAULT_JOBS = 8
+NET_UPDATE_MODES = ["live", "redefine"]
+DEFAULT_WAIT_TIMEOUT = 300
+
+# reclaim keeps this much of the memory a guest uses on top of it and never
+# shrinks it below RECLAIM_MIN_MEM MiB
+RECLAIM_HEADROOM = 0.25
+RECLAIM_MIN_MEM = 512
+
+# how far the committed vcpus, memory and volume sizes may exceed the host
+# cpus, memory and the available pool space when placing vms
+DEFAULT_OVERCOMMIT = {"cpu": 4.0, "mem": 1.0, "disk": 1.0}
+
+# how long long running processes trust the cached network, pool and host
+# snapshots for
+CACHE_MAX_AGE = 30
+
+
+def merge_profile(name, defaults, overrides):
+    # the defaults of a profile updated with the overrides of a vmspec, raises
+    # ValueError on anything but a mapping of keys the profile has
+    overrides = overrides or {}
+
+    if not isinstance(overrides, dict):
+        raise ValueError(f"{name} should be a mapping")
+
+    for key in overrides:
+        if key not in defaults:
+            raise ValueError(f"{key} is not a {name} key")
+
+    return dict(defaults, **overrides)
+
+
+def replace_file(path, text):
+    # written to a temporary file first so that neither a crash nor a
+    # concurrent reader ever sees half of it. named after the thread as well,
+    # cloudvirtd writes from several
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+
+    with open(tmp_path, "w", encoding="utf-8") as tmp_file:
+        tmp_file.write(text)
+    os.replace(tmp_path, path)
+
+
+def cache_dir():
+    path = os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "cloudvirt",
+    )
+    os.makedirs(path, exist_ok=True)
+
+    return path
+
+
+def state_dir():
+    path = os.path.join(
+        os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"),
+        "cloudvirt",
+    )
+    os.makedirs(path, exist_ok=True)
+
+    return path
 
 
 def ask_q(query, passwd=False):
@@ -22,7 +91,7 @@ def ask_q(query, passwd=False):
     except (EOFError, KeyboardInterrupt):
         print()
         logging.StreamHandler.terminator = "\n"
-        logger.error("user cancelled the action, exiting")
+        raise CloudvirtError("user cancelled the action") from None
 
     logging.StreamHandler.terminator = "\n"
 
@@ -0,0 +1,362 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+import libvirt
+import yaml
+
+from .config import YAMLLoader
+from .density import resolve_density_profile
+from .disk import resolve_disk_profile
+from .driver import APIDriverVMCreator, METADATA_NS, seed_iso_name
+from .errors import CloudvirtError, SpecError
+from .journal import vmspec_digest
+from .log import DomainLoggerAdapter
+from .nic import resolve_net_profile
+from .spec import VMSpec
+
+# everything that ends up in the domain definition or the overlay of a warm
+# vm, vms are only ever claimed by vmspecs with the very same values
+PROFILE_KEYS = ("base_image", "dom_mem", "dom_vcpu", "net", "vol_pool", "vol_size")
+
+# same, but left at the vmspec defaults if a warmpool entry does not set them
+OPTIONAL_PROFILE_KEYS = {
+    "cpu_mode": None,
+    "cpuset": None,
+    "emulator_cpuset": None,
+    "numa_node": None,
+    "hugepages": None,
+    "dom_mem_current": None,
+    "density_profile": None,
+    "disk_profile": None,
+    "net_profile": None,
+    "vol_prealloc": None,
+    "vol_cluster_size": None,
+    "vol_extended_l2": False,
+}
+
+# the optional keys holding a mapping, resolved against their defaults
+PROFILE_RESOLVERS = {
+    "density_profile": resolve_density_profile,
+    "disk_profile": resolve_disk_profile,
+    "net_profile": resolve_net_profile,
+}
+
+WARM_PREFIX = "cloudvirt-warm"
+DEFAULT_REFILL_INTERVAL = 60
+
+
+def _freeze(value):
+    # profiles are dict keys, mappings such as disk_profile are kept as tuples
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+
+    return value
+
+
+def _thaw(value):
+    return {k: _thaw(v) if isinstance(v, tuple) else v for k, v in value}
+
+
+def profile_of(vmspec):
+    return tuple(
+        _freeze(getattr(vmspec, key))
+        for key in PROFILE_KEYS + tuple(OPTIONAL_PROFILE_KEYS)
+    )
+
+
+def profile_id(profile):
+    return hashlib.sha1(repr(profile).encode("utf-8")).hexdigest()[:8]
+
+
+def load_profiles(path):
+    # {profile: count} out of a yaml file with a `warmpool' list of the
+    # PROFILE_KEYS plus a count each
+    if not os.path.isfile(path):
+        raise SpecError(f"{path} is not a file")
+
+    try:
+        with open(path, "r", encoding="utf-8") as yaml_file:
+            yaml_parsed = yaml.load(yaml_file, Loader=YAMLLoader)
+    except (OSError, yaml.YAMLError) as exc:
+        raise SpecError(f"{path} parsing has failed: {exc}") from exc
+
+    if not isinstance(yaml_parsed, dict) or "warmpool" not in yaml_parsed:
+        raise SpecError(f"warmpool section in {path} is missing")
+
+    profiles = {}
+    for entry in yaml_parsed["warmpool"]:
+        for key in PROFILE_KEYS + ("count",):
+            if entry.get(key) is None:
+                raise SpecError(f"{key} is missing from a warmpool entry")
+
+        for key, resolve in PROFILE_RESOLVERS.items():
+            if entry.get(key) is None:
+                continue
+
+            try:
+                entry[key] = resolve(entry[key])
+            except ValueError as exc:
+                raise SpecError(f"{key} of a warmpool entry is invalid: {exc}") from exc
+
+        profile = [entry[key] for key in PROFILE_KEYS]
+        profile += [_freeze(entry.get(k, v)) for k, v in OPTIONAL_PROFILE_KEYS.items()]
+
+        profiles[tuple(profile)] = int(entry["count"])
+
+    return profiles
+
+
+class APIDriverWarmVMCreator(APIDriverVMCreator):
+    # defines a stopped vm of a profile with its overlay in place, the seed
+    # iso and the network entries are left to the claimer
+    def prepare(self):
+        self.logger.info("provisioning warm VM")
+
+        self._dom_exists_precheck()
+        self.vmspec.mac_addr = self._genmac()
+
+        pool_snapshot = self.driver.cache.pool(self.vmspec.vol_pool)
+        self._pool = pool_snapshot.pool
+        self._pool_path = pool_snapshot.path
+        self._base_image_precheck(pool_snapshot)
+
+        self._gen_volume()
+        self._gen_dom()
+
+    def create(self, wait=None):
+        # the placement reserved for it is not held while it sits stopped
+        try:
+            self.prepare()
+        finally:
+            self.release()
+
+
+class APIDriverVMClaimer(APIDriverVMCreator):
+    # turns a warm vm into the one described by the vmspec: define, rename,
+    # insert the seed and start instead of generating the overlay and the
+    # domain from scratch
+    def __init__(self, driver, vmspec, warm_name, net_batch=None):
+        super().__init__(driver, vmspec, net_batch)
+        self.warm_name = warm_name
+
+        self._dom = None
+        self._claimed = False
+
+    def _claim(self):
+        # the pool is shared, another process may have claimed the warm vm
+        # since it got taken. the next one is tried then, None once they are
+        # all gone
+        while self.warm_name is not None:
+            self.logger.info("claiming warm VM %s", self.warm_name)
+
+            try:
+                self._dom = self.driver.lookupByName(self.warm_name)
+                self._dom.rename(self.vmspec.dom_name, 0)
+                self._claimed = True
+                break
+            except libvirt.libvirtError as exc:
+                self.logger.info("could not claim %s: %s", self.warm_name, exc)
+                self.warm_name = self.driver.warm_pool.take(self.vmspec)
+
+        if self.warm_name is None:
+            return None
+
+        domxml_root = ET.fromstring(self._dom.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE))
+
+        self.vmspec.mac_addr = domxml_root.find("devices/interface/mac").attrib[
+            "address"
+        ]
+        self.vmspec.vol_name = domxml_root.find(
+            "devices/disk[@device='disk']/source"
+        ).attrib["volume"]
+
+        return domxml_root
+
+    def release(self):
+        # a warm vm taken by a create that failed before claiming it is left
+        # for the next one
+        super().release()
+
+        if not self._claimed and self.warm_name is not None:
+            self.driver.warm_pool.put_back(self.warm_name)
+            self.warm_name = None
+
+    def _insert_seed(self, domxml_root):
+        self.logger.info("inserting the cloud-init ISO")
+
+        cdrom = domxml_root.find("devices/disk[@device='cdrom']")
+
+        source = cdrom.find("source")
+        if source is None:
+            source = ET.SubElement(cdrom, "source")
+
+        source.attrib.update(
+            {"pool": self.vmspec.vol_pool, "volume": self._cloudinit_iso}
+        )
+
+        self._dom.updateDeviceFlags(
+            ET.tostring(cdrom, encoding="unicode"), libvirt.VIR_DOMAIN_AFFECT_CONFIG
+        )
+
+    def _set_labels(self):
+        if not self.vmspec.labels:
+            return
+
+        self._dom.setMetadata(
+            libvirt.VIR_DOMAIN_METADATA_ELEMENT,
+            ET.tostring(self._gen_labels(), encoding="unicode"),
+            "cloudvirt",
+            METADATA_NS,
+            libvirt.VIR_DOMAIN_AFFECT_CONFIG,
+        )
+
+    def prepare(self):
+        self.logger.info("creating VM from the warm pool: %s", self.vmspec.dom_name)
+
+        self._dom_exists_precheck()
+        needs_net_update = self._network_precheck()
+
+        pool_snapshot = self.driver.cache.pool(self.vmspec.vol_pool)
+        self._pool = pool_snapshot.pool
+        self._pool_path = pool_snapshot.path
+
+        # journaled like a regular create so that a failed claim can be
+        # rolled back, it is never resumed though
+        if self.driver.journal is not None:
+            self._entry = self.driver.journal.begin(
+                self.vmspec,
+                vmspec_digest(self.vmspec),
+                seed_iso_name(self.vmspec.dom_name),
+            )
+
+        domxml_root = self._claim()
+        if domxml_root is None:
+            # the address the prechecks claimed is taken again by the regular
+            # ones
+            self.logger.info("no warm VM left, creating it from scratch")
+            self.release()
+            self._entry = None
+
+            super().prepare()
+            return
+
+        self._defined_at = time.monotonic()
+
+        self._done("claim")
+
+        self._gen_cloudinit_iso()
+        self._done("iso")
+
+        self._insert_seed(domxml_root)
+        self._set_labels()
+
+        if needs_net_update:
+            self._update_net()
+
+
+class WarmPool:
+    # keeps `count' defined but stopped vms per profile. the pool itself is
+    # just the domains named WARM_PREFIX-<profile id>-*, so any process
+    # sharing the libvirt instance sees the same pool
+    def __init__(self, driver, profiles=None, interval=DEFAULT_REFILL_INTERVAL):
+        self.driver = driver
+        self.profiles = dict(profiles or {})
+        self.interval = interval
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self._taken = set()
+        self._lock = threading.Lock()
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _warm_names(self, profile):
+        return self.driver.select_domains([f"{WARM_PREFIX}-{profile_id(profile)}-*"])
+
+    def take(self, vmspec):
+        profile = profile_of(vmspec)
+
+        with self._lock:
+            names = self._warm_names(profile)
+
+            # claimed ones are renamed, forget about them
+            self._taken &= set(names)
+
+            for name in names:
+                if name not in self._taken:
+                    self._taken.add(name)
+                    self._wakeup.set()
+
+                    return name
+
+        return None
+
+    def put_back(self, name):
+        with self._lock:
+            self._taken.discard(name)
+
+    def claimer(self, vmspec, net_batch=None):
+        warm_name = self.take(vmspec)
+        if warm_name is None:
+            return None
+
+        return APIDriverVMClaimer(self.driver, vmspec, warm_name, net_batch)
+
+    @staticmethod
+    def _warm_vmspec(profile):
+        vmspec = VMSpec()
+        for key, value in zip(PROFILE_KEYS + tuple(OPTIONAL_PROFILE_KEYS), profile):
+            if key in PROFILE_RESOLVERS and value is not None:
+                value = _thaw(value)
+
+            setattr(vmspec, key, value)
+
+        vmspec.dom_name = f"{WARM_PREFIX}-{profile_id(profile)}-{uuid.uuid4().hex[:8]}"
+        vmspec.vol_name = f"{vmspec.dom_name}-vol.qcow2"
+
+        # harmless without an agent in the guest, lets any claimer use --wait
+        vmspec.guest_agent = True
+
+        return vmspec
+
+    def refill(self):
+        for profile, count in self.profiles.items():
+            missing = count - len(self._warm_names(profile))
+
+            for _ in range(max(0, missing)):
+                vmspec = self._warm_vmspec(profile)
+                logger = DomainLoggerAdapter(self.logger, {"dom_name": vmspec.dom_name})
+
+                try:
+                    APIDriverWarmVMCreator(self.driver, vmspec).create()
+                except (CloudvirtError, libvirt.libvirtError) as exc:
+                    logger.warning("provisioning failed: %s", exc)
+                    break
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refill()
+
+            # claims kick the loop so that the pool is topped up right away
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="cloudvirt-warmpool", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+        if self._thread is not None:
+            self._thread.join()
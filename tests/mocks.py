@@ -0,0 +1,410 @@
+import os
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from cloudvirt.driver import APIDriver
+from cloudvirt.spec import VMSpec, UserSpec
+
+PASSWORD_HASH = (
+    "$y$j9T$0i28VV.7n07tAyGUHDPzz0$7N1jxo6jUWHafKq1hMX9bvHMq4oIMiu.1v7yv.tB.GD"
+)
+
+
+def get_testfile(name):
+    return os.path.join(os.path.dirname(__file__), name)
+
+
+def get_driver(pool_path, url="qemu:///system"):
+    driver = APIDriver(url)
+    driver.conn = MockDriver(pool_path)
+
+    return driver
+
+
+def get_vmspec(dom_name, password=False, **kwargs):
+    vmspec = VMSpec()
+    vmspec.dom_name = dom_name
+    vmspec.dom_mem = 2
+    vmspec.dom_vcpu = 2
+    vmspec.net = "test_net"
+    vmspec.vol_pool = "test_pool"
+    vmspec.vol_size = 25
+    vmspec.base_image = "test.img"
+    vmspec.vol_name = f"{dom_name}-vol.qcow2"
+
+    for key, value in kwargs.items():
+        setattr(vmspec, key, value)
+
+    testuser = UserSpec()
+    testuser.name = "mytestname"
+    if password:
+        vmspec.sshpwauth = True
+        testuser.password_hash = PASSWORD_HASH
+    else:
+        testuser.ssh_keys = ["ssh-lol 123123123"]
+    vmspec.users.append(testuser)
+
+    return vmspec
+
+
+class MockStream:
+    def __init__(self):
+        self.data = b""
+        self.finished = False
+
+    def send(self, data):
+        self.data += bytes(data)
+        return len(data)
+
+    def finish(self):
+        self.finished = True
+
+    def abort(self):
+        pass
+
+
+class MockStorageVol:
+    def __init__(self, xml=None):
+        self.xml = xml
+        self.stream = None
+
+    def upload(
+        self, stream, offset, length, flags=0
+    ):  # pylint: disable=unused-argument
+        self.stream = stream
+
+    def delete(self):
+        return None
+
+    def XMLDesc(self, flags=0):  # pylint: disable=unused-argument
+        return self.xml
+
+
+class MockDirStoragePool:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+        self.created_vols = []
+
+        # what storageVolLookupByName() reports for the base images
+        self.base_format = "qcow2"
+        self.base_capacity = 3758096384
+        self.base_lookups = 0
+
+        # volumes storageVolLookupByName() does not find
+        self.missing_vols = set()
+
+    def XMLDesc(self):
+        xml = f"""
+            <pool type='dir'>
+              <name>{self.name}</name>
+              <uuid>ac3311e0-4886-45e4-8134-8428a594547b</uuid>
+              <capacity unit='bytes'>527298895872</capacity>
+              <allocation unit='bytes'>91432857600</allocation>
+              <available unit='bytes'>435866038272</available>
+              <source>
+              </source>
+              <target>
+                <path>{self.path}</path>
+                <permissions>
+                  <mode>0755</mode>
+                  <owner>1000</owner>
+                  <group>1000</group>
+                </permissions>
+              </target>
+            </pool>
+        """
+        return xml
+
+    def createXML(self, xml, weird_number):  # pylint: disable=unused-argument
+        if weird_number not in [0, libvirt.VIR_STORAGE_VOL_CREATE_PREALLOC_METADATA]:
+            raise ValueError("what the fuck weird number did you pass?")
+
+        vol = MockStorageVol(xml)
+        self.created_vols.append(vol)
+
+        return vol
+
+    def refresh(self):
+        return 0
+
+    def storageVolLookupByName(self, name):
+        if name in self.missing_vols:
+            raise libvirt.libvirtError(f"Storage volume not found: {name}")
+
+        self.base_lookups += 1
+
+        return MockStorageVol(f"""
+            <volume type='file'>
+              <name>{name}</name>
+              <capacity unit='bytes'>{self.base_capacity}</capacity>
+              <target>
+                <path>{self.path}/{name}</path>
+                <format type='{self.base_format}'/>
+              </target>
+            </volume>
+            """)
+
+
+class MockNetwork:
+    def __init__(self, name, dhcp_start="192.168.254.128", dhcp_end="192.168.254.254"):
+        self.name = name
+        self.dhcp_start = dhcp_start
+        self.dhcp_end = dhcp_end
+
+        self.updates = []
+
+    def isActive(self):
+        return 1
+
+    def XMLDesc(self, flags=0):  # pylint: disable=unused-argument
+        xml = f"""
+            <network>
+              <name>{self.name}</name>
+              <uuid>803cb35a-75e9-451f-97d2-9b758b0102ef</uuid>
+              <forward mode='nat'>
+                <nat>
+                  <port start='1024' end='65535'/>
+                </nat>
+              </forward>
+              <bridge name='virbr1' stp='on' delay='0'/>
+              <mac address='52:54:00:87:8f:71'/>
+              <domain name='cloudvirt-net'/>
+              <ip address='192.168.254.1' netmask='255.255.255.0'>
+                <dhcp>
+                  <range start="{self.dhcp_start}" end="{self.dhcp_end}"/>
+                </dhcp>
+              </ip>
+            </network>
+        """
+
+        return xml
+
+    def DHCPLeases(self, mac=None, flags=0):  # pylint: disable=unused-argument
+        return []
+
+    # fmt: off
+    def update(self, command, section, parentIndex, xml, flags=0): # pylint: disable=unused-argument
+        self.updates.append((command, section, xml))
+    # fmt: on
+
+
+class MockDom:
+    def __init__(self, xml=None, conn=None):
+        self.xml = xml
+        self.conn = conn
+
+        # what getAllDomainStats() reports, and what setMemoryFlags() set
+        self.balloon_stats = {}
+        self.memory = None
+
+    def create(self):
+        if self.conn is None:
+            return
+
+        self.conn.emit(
+            self,
+            libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+            libvirt.VIR_DOMAIN_EVENT_STARTED,
+        )
+
+        if "org.qemu.guest_agent.0" in self.XMLDesc():
+            self.conn.emit(
+                self,
+                libvirt.VIR_DOMAIN_EVENT_ID_AGENT_LIFECYCLE,
+                libvirt.VIR_CONNECT_DOMAIN_EVENT_AGENT_LIFECYCLE_STATE_CONNECTED,
+            )
+
+    def rename(self, new_name, flags):  # pylint: disable=unused-argument
+        dom_root = ET.fromstring(self.XMLDesc())
+        old_name = dom_root.find("name").text
+        dom_root.find("name").text = new_name
+
+        self.xml = ET.tostring(dom_root, encoding="unicode")
+        self.conn._known_doms[new_name] = self.conn._known_doms.pop(old_name)
+
+    def updateDeviceFlags(self, xml, flags):  # pylint: disable=unused-argument
+        dom_root = ET.fromstring(self.XMLDesc())
+        devices = dom_root.find("devices")
+        device = ET.fromstring(xml)
+
+        for disk in devices.findall("disk"):
+            if disk.find("target").attrib == device.find("target").attrib:
+                devices.remove(disk)
+        devices.append(device)
+
+        self.xml = ET.tostring(dom_root, encoding="unicode")
+
+    def setMetadata(self, kind, metadata, key, uri, flags):
+        # pylint: disable=unused-argument
+        dom_root = ET.fromstring(self.XMLDesc())
+        ET.SubElement(dom_root, "metadata").append(ET.fromstring(metadata))
+
+        self.xml = ET.tostring(dom_root, encoding="unicode")
+
+    def XMLDesc(self, flags=0):  # pylint: disable=unused-argument
+        if self.xml:
+            return self.xml
+
+        domxml_path = get_testfile("realdom.xml")
+
+        domxml = None
+        with open(domxml_path, "r", encoding="utf-8") as f:
+            domxml = f.read()
+
+        return domxml
+
+    def name(self):
+        return ET.fromstring(self.XMLDesc()).findall("name")[0].text
+
+    def metadata(self, kind, uri):  # pylint: disable=unused-argument
+        meta = ET.fromstring(self.XMLDesc()).find(f"metadata/{{{uri}}}cloudvirt")
+        if meta is None:
+            raise libvirt.libvirtError("no metadata")
+
+        return ET.tostring(meta, encoding="unicode")
+
+    def isActive(self):
+        # lol this is probably a stupid idea i will forget about
+        return 1
+
+    def interfaceAddresses(self, src):
+        if src in [
+            libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_LEASE,
+            libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_AGENT,
+        ]:
+            # only the domains created by the tests have booted
+            if self.xml is None:
+                return {}
+
+            mac = ET.fromstring(self.xml).find("devices/interface/mac")
+            return {
+                "vnet0": {
+                    "addrs": [{"addr": "192.168.254.140", "prefix": 24, "type": 0}],
+                    "hwaddr": mac.attrib["address"],
+                }
+            }
+
+        if src == libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_ARP:
+            return {
+                "vnet0": {
+                    "addrs": [{"addr": "192.168.254.131", "prefix": 0, "type": 0}],
+                    "hwaddr": "52:54:60:38:67:43",
+                }
+            }
+
+    def setMemoryFlags(self, memory, flags):  # pylint: disable=unused-argument
+        self.memory = memory
+
+    def destroy(self):
+        return 0
+
+    def undefine(self):
+        if self.conn is not None:
+            del self.conn._known_doms[self.name()]
+
+        return 0
+
+
+class MockDriver:
+    def __init__(self, pool_path):
+        self.pool_path = pool_path
+
+        self._known_doms = {"test_nuke_dom": MockDom()}
+
+        self.net_lookups = 0
+        self.dom_event_cbs = {}
+        self.baselines = 0
+
+        # what getInfo() reports, memory in MiB
+        self.host_cpus = 8
+        self.host_memory = 16384
+
+        # what getLibVersion() and getVersion() report
+        self.lib_version = 10000000
+        self.version = 8002000
+
+    def networkLookupByName(self, name):
+        self.net_lookups += 1
+        return MockNetwork(name)
+
+    def storagePoolLookupByName(self, name):  # pylint: disable=unused-argument
+        return MockDirStoragePool("test_pool", self.pool_path)
+
+    def newStream(self, flags=0):  # pylint: disable=unused-argument
+        return MockStream()
+
+    def networkDefineXML(self, xml):
+        self.defined_net_xml = xml  # pylint: disable=attribute-defined-outside-init
+
+    def defineXML(self, xml):
+        dom_xml = ET.ElementTree(ET.fromstring(xml))
+        dom_root = dom_xml.getroot()
+        name = dom_root.findall("name")[0].text
+        self._known_doms[name] = MockDom(xml, self)
+
+    def listAllDomains(self, flags=0):  # pylint: disable=unused-argument
+        return list(self._known_doms.values())
+
+    def domainEventRegisterAny(self, dom, event_id, cb, opaque):
+        # pylint: disable=unused-argument
+        callback_id = len(self.dom_event_cbs)
+        self.dom_event_cbs[callback_id] = (event_id, cb, opaque)
+
+        return callback_id
+
+    def getCapabilities(self):
+        return (
+            "<capabilities><host><cpu><arch>x86_64</arch>"
+            "<model>Skylake-Server-IBRS</model><vendor>Intel</vendor></cpu>"
+            "<topology><cells num='2'>"
+            "<cell id='0'><cpus num='4'><cpu id='0'/><cpu id='1'/><cpu id='2'/>"
+            "<cpu id='3'/></cpus></cell>"
+            "<cell id='1'><cpus num='4'><cpu id='4'/><cpu id='5'/><cpu id='6'/>"
+            "<cpu id='7'/></cpus></cell>"
+            "</cells></topology></host></capabilities>"
+        )
+
+    def getCellsFreeMemory(self, first, count):  # pylint: disable=unused-argument
+        return [4 << 30, 6 << 30]
+
+    def getInfo(self):
+        return ["x86_64", self.host_memory, self.host_cpus, 2400, 2, 1, 4, 1]
+
+    def getFreeMemory(self):
+        return self.host_memory << 19
+
+    def getLibVersion(self):
+        return self.lib_version
+
+    def getVersion(self):
+        return self.version
+
+    def baselineHypervisorCPU(self, emulator, arch, machine, virttype, xmls, flags):
+        # pylint: disable=unused-argument,too-many-arguments
+        self.baselines += 1
+        model = ET.fromstring(xmls[0]).find("model").text
+
+        return f"<cpu mode='custom' match='exact'><model>{model}</model></cpu>"
+
+    def getAllDomainStats(self, stats, flags):  # pylint: disable=unused-argument
+        return [(dom, dom.balloon_stats) for dom in self._known_doms.values()]
+
+    def emit(self, dom, event_id, event):
+        for cb_event_id, cb, opaque in list(self.dom_event_cbs.values()):
+            if cb_event_id == event_id:
+                cb(self, dom, event, 0, opaque)
+
+    def domainEventDeregisterAny(self, callback_id):
+        del self.dom_event_cbs[callback_id]
+
+    def lookupByName(self, name):
+        if name == "existing_dom":
+            raise libvirt.libvirtError("already exists!")
+
+        if name in self._known_doms:
+            return self._known_doms[name]
+
+        raise libvirt.libvirtError("Nothing found baybe!!")
@@ -0,0 +1,87 @@
+import tempfile
+import unittest
+
+from cloudvirt.api import Client, vmspec_from_dict, vmspecs_from_dicts
+from cloudvirt.errors import SpecError
+
+from tests.mocks import MockDriver
+
+
+class InProcessAPI(unittest.TestCase):
+    def setUp(self):
+        self.vol_dir = (
+            tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        )
+
+    def tearDown(self):
+        self.vol_dir.cleanup()
+
+    def test_specs(self):
+        users = [{"name": "mytestname", "ssh_keys": ["ssh-lol 123123123"]}]
+        vmspec_doc = {
+            "dom_name": "test_dom",
+            "dom_mem": 2048,
+            "dom_vcpu": 2,
+            "net": "test_net",
+            "vol_pool": "test_pool",
+            "vol_size": 25,
+            "ip": "192.168.254.129",
+            "labels": {"role": "web"},
+        }
+
+        vmspec = vmspec_from_dict(vmspec_doc, users)
+        self.assertEqual(vmspec.ip, "192.168.254.129")
+        self.assertEqual(vmspec.labels, {"role": "web"})
+        self.assertEqual(vmspec.users[0].ssh_keys, ["ssh-lol 123123123"])
+
+        with self.assertRaises(SpecError):
+            vmspec_from_dict(dict(vmspec_doc, vol_size=None), users)
+
+        with self.assertRaises(SpecError):
+            vmspecs_from_dicts([vmspec_doc, vmspec_doc], users)
+
+        with self.assertRaises(SpecError):
+            vmspec_from_dict(vmspec_doc, [{"name": "mytestname"}])
+
+    def test_create_nuke(self):
+        client = Client(journal=False)
+        client.driver.conn = MockDriver(self.vol_dir.name)
+
+        vmspecs = vmspecs_from_dicts(
+            [
+                {
+                    "dom_name": dom_name,
+                    "dom_mem": 2,
+                    "dom_vcpu": 2,
+                    "net": "test_net",
+                    "vol_pool": "test_pool",
+                    "vol_size": 25,
+                    "base_image": "test.img",
+                    "ip": "auto",
+                }
+                for dom_name in ["test_dom_0", "existing_dom"]
+            ],
+            [{"name": "mytestname", "ssh_keys": ["ssh-lol 123123123"]}],
+        )
+
+        results = client.create_many(vmspecs, jobs=2)
+
+        self.assertTrue(results["test_dom_0"].ok)
+        self.assertEqual(results["test_dom_0"].mac_addr, vmspecs[0].mac_addr)
+        self.assertTrue(results["test_dom_0"].ip.startswith("192.168.254."))
+        self.assertEqual(
+            results["test_dom_0"].volumes,
+            [
+                ("test_pool", "test_dom_0-vol.qcow2"),
+                ("test_pool", "test_dom_0-cloudinit.iso"),
+            ],
+        )
+
+        self.assertFalse(results["existing_dom"].ok)
+        self.assertEqual(results["existing_dom"].volumes, [])
+
+        results = client.nuke_many(["test_dom_0", "nonexistant_dom"])
+
+        self.assertTrue(results["test_dom_0"].ok)
+        self.assertEqual(len(results["test_dom_0"].volumes), 2)
+        self.assertFalse(results["nonexistant_dom"].ok)
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+from cloudvirt.cli import CLI
+from cloudvirt.driver import APIDriver
+from cloudvirt.errors import CloudvirtError
+
+from tests.mocks import MockDriver
+
+HEAVY_MODULES = ["libvirt", "pycdlib", "passlib", "yaml"]
+
+
+class Startup(unittest.TestCase):
+    def test_lazy_imports(self):
+        # a fresh interpreter, this one already has everything imported
+        proc = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, cloudvirt.cli; print('\\n'.join(sys.modules))",
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+
+        modules = proc.stdout.split()
+        for name in HEAVY_MODULES:
+            self.assertNotIn(name, modules)
+
+
+class Create(unittest.TestCase):
+    def test_host_connections(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            vmspec_path = os.path.join(tmpdir, "vmspec.yml")
+            with open(vmspec_path, "w", encoding="utf-8") as vmspec_file:
+                vmspec_file.write(
+                    "vmspec:\n  dom_name: test_dom\n  dom_mem: 2048\n"
+                    "  dom_vcpu: 2\n  net: test_net\n  vol_pool: test_pool\n"
+                    "  vol_size: 25\n"
+                )
+
+            userspec_path = os.path.join(tmpdir, "userspec.yml")
+            with open(userspec_path, "w", encoding="utf-8") as userspec_file:
+                userspec_file.write(
+                    "userspec:\n  - name: mytestname\n    ssh_keys: [ssh-lol 123]\n"
+                )
+
+            argv = ["cloudvirt", "--no-daemon", "create", "--users", userspec_path]
+            argv += ["--host", "qemu+ssh://a/system", "--host", "qemu+ssh://a/system"]
+            argv += ["--host", "qemu+ssh://b/system", vmspec_path]
+
+            connected, closed = [], []
+
+            def connect(driver):
+                connected.append(driver.url)
+                if driver.url == "qemu+ssh://b/system":
+                    raise CloudvirtError("unreachable")
+
+                driver.conn = MockDriver(tmpdir)
+
+            # a host given twice is connected to once, and the ones connected
+            # before one that failed are closed again
+            with unittest.mock.patch("sys.argv", argv), unittest.mock.patch.dict(
+                os.environ, {"XDG_STATE_HOME": tmpdir}
+            ), unittest.mock.patch.object(
+                APIDriver, "connect", autospec=True, side_effect=connect
+            ), unittest.mock.patch.object(
+                APIDriver,
+                "close",
+                autospec=True,
+                side_effect=lambda driver: closed.append(driver.url),
+            ):
+                with self.assertRaises(SystemExit):
+                    CLI().run()
+
+            self.assertEqual(
+                connected,
+                ["qemu:///system", "qemu+ssh://a/system", "qemu+ssh://b/system"],
+            )
+            self.assertEqual(closed, ["qemu+ssh://a/system"])
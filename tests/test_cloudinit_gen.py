@@ -1,10 +1,13 @@
+import io
 import unittest
 
+import pycdlib
 import yaml
 
 from cloudvirt.spec import UserSpec
 from cloudvirt.spec import VMSpec
 from cloudvirt.cloudinit import CloudInit
+from cloudvirt.nic import resolve_net_profile
 
 
 class CreateCloudInit(unittest.TestCase):
@@ -102,3 +105,92 @@ class CreateCloudInit(unittest.TestCase):
             netplan_id0["routes"],
             [{"to": "0.0.0.0/0", "via": "192.168.254.1", "on-link": True}],
         )
+
+    def test_netconf_offloads(self):
+        vmspec = VMSpec()
+        vmspec.dom_name = "test_dom"
+        vmspec.mac_addr = "0a:ba:d1:de:a0:ff"
+        vmspec.net_profile = resolve_net_profile(
+            {"offloads": {"tso4": False, "ecn": False}}
+        )
+
+        testuser = UserSpec()
+        testuser.name = "mytestname"
+        testuser.ssh_keys = ["ssh-lol 123123123"]
+        vmspec.users.append(testuser)
+
+        cloudinit = CloudInit(vmspec)
+
+        # dhcp vms get a network-config as well once offloads are toggled
+        files = cloudinit._gen_files()  # pylint: disable=protected-access
+        self.assertIn("network-config", [name for _, name, _ in files])
+
+        netplan_id0 = yaml.safe_load(cloudinit.netconf)["network"]["ethernets"]["id0"]
+        self.assertEqual(
+            netplan_id0,
+            {
+                "match": {"macaddress": "0a:ba:d1:de:a0:ff"},
+                "dhcp4": True,
+                "tcp-segmentation-offload": False,
+            },
+        )
+
+    def test_mkiso_fast(self):
+        vmspec = VMSpec()
+
+        testuser = UserSpec()
+        testuser.name = "mytestname"
+        testuser.ssh_keys = ["ssh-lol 123123123"]
+
+        vmspec.dom_name = "test_dom"
+        vmspec.ip = "192.168.254.129"
+        vmspec.gateway = "192.168.254.1"
+        vmspec.bridge_pfxlen = "24"
+        vmspec.mac_addr = "0a:ba:d1:de:a0:ff"
+
+        vmspec.users.append(testuser)
+
+        cloudinit = CloudInit(vmspec)
+
+        # both writers have to produce images the pycdlib reader agrees on
+        listings = []
+        for fast in [True, False]:
+            iso = pycdlib.PyCdlib()
+            iso.open_fp(io.BytesIO(cloudinit.mkiso(fast=fast)))
+
+            self.assertEqual(iso.pvd.volume_identifier.rstrip(), b"CIDATA")
+
+            # the fast writer has no rock ridge, a mount shows the joliet names
+            # instead which have to be the same
+            self.assertEqual(iso.has_rock_ridge(), not fast)
+            path_type = "joliet_path" if fast else "rr_path"
+
+            listing = {}
+            for child in iso.list_children(**{path_type: "/"}):
+                if child.is_dot() or child.is_dotdot():
+                    continue
+
+                if fast:
+                    name = child.file_identifier().decode("utf-16-be")
+                else:
+                    name = child.rock_ridge.name().decode("utf-8")
+
+                out = io.BytesIO()
+                iso.get_file_from_iso_fp(out, **{path_type: f"/{name}"})
+                listing[name] = out.getvalue()
+
+            listings.append(listing)
+
+            for iso_name, name, data in [
+                ("UDATA.;1", "user-data", cloudinit.udata),
+                ("MDATA.;1", "meta-data", cloudinit.mdata),
+                ("NDATA.;1", "network-config", cloudinit.netconf),
+            ]:
+                for path in [{"iso_path": f"/{iso_name}"}, {"joliet_path": f"/{name}"}]:
+                    out = io.BytesIO()
+                    iso.get_file_from_iso_fp(out, **path)
+                    self.assertEqual(out.getvalue(), data)
+
+            iso.close()
+
+        self.assertEqual(listings[0], listings[1])
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from cloudvirt.api import vmspecs_from_dicts
+from cloudvirt.config import ConfigYAML
+from cloudvirt.errors import SpecError
+
+
+class SpecLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = (
+            tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w", encoding="utf-8") as yaml_file:
+            yaml_file.write(text)
+
+        return path
+
+    def test_errors_at_once(self):
+        vmspec_docs = [
+            {
+                "dom_name": "test_dom_0",
+                "dom_mem": "lots",
+                "dom_vcpu": 2,
+                "net": "test_net",
+                "vol_pool": "test_pool",
+                "sshpwauth": "yes",
+            },
+            {"dom_mem": 2048, "dom_vcpu": 2, "net": "test_net", "vol_pool": "x"},
+        ]
+
+        with self.assertRaises(SpecError) as ctx:
+            vmspecs_from_dicts(vmspec_docs, [{"name": "mytestname", "ssh_keys": []}])
+
+        err = str(ctx.exception)
+        self.assertIn("6 errors in the specs", err)
+        self.assertIn("test_dom_0: dom_mem should be an int", err)
+        self.assertIn("test_dom_0: vol_size is missing", err)
+        self.assertIn("test_dom_0: sshpwauth should be a bool", err)
+        self.assertIn("vmspec #2: dom_name is missing", err)
+        self.assertIn("vmspec #2: vol_size is missing", err)
+        self.assertIn("user mytestname: ssh_keys should be a list", err)
+
+    def test_safe_loader(self):
+        vmspec_path = self.write(
+            "vmspec.yml", "vmspec: !!python/object/apply:os.getcwd []\n"
+        )
+
+        with self.assertRaises(SpecError):
+            ConfigYAML(vmspec_path, None, None).run()
+
+    def test_userspec_cache(self):
+        vmspec_path = self.write(
+            "vmspec.yml",
+            "vmspec:\n  dom_name: test_dom\n  dom_mem: 2048\n  dom_vcpu: 2\n"
+            "  net: test_net\n  vol_pool: test_pool\n  vol_size: 25\n",
+        )
+        userspec_path = self.write(
+            "userspec.yml",
+            "userspec:\n  - name: mytestname\n    ssh_keys: [ssh-lol 123]\n",
+        )
+
+        read_yaml = ConfigYAML._read_yaml  # pylint: disable=protected-access
+
+        def load(expected_reads):
+            with unittest.mock.patch.object(
+                ConfigYAML, "_read_yaml", side_effect=read_yaml
+            ) as reads:
+                config = ConfigYAML(vmspec_path, userspec_path, None)
+                config.run()
+
+            self.assertEqual(reads.call_count, expected_reads)
+
+            return config.vmspecs[0].users[0]
+
+        self.assertEqual(load(2).ssh_keys, ["ssh-lol 123"])
+        self.assertEqual(load(1).ssh_keys, ["ssh-lol 123"])
+
+        self.write(
+            "userspec.yml",
+            "userspec:\n  - name: mytestname\n    ssh_keys: [ssh-lol 12345]\n",
+        )
+        self.assertEqual(load(2).ssh_keys, ["ssh-lol 12345"])
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+from cloudvirt.cli import CLI
+from cloudvirt.daemon import Daemon, DaemonClient, DaemonServer
+from cloudvirt.errors import CloudvirtError
+
+from tests.mocks import get_driver
+
+
+class CloudvirtDaemon(unittest.TestCase):
+    def test_requests(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            daemon = Daemon(os.path.join(tmpdir, "cloudvirtd.sock"))
+            daemon.driver = get_driver(tmpdir)
+
+            server = DaemonServer(daemon.socket_path, daemon)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+            try:
+                client = DaemonClient(daemon.socket_path)
+                self.assertTrue(client.available())
+
+                response = client.request({"command": "list"})
+                self.assertEqual(
+                    response,
+                    {
+                        "ok": True,
+                        "domains": [{"name": "test_nuke_dom", "active": True}],
+                    },
+                )
+
+                response = client.request({"command": "select", "names": ["test_*"]})
+                self.assertEqual(response["dom_names"], ["test_nuke_dom"])
+
+                response = client.request({"command": "reboot"})
+                self.assertFalse(response["ok"])
+
+                self.assertTrue(client.serves("qemu:///system"))
+                self.assertFalse(client.serves("qemu+ssh://other/system"))
+
+                response = client.request(
+                    {"command": "list", "url": "qemu+ssh://other/system"}
+                )
+                self.assertFalse(response["ok"])
+
+                # anyone could be listening behind a writable socket
+                os.chmod(daemon.socket_path, 0o666)
+                self.assertFalse(client.available())
+                self.assertFalse(client.serves("qemu:///system"))
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def test_foreign_connect(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            daemon = Daemon(os.path.join(tmpdir, "cloudvirtd.sock"))
+            daemon.driver = get_driver(tmpdir)
+
+            server = DaemonServer(daemon.socket_path, daemon)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+            argv = ["cloudvirt", "-c", "qemu+ssh://other/system"]
+            argv += ["--socket", daemon.socket_path, "nuke", "--noconfirm", "test_*"]
+
+            try:
+                # the cli goes for the other host itself instead
+                with unittest.mock.patch("sys.argv", argv), unittest.mock.patch(
+                    "cloudvirt.driver.APIDriver.connect",
+                    side_effect=CloudvirtError("direct"),
+                ) as connect:
+                    with self.assertRaises(SystemExit):
+                        CLI().run()
+
+                connect.assert_called_once()
+                self.assertIn("test_nuke_dom", daemon.driver.conn._known_doms)
+            finally:
+                server.shutdown()
+                server.server_close()
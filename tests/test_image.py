@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from cloudvirt.image import ImageImporter, ImageRegistry
+
+from tests.mocks import get_driver
+
+
+class ImportImage(unittest.TestCase):
+    def test_import(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            driver = get_driver(tmpdir)
+
+            pool = driver.cache.pool("test_pool").pool
+            pool.missing_vols.add("cloud.img")
+
+            image = b"QFI\xfb" + os.urandom(4096)
+            for name in ["cloud.img", "copy.img"]:
+                with open(os.path.join(tmpdir, name), "wb") as image_file:
+                    image_file.write(image)
+
+            importer = ImageImporter(
+                driver, "test_pool", ImageRegistry(os.path.join(tmpdir, "images.json"))
+            )
+
+            with unittest.mock.patch(
+                "cloudvirt.image.image_info", return_value=("qcow2", 2 * 1024**3)
+            ), unittest.mock.patch(
+                "cloudvirt.image.optimize_image",
+                side_effect=lambda src, fmt, dst: shutil.copy(src, dst),
+            ) as optimize:
+                self.assertEqual(
+                    importer.run(os.path.join(tmpdir, "cloud.img")), "cloud.img"
+                )
+                self.assertEqual(pool.created_vols[-1].stream.data, image)
+                self.assertTrue(pool.created_vols[-1].stream.finished)
+
+                # the same contents are not imported again under another name
+                pool.missing_vols.clear()
+                self.assertEqual(
+                    importer.run(os.path.join(tmpdir, "copy.img")), "cloud.img"
+                )
+                self.assertEqual(optimize.call_count, 1)
+
+                # unless the volume is gone from the pool
+                pool.missing_vols.add("cloud.img")
+                importer.run(os.path.join(tmpdir, "cloud.img"))
+                self.assertEqual(optimize.call_count, 2)
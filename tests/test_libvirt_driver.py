@@ -1,173 +1,43 @@
+import asyncio
+import json
 import os
 import tempfile
+import threading
 import unittest
+import unittest.mock
 import xml.etree.ElementTree as ET
 
 import libvirt
 
+from cloudvirt.aio import AsyncAPIDriver
+from cloudvirt.cpu import CPUBaseline
+from cloudvirt.density import Reclaimer, resolve_density_profile
+from cloudvirt.disk import resolve_disk_profile
 from cloudvirt.driver import APIDriverVMCreator
 from cloudvirt.driver import APIDriverVMNuker
+from cloudvirt.errors import ConflictError, SpecError
+from cloudvirt.journal import CreateJournal
+from cloudvirt.netbatch import NetworkUpdateBatch
+from cloudvirt.nic import resolve_net_profile
+from cloudvirt.scheduler import Scheduler
+from cloudvirt.trace import Tracer
+from cloudvirt.warmpool import WarmPool, profile_of
 from cloudvirt.spec import VMSpec, UserSpec
 
-
-def get_testfile(name):
-    return os.path.join(os.path.dirname(__file__), name)
-
-
-class MockStorageVol:
-    def delete(self):
-        return None
-
-
-class MockDirStoragePool:
-    def __init__(self, name, path):
-        self.name = name
-        self.path = path
-
-    def XMLDesc(self):
-        xml = f"""
-            <pool type='dir'>
-              <name>{self.name}</name>
-              <uuid>ac3311e0-4886-45e4-8134-8428a594547b</uuid>
-              <capacity unit='bytes'>527298895872</capacity>
-              <allocation unit='bytes'>91432857600</allocation>
-              <available unit='bytes'>435866038272</available>
-              <source>
-              </source>
-              <target>
-                <path>{self.path}</path>
-                <permissions>
-                  <mode>0755</mode>
-                  <owner>1000</owner>
-                  <group>1000</group>
-                </permissions>
-              </target>
-            </pool>
-        """
-        return xml
-
-    def createXML(self, xml, weird_number):  # pylint: disable=unused-argument
-        if weird_number != 0:
-            raise ValueError("what the fuck weird number did you pass?")
-
-    def refresh(self):
-        return 0
-
-    def storageVolLookupByName(self, name):  # pylint: disable=unused-argument
-        return MockStorageVol()
-
-
-class MockNetwork:
-    def __init__(self, name, dhcp_start="192.168.254.128", dhcp_end="192.168.254.254"):
-        self.name = name
-        self.dhcp_start = dhcp_start
-        self.dhcp_end = dhcp_end
-
-    def XMLDesc(self):
-        xml = f"""
-            <network>
-              <name>{self.name}</name>
-              <uuid>803cb35a-75e9-451f-97d2-9b758b0102ef</uuid>
-              <forward mode='nat'>
-                <nat>
-                  <port start='1024' end='65535'/>
-                </nat>
-              </forward>
-              <bridge name='virbr1' stp='on' delay='0'/>
-              <mac address='52:54:00:87:8f:71'/>
-              <domain name='cloudvirt-net'/>
-              <ip address='192.168.254.1' netmask='255.255.255.0'>
-                <dhcp>
-                  <range start="{self.dhcp_start}" end="{self.dhcp_end}"/>
-                </dhcp>
-              </ip>
-            </network>
-        """
-
-        return xml
-
-    def DHCPLeases(self, mac=None, flags=0):  # pylint: disable=unused-argument
-        return []
-
-    # fmt: off
-    def update(self, command, section, parentIndex, xml, flags=0): # pylint: disable=unused-argument
-        return None
-    # fmt: on
-
-
-class MockDom:
-    def __init__(self, xml=None):
-        self.xml = xml
-
-    def create(self):
-        pass
-
-    def XMLDesc(self):
-        if self.xml:
-            return self.xml
-
-        domxml_path = get_testfile("realdom.xml")
-
-        domxml = None
-        with open(domxml_path, "r", encoding="utf-8") as f:
-            domxml = f.read()
-
-        return domxml
-
-    def isActive(self):
-        # lol this is probably a stupid idea i will forget about
-        return 1
-
-    def interfaceAddresses(self, src):
-        if src == libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_LEASE:
-            return {}
-
-        if src == libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_ARP:
-            return {
-                "vnet0": {
-                    "addrs": [{"addr": "192.168.254.131", "prefix": 0, "type": 0}],
-                    "hwaddr": "52:54:60:38:67:43",
-                }
-            }
-
-    def destroy(self):
-        return 0
-
-    def undefine(self):
-        return 0
-
-
-class MockDriver:
-    def __init__(self, pool_path):
-        self.pool_path = pool_path
-
-        self._known_doms = {"test_nuke_dom": MockDom()}
-
-    def networkLookupByName(self, name):
-        return MockNetwork(name)
-
-    def storagePoolLookupByName(self, name):  # pylint: disable=unused-argument
-        return MockDirStoragePool("test_pool", self.pool_path)
-
-    def defineXML(self, xml):
-        dom_xml = ET.ElementTree(ET.fromstring(xml))
-        dom_root = dom_xml.getroot()
-        name = dom_root.findall("name")[0].text
-        self._known_doms[name] = MockDom(xml)
-
-    def lookupByName(self, name):
-        if name == "existing_dom":
-            raise libvirt.libvirtError("already exists!")
-
-        if name in self._known_doms:
-            return self._known_doms[name]
-
-        raise libvirt.libvirtError("Nothing found baybe!!")
+from tests.mocks import (
+    MockDirStoragePool,
+    MockDom,
+    MockDriver,
+    MockNetwork,
+    MockStorageVol,
+    get_driver,
+    get_vmspec,
+)
 
 
 class NukeVM(unittest.TestCase):
     def test_nukevm(self):
-        driver = MockDriver(None)
+        driver = get_driver(None)
 
         vmspec = VMSpec()
         vmspec.dom_name = "test_nuke_dom"
@@ -191,8 +61,51 @@ class NukeVM(unittest.TestCase):
         c = APIDriverVMNuker(driver, vmspec.dom_name)
         c.nuke()
 
+    def test_nuke_many(self):
+        driver = get_driver(None)
+
+        results = driver.nuke_many(["test_nuke_dom", "nonexistant_dom"], jobs=2)
+
+        self.assertIsNone(results["test_nuke_dom"])
+        self.assertIsNotNone(results["nonexistant_dom"])
+
+    def test_nuke_many_file_disk(self):
+        driver = get_driver(None)
+
+        # a disk cloudvirt did not create, without a pool to look it up in
+        dom_root = ET.fromstring(MockDom().XMLDesc())
+        dom_root.find("name").text = "file_dom"
+        source = dom_root.find("devices/disk/source")
+        source.attrib.clear()
+        source.set("file", "/var/lib/libvirt/images/file_dom.qcow2")
+
+        driver.conn._known_doms["file_dom"] = MockDom(
+            ET.tostring(dom_root, encoding="unicode"), driver.conn
+        )
+
+        results = driver.nuke_many(["file_dom", "test_nuke_dom"], jobs=2)
+
+        # refused before the domain or its network entries are touched
+        self.assertIn("file_dom.qcow2 is not a volume of a pool", results["file_dom"])
+        self.assertIn("file_dom", driver.conn._known_doms)
+        updates = driver.cache.network("test_net").network.updates
+        self.assertFalse([x for x in updates if "file_dom" in x[2]])
+        self.assertIsNone(results["test_nuke_dom"])
+
+    def test_nuke_many_unexpected_error(self):
+        driver = get_driver(None)
+
+        # a bug is reported as the result of its vm, with the traceback logged
+        with unittest.mock.patch.object(
+            APIDriverVMNuker, "_nuke_volumes", side_effect=KeyError("pool")
+        ), self.assertLogs("APIDriver", "ERROR") as logs:
+            results = driver.nuke_many(["test_nuke_dom"], jobs=1)
+
+        self.assertEqual(results, {"test_nuke_dom": "KeyError: 'pool'"})
+        self.assertIn("Traceback", logs.output[0])
+
     def test_nonexistant_dom_name(self):
-        driver = MockDriver(None)
+        driver = get_driver(None)
 
         vmspec = VMSpec()
         vmspec.dom_name = "nonexistant_dom"
@@ -207,9 +120,7 @@ class NukeVM(unittest.TestCase):
 
         c = APIDriverVMNuker(driver, vmspec.dom_name)
 
-        # normally would catch libvirt.libvirtError but our logger exits with 1
-        # when exception/error is called, so catch that.
-        with self.assertRaises(SystemExit):
+        with self.assertRaises(SpecError):
             c.nuke()
 
 
@@ -223,7 +134,7 @@ class CreateVM(unittest.TestCase):
         self.vol_dir.cleanup()
 
     def test_createvm(self):
-        driver = MockDriver(self.vol_dir.name)
+        driver = get_driver(self.vol_dir.name)
 
         vmspec = VMSpec()
         vmspec.dom_name = "test_dom"
@@ -247,8 +158,421 @@ class CreateVM(unittest.TestCase):
         c = APIDriverVMCreator(driver, vmspec)
         c.create()
 
+        # the seed iso was streamed into a new volume, no pool refresh
+        iso_vol = driver.cache.pool("test_pool").pool.created_vols[0]
+        iso_size = ET.fromstring(iso_vol.xml).find("capacity").text
+
+        self.assertTrue(iso_vol.stream.finished)
+        self.assertEqual(len(iso_vol.stream.data), int(iso_size))
+        self.assertEqual(iso_vol.stream.data[32769:32774], b"CD001")
+
+    def test_wait(self):
+        driver = get_driver(self.vol_dir.name)
+
+        vmspec = get_vmspec("test_dom", guest_agent=True)
+
+        timings = driver.create(vmspec, wait=5)
+
+        self.assertEqual(list(timings), ["started", "lease", "agent"])
+        self.assertEqual(timings, dict(sorted(timings.items(), key=lambda x: x[1])))
+
+        # callbacks stay registered for the next creator, the waiter is gone
+        self.assertEqual(len(driver.conn.dom_event_cbs), 2)
+        driver.readiness.deregister_events()
+        self.assertEqual(driver.conn.dom_event_cbs, {})
+
+    def test_warm_pool(self):
+        driver = get_driver(self.vol_dir.name)
+
+        vmspec = get_vmspec(
+            "test_dom", ip="192.168.254.129", labels={"role": "ci"}, numa_node="auto"
+        )
+
+        driver.warm_pool = WarmPool(driver, {profile_of(vmspec): 2})
+        driver.warm_pool.refill()
+
+        warm_names = driver.select_domains(["cloudvirt-warm-*"])
+        self.assertEqual(len(warm_names), 2)
+
+        # stopped warm vms do not hold on to their placement
+        self.assertEqual(driver.placement._pending, {})
+
+        driver.create(vmspec)
+
+        # one of the warm vms became test_dom, seed and labels included
+        self.assertEqual(len(driver.select_domains(["cloudvirt-warm-*"])), 1)
+        self.assertEqual(driver.select_domains(["test_dom"]), ["test_dom"])
+
+        dom_root = ET.fromstring(driver.lookupByName("test_dom").XMLDesc())
+        self.assertIn(
+            dom_root.find("devices/disk[@device='disk']/source").attrib["volume"],
+            [f"{x}-vol.qcow2" for x in warm_names],
+        )
+        self.assertEqual(
+            dom_root.find("devices/disk[@device='cdrom']/source").attrib["volume"],
+            "test_dom-cloudinit.iso",
+        )
+        self.assertEqual(driver.select_domains([], labels={"role": "ci"}), ["test_dom"])
+
+        # no warm vm of a different profile
+        vmspec.dom_name = "test_dom_1"
+        vmspec.dom_mem = 4
+        self.assertIsNone(driver.warm_pool.take(vmspec))
+
+        driver.warm_pool.refill()
+        self.assertEqual(len(driver.select_domains(["cloudvirt-warm-*"])), 2)
+
+    def test_warm_pool_journal(self):
+        driver = get_driver(self.vol_dir.name)
+        driver.journal = CreateJournal(driver.url, os.path.join(self.vol_dir.name, "j"))
+
+        vmspec = get_vmspec("test_dom", ip="192.168.254.129")
+
+        driver.warm_pool = WarmPool(driver, {profile_of(vmspec): 1})
+        driver.warm_pool.refill()
+        warm_name = driver.select_domains(["cloudvirt-warm-*"])[0]
+
+        # the seed cannot be inserted into the renamed warm vm
+        with unittest.mock.patch.object(
+            MockDom, "updateDeviceFlags", side_effect=libvirt.libvirtError("busy")
+        ):
+            results = driver.create_many([vmspec])
+
+        self.assertEqual(results, {"test_dom": "busy"})
+
+        entry = driver.journal.load("test_dom")
+        self.assertEqual(entry["phases"], ["claim", "iso"])
+        self.assertEqual(entry["vol_name"], f"{warm_name}-vol.qcow2")
+
+        with unittest.mock.patch.object(MockStorageVol, "delete") as vol_delete:
+            self.assertEqual(driver.rollback_many(None), {"test_dom": None})
+
+        self.assertNotIn("test_dom", driver.conn._known_doms)
+        self.assertEqual(vol_delete.call_count, 2)
+        self.assertEqual(driver.journal.dom_names(), [])
+
+    def test_warm_pool_race(self):
+        driver = get_driver(self.vol_dir.name)
+        driver.journal = CreateJournal(driver.url, os.path.join(self.vol_dir.name, "j"))
+
+        vmspec = get_vmspec("test_nuke_dom", ip="auto")
+        driver.warm_pool = WarmPool(driver, {profile_of(vmspec): 2})
+        driver.warm_pool.refill()
+
+        # a name collision leaves nothing behind to roll back
+        with self.assertRaises(ConflictError):
+            driver.create(vmspec)
+
+        self.assertEqual(driver.journal.dom_names(), [])
+
+        # another process renames the first warm vm taken away
+        rename = MockDom.rename
+        renames = []
+
+        def racing_rename(dom, new_name, flags):
+            renames.append(dom.name())
+            if len(renames) == 1:
+                raise libvirt.libvirtError("domain not found")
+
+            rename(dom, new_name, flags)
+
+        vmspec = get_vmspec("test_dom_0", ip="auto")
+        with unittest.mock.patch.object(MockDom, "rename", racing_rename):
+            driver.create(vmspec)
+
+        self.assertEqual(len(set(renames)), 2)
+        self.assertIn(renames[1], driver.lookupByName("test_dom_0").XMLDesc())
+
+        # every warm vm gone, created from scratch with the address it got
+        vmspec = get_vmspec("test_dom_1", ip="auto")
+        with unittest.mock.patch.object(
+            MockDom, "rename", side_effect=libvirt.libvirtError("domain not found")
+        ):
+            driver.create(vmspec)
+
+        dom_xml = driver.lookupByName("test_dom_1").XMLDesc()
+        self.assertIn("test_dom_1-vol.qcow2", dom_xml)
+
+        allocator = driver.cache.network("test_net").ip_allocator
+        self.assertFalse(allocator.claim(vmspec.ip))
+
+    def test_cpu_mode(self):
+        driver = get_driver(self.vol_dir.name)
+
+        def create(dom_name, cpu_mode):
+            vmspec = get_vmspec(dom_name, cpu_mode=cpu_mode)
+
+            driver.create(vmspec)
+
+            return ET.fromstring(driver.lookupByName(dom_name).XMLDesc()).find("cpu")
+
+        self.assertEqual(
+            create("passthrough", "host-passthrough").attrib,
+            {"mode": "host-passthrough"},
+        )
+        self.assertEqual(create("named", "EPYC-v4").find("model").text, "EPYC-v4")
+        self.assertEqual(create("legacy", None).find("model").text, "qemu64")
+
+        with unittest.mock.patch.dict(
+            os.environ, {"XDG_CACHE_HOME": self.vol_dir.name}
+        ):
+            for i in range(3):
+                cpu = create(f"baseline_{i}", "baseline")
+                self.assertEqual(cpu.find("model").text, "Skylake-Server-IBRS")
+
+            # computed once, then picked up from disk by a new driver as well
+            self.assertEqual(driver.conn.baselines, 1)
+
+            driver.cpu_baseline = CPUBaseline(driver)
+            create("baseline_new", "baseline")
+            self.assertEqual(driver.conn.baselines, 1)
+
+            # a qemu upgrade may change what the models mean
+            driver.conn.version = 9000000
+            driver.cpu_baseline = CPUBaseline(driver)
+            create("baseline_upgraded", "baseline")
+            self.assertEqual(driver.conn.baselines, 2)
+
+    def test_placement(self):
+        driver = get_driver(self.vol_dir.name)
+
+        def create(dom_name, dom_mem=4096, **kwargs):
+            vmspec = get_vmspec(dom_name, dom_mem=dom_mem, **kwargs)
+
+            creator = APIDriverVMCreator(driver, vmspec)
+            creator.prepare()
+
+            return ET.fromstring(driver.lookupByName(dom_name).XMLDesc())
+
+        def pins(dom_root):
+            return [x.attrib["cpuset"] for x in dom_root.findall("cputune/vcpupin")]
+
+        dom_root = create("pinned", cpuset="8-11", emulator_cpuset="12", hugepages="1G")
+        self.assertEqual(pins(dom_root), ["8", "9"])
+        self.assertEqual(dom_root.find("cputune/emulatorpin").attrib["cpuset"], "12")
+        self.assertEqual(
+            dom_root.find("memoryBacking/hugepages/page").attrib["size"], "1048576"
+        )
+
+        # most free memory first, then the node the first one did not take
+        dom_root = create("auto_0", numa_node="auto")
+        self.assertEqual(dom_root.find("numatune/memory").attrib["nodeset"], "1")
+        self.assertEqual(pins(dom_root), ["4", "5"])
+
+        dom_root = create("auto_1", numa_node="auto")
+        self.assertEqual(dom_root.find("numatune/memory").attrib["nodeset"], "0")
+        self.assertEqual(pins(dom_root), ["0", "1"])
+
+        # released once started, the pins stay visible in the domain xml
+        driver.placement.release("auto_0")
+        driver.placement.release("auto_1")
+        dom_root = create("fixed", numa_node=1, dom_mem=1024)
+        self.assertEqual(pins(dom_root), ["6", "7"])
+
+    def test_disk_profile(self):
+        driver = get_driver(self.vol_dir.name)
+
+        def create(dom_name, disk_profile, **kwargs):
+            vmspec = get_vmspec(
+                dom_name, dom_vcpu=4, disk_profile=disk_profile, **kwargs
+            )
+
+            driver.create(vmspec)
+
+            return ET.fromstring(driver.lookupByName(dom_name).XMLDesc())
+
+        dom_root = create("default", None, emulator_cpuset="6-7")
+        disk_driver = dom_root.find("devices/disk[@device='disk']/driver")
+        self.assertEqual(dom_root.find("iothreads").text, "1")
+        self.assertEqual(disk_driver.attrib["cache"], "none")
+        self.assertEqual(disk_driver.attrib["io"], "native")
+        self.assertEqual(disk_driver.attrib["discard"], "unmap")
+        self.assertEqual(disk_driver.attrib["iothread"], "1")
+        self.assertEqual(disk_driver.attrib["queues"], "4")
+        self.assertEqual(
+            dom_root.find("cputune/iothreadpin").attrib,
+            {"iothread": "1", "cpuset": "6,7"},
+        )
+
+        dom_root = create("spread", resolve_disk_profile({"iothreads": 2}))
+        queues = [
+            [x.attrib["id"] for x in iothread.findall("queue")]
+            for iothread in dom_root.findall(
+                "devices/disk[@device='disk']/driver/iothreads/iothread"
+            )
+        ]
+        self.assertEqual(queues, [["0", "2"], ["1", "3"]])
+
+        dom_root = create(
+            "no_iothreads", resolve_disk_profile({"iothreads": 0, "queues": 1})
+        )
+        self.assertIsNone(dom_root.find("iothreads"))
+        self.assertEqual(
+            dom_root.find("devices/disk[@device='disk']/driver").attrib["queues"], "1"
+        )
+
+        for overrides in [
+            {"io": "native", "cache": "writeback"},
+            {"detect_zeroes": "unmap", "discard": "ignore"},
+            {"queues": 0},
+            {"bogus": 1},
+        ]:
+            with self.assertRaises(ValueError):
+                resolve_disk_profile(overrides)
+
+    def test_net_profile(self):
+        driver = get_driver(self.vol_dir.name)
+
+        vmspec = get_vmspec(
+            "net_profile",
+            dom_vcpu=4,
+            net_profile=resolve_net_profile({"offloads": {"gso": False}}),
+        )
+
+        driver.create(vmspec)
+
+        iface_driver = ET.fromstring(driver.lookupByName("net_profile").XMLDesc()).find(
+            "devices/interface/driver"
+        )
+        self.assertEqual(
+            iface_driver.attrib,
+            {"name": "vhost", "queues": "4", "rx_queue_size": "1024"},
+        )
+        self.assertEqual(iface_driver.find("host").attrib, {"gso": "off"})
+
+        for overrides in [
+            {"backend": "vhost-user"},
+            {"rx_queue_size": 300},
+            {"tx_queue_size": 256},
+            {"offloads": {"lro": False}},
+        ]:
+            with self.assertRaises(ValueError):
+                resolve_net_profile(overrides)
+
+    def test_volume_options(self):
+        driver = get_driver(self.vol_dir.name)
+
+        pool = driver.cache.pool("test_pool").pool
+        pool.base_format = "raw"
+
+        base_path = os.path.join(self.vol_dir.name, "raw.img")
+        with open(base_path, "wb"):
+            pass
+
+        def create(dom_name, **kwargs):
+            vmspec = get_vmspec(dom_name, base_image="raw.img", **kwargs)
+
+            APIDriverVMCreator(driver, vmspec).prepare()
+
+            # the overlay is created right after the seed iso
+            return ET.fromstring(pool.created_vols[-1].xml)
+
+        volxml_root = create(
+            "prealloc",
+            vol_prealloc="falloc",
+            vol_cluster_size=128,
+            vol_extended_l2=True,
+        )
+        self.assertEqual(volxml_root.find("backingStore/format").attrib["type"], "raw")
+        self.assertEqual(volxml_root.find("allocation").text, "25")
+        self.assertEqual(volxml_root.find("target/clusterSize").text, "128")
+        self.assertIsNotNone(volxml_root.find("target/features/extended_l2"))
+
+        # probed once until the image changes on disk
+        volxml_root = create("plain")
+        self.assertIsNone(volxml_root.find("allocation"))
+        self.assertIsNone(volxml_root.find("target/clusterSize"))
+        self.assertEqual(pool.base_lookups, 1)
+
+        os.utime(base_path, ns=(0, 0))
+        pool.base_capacity = 30 * 1024**3
+
+        with self.assertRaises(SpecError):
+            create("too_small")
+
+        self.assertEqual(pool.base_lookups, 2)
+        # checked before the seed iso got uploaded
+        self.assertEqual(len(pool.created_vols), 4)
+
+        # the local file says nothing about the image on a remote host, the
+        # probe is kept until the pool is dropped
+        driver = get_driver(self.vol_dir.name, "qemu+ssh://remote/system")
+        pool = driver.cache.pool("test_pool").pool
+        pool.base_format = "raw"
+
+        create("remote")
+        os.utime(base_path, ns=(1, 1))
+        create("remote_again")
+        self.assertEqual(pool.base_lookups, 1)
+
+        driver.cache.invalidate_pool("test_pool")
+        pool = driver.cache.pool("test_pool").pool
+
+        create("remote_refreshed")
+        self.assertEqual(pool.base_lookups, 1)
+
+    def test_density(self):
+        driver = get_driver(self.vol_dir.name)
+
+        def create(dom_name, dom_mem=4096, **kwargs):
+            vmspec = get_vmspec(dom_name, dom_mem=dom_mem, **kwargs)
+
+            driver.create(vmspec)
+
+            return ET.fromstring(driver.lookupByName(dom_name).XMLDesc())
+
+        dom_root = create(
+            "dense",
+            dom_mem_current=2048,
+            density_profile=resolve_density_profile({"ksm": False}),
+        )
+        tags = [x.tag for x in dom_root]
+        self.assertEqual(tags[tags.index("memory") + 1], "currentMemory")
+        self.assertEqual(dom_root.find("currentMemory").text, "2048")
+        self.assertIsNotNone(dom_root.find("memoryBacking/nosharepages"))
+        self.assertEqual(
+            dom_root.find("devices/memballoon").attrib,
+            {"model": "virtio", "autodeflate": "on", "freePageReporting": "on"},
+        )
+        self.assertEqual(
+            dom_root.find("devices/memballoon/stats").attrib["period"], "10"
+        )
+
+        dom_root = create(
+            "no_balloon",
+            density_profile=resolve_density_profile(
+                {"balloon": False, "free_page_reporting": False}
+            ),
+        )
+        self.assertEqual(dom_root.find("devices/memballoon").attrib, {"model": "none"})
+
+        with self.assertRaises(ValueError):
+            resolve_density_profile({"balloon": False})
+
+        # 1G used out of 4G, 600M used out of 700M, no stats at all
+        driver.lookupByName("dense").balloon_stats = {
+            "balloon.current": 4194304,
+            "balloon.available": 4194304,
+            "balloon.usable": 3145728,
+            "balloon.last-update": 1700000000,
+        }
+        driver.lookupByName("no_balloon").balloon_stats = {
+            "balloon.current": 716800,
+            "balloon.available": 716800,
+            "balloon.usable": 102400,
+            "balloon.last-update": 1700000000,
+        }
+
+        reclaimer = Reclaimer(driver)
+        targets = reclaimer.plan()
+        self.assertEqual(targets, {"dense": (4194304, 1310720)})
+        self.assertEqual(reclaimer.plan(["no_balloon"]), {})
+
+        self.assertEqual(reclaimer.apply(targets), {"dense": None})
+        self.assertEqual(driver.lookupByName("dense").memory, 1310720)
+
     def test_existing_dom_name(self):
-        driver = MockDriver(self.vol_dir.name)
+        driver = get_driver(self.vol_dir.name)
 
         vmspec = VMSpec()
         vmspec.dom_name = "existing_dom"
@@ -273,3 +597,385 @@ class CreateVM(unittest.TestCase):
 
         with self.assertRaises(libvirt.libvirtError):
             c.create()
+
+    def test_create_many(self):
+        driver = get_driver(self.vol_dir.name)
+
+        vmspecs = []
+        for dom_name in ["test_dom_0", "test_dom_1", "existing_dom"]:
+            vmspec = get_vmspec(dom_name, password=True)
+            vmspecs.append(vmspec)
+
+        results = driver.create_many(vmspecs, jobs=2)
+
+        self.assertEqual(list(results), ["test_dom_0", "test_dom_1", "existing_dom"])
+        self.assertIsNone(results["test_dom_0"])
+        self.assertIsNone(results["test_dom_1"])
+        self.assertIsNotNone(results["existing_dom"])
+
+    def test_schedule(self):
+        small = get_driver(self.vol_dir.name)
+        small.url = "qemu+ssh://small/system"
+        small.conn.host_cpus = 4
+        small.conn.host_memory = 8192
+
+        large = get_driver(self.vol_dir.name)
+        large.url = "qemu+ssh://large/system"
+
+        vmspecs = []
+        for dom_name, dom_vcpu, dom_mem in [
+            ("test_dom_med_0", 2, 4096),
+            ("test_dom_big", 8, 8192),
+            ("test_dom_med_1", 2, 4096),
+            ("test_dom_med_2", 2, 4096),
+        ]:
+            vmspec = get_vmspec(
+                dom_name, password=True, dom_mem=dom_mem, dom_vcpu=dom_vcpu
+            )
+            vmspecs.append(vmspec)
+
+        # the big one goes first and only fits the large host, which it then
+        # fills up on vcpus
+        results = Scheduler([small, large], {"cpu": 1.0}).create_many(vmspecs)
+
+        self.assertEqual(list(results), [x.dom_name for x in vmspecs])
+        self.assertIsNone(results["test_dom_big"])
+        self.assertIsNone(results["test_dom_med_0"])
+        self.assertIsNone(results["test_dom_med_1"])
+        self.assertIn("no host has room for it", results["test_dom_med_2"])
+        self.assertIn("qemu+ssh://small/system: cpu", results["test_dom_med_2"])
+
+        self.assertIn("test_dom_big", large.conn._known_doms)
+        self.assertIn("test_dom_med_0", small.conn._known_doms)
+        self.assertIn("test_dom_med_1", small.conn._known_doms)
+
+        # mirrored on the snapshots, not refetched
+        self.assertEqual(small.cache.host().committed_vcpus, 4)
+        self.assertEqual(small.cache.host().committed_memory, 8192 * 1024)
+        self.assertEqual(small.cache.pool("test_pool").reserved, 50 * 1024**3)
+        self.assertEqual(large.cache.host().committed_vcpus, 8)
+
+        # a lone host is admitted against all the same
+        vmspec = get_vmspec("test_dom_lone", dom_mem=4096)
+        results = Scheduler([small]).create_many([vmspec])
+
+        self.assertIn("qemu+ssh://small/system: mem", results["test_dom_lone"])
+        self.assertNotIn("test_dom_lone", small.conn._known_doms)
+
+    def test_trace(self):
+        driver = get_driver(self.vol_dir.name)
+
+        # built once, and follows the connection it is called on
+        self.assertIs(driver.lookupByName, driver.lookupByName)
+        driver.tracer = Tracer()
+
+        vmspecs = []
+        for dom_name in ["test_dom_0", "test_dom_1"]:
+            vmspec = get_vmspec(dom_name, password=True)
+            vmspecs.append(vmspec)
+
+        results = driver.create_many(vmspecs, jobs=2)
+        self.assertEqual(results, {"test_dom_0": None, "test_dom_1": None})
+
+        trace_path = os.path.join(self.vol_dir.name, "trace.json")
+        driver.tracer.export(trace_path)
+        with open(trace_path, "r", encoding="utf-8") as trace_file:
+            events = json.load(trace_file)["traceEvents"]
+
+        phases = [
+            (x["name"], x["args"]["dom"])
+            for x in events
+            if x.get("cat") == "phase" and "dom" in x.get("args", {})
+        ]
+        for dom_name in ["test_dom_0", "test_dom_1"]:
+            for phase in ["precheck", "iso", "volume", "define", "start"]:
+                self.assertIn((phase, dom_name), phases)
+
+        self.assertTrue(any(x["name"] == "thread_name" for x in events))
+
+        stats = driver.tracer.stats()
+        self.assertIn("defineXML", stats)
+        self.assertEqual(stats["defineXML"][0], 2)
+        self.assertLessEqual(stats["defineXML"][1], stats["defineXML"][4])
+
+    def test_select_domains(self):
+        driver = get_driver(self.vol_dir.name)
+
+        for dom_name, role in [("ci-0", "ci"), ("ci-1", "ci"), ("db-0", "db")]:
+            vmspec = get_vmspec(dom_name, labels={"role": role})
+
+            c = APIDriverVMCreator(driver, vmspec)
+            c.create()
+
+        self.assertEqual(driver.select_domains(["ci-*"]), ["ci-0", "ci-1"])
+        self.assertEqual(driver.select_domains([r".*-0"], regex=True), ["ci-0", "db-0"])
+        self.assertEqual(driver.select_domains([], labels={"role": "db"}), ["db-0"])
+        self.assertEqual(
+            driver.select_domains(["*-0"], labels={"role": "ci"}), ["ci-0"]
+        )
+
+    def test_auto_ip(self):
+        driver = get_driver(self.vol_dir.name)
+
+        vmspecs = []
+        for dom_name in ["test_dom_0", "test_dom_1"]:
+            vmspec = get_vmspec(dom_name, ip="auto")
+            vmspecs.append(vmspec)
+
+        results = driver.create_many(vmspecs, jobs=2)
+
+        self.assertEqual(results, {"test_dom_0": None, "test_dom_1": None})
+        self.assertEqual(
+            sorted(vmspec.ip for vmspec in vmspecs),
+            ["192.168.254.128", "192.168.254.129"],
+        )
+
+        # both creators were served by a single fetch of the network
+        self.assertEqual(driver.conn.net_lookups, 1)
+
+        net_root = driver.cache.network("test_net").xml_root
+        self.assertEqual(
+            sorted(x.attrib["name"] for x in net_root.findall("ip/dhcp/host")),
+            ["test_dom_0", "test_dom_1"],
+        )
+
+        driver.cache.invalidate_network("test_net")
+        driver.cache.network("test_net")
+        self.assertEqual(driver.conn.net_lookups, 2)
+
+        # the address of a create that failed is handed out again
+        vmspec = vmspecs[0]
+        vmspec.dom_name = "test_dom_2"
+        vmspec.ip = "auto"
+        with unittest.mock.patch.object(
+            MockDirStoragePool, "createXML", side_effect=libvirt.libvirtError("full")
+        ):
+            results = driver.create_many([vmspec])
+
+        self.assertEqual(results, {"test_dom_2": "full"})
+
+        allocator = driver.cache.network("test_net").ip_allocator
+        self.assertTrue(allocator.claim(vmspec.ip))
+
+    def test_journal(self):
+        driver = get_driver(self.vol_dir.name)
+        driver.journal = CreateJournal(driver.url, os.path.join(self.vol_dir.name, "j"))
+
+        def vmspecs():
+            vmspec = get_vmspec("test_dom", ip="auto", numa_node="auto")
+
+            return [vmspec]
+
+        # fails on the very last phase, everything before it is journaled
+        failing = vmspecs()
+        with unittest.mock.patch.object(
+            MockDom, "create", side_effect=libvirt.libvirtError("no kvm")
+        ):
+            results = driver.create_many(failing)
+
+        self.assertEqual(results, {"test_dom": "no kvm"})
+
+        entry = driver.journal.load("test_dom")
+        self.assertEqual(entry["phases"], ["iso", "volume", "define", "net"])
+        self.assertEqual(entry["ip"], failing[0].ip)
+        self.assertEqual(driver.journal.dom_names(), ["test_dom"])
+
+        # the vmspec the failed create filled in still matches its entry, a
+        # different static address does not
+        self.assertNotEqual(failing[0].ip, "auto")
+        self.assertIsNotNone(failing[0].gateway)
+        self.assertEqual(driver.journal.resume(driver, failing[0], None), entry)
+
+        changed = vmspecs()
+        changed[0].ip = "192.168.254.200"
+        with unittest.mock.patch(
+            "cloudvirt.journal.APIDriverVMRollback.rollback"
+        ) as rollback:
+            entry = driver.journal.resume(driver, changed[0], None)
+        self.assertEqual(entry["phases"], [])
+        rollback.assert_called_once()
+
+        # the retry only starts it, with the address and mac it got first
+        driver.tracer = Tracer()
+        retried = vmspecs()
+        self.assertEqual(driver.create_many(retried), {"test_dom": None})
+
+        self.assertEqual(retried[0].ip, failing[0].ip)
+        self.assertEqual(retried[0].mac_addr, failing[0].mac_addr)
+        self.assertEqual(
+            [x["name"] for x in driver.tracer.events if x["cat"] == "phase"],
+            ["precheck", "net_flush", "start"],
+        )
+        self.assertIsNone(driver.journal.load("test_dom"))
+
+        # rolled back right away instead
+        driver.conn._known_doms.pop("test_dom")
+        driver.cache.invalidate_network("test_net")
+        with unittest.mock.patch.object(
+            MockDom, "create", side_effect=libvirt.libvirtError("no kvm")
+        ), unittest.mock.patch.object(MockStorageVol, "delete") as vol_delete:
+            results = driver.create_many(vmspecs(), rollback=True)
+
+        self.assertEqual(results, {"test_dom": "no kvm"})
+        self.assertNotIn("test_dom", driver.conn._known_doms)
+        self.assertEqual(vol_delete.call_count, 2)
+        self.assertIsNone(driver.journal.load("test_dom"))
+
+    def test_ip_outside_dhcp_range(self):
+        driver = get_driver(self.vol_dir.name)
+
+        vmspec = get_vmspec("test_dom", ip="192.168.254.100")
+
+        c = APIDriverVMCreator(driver, vmspec)
+
+        with self.assertRaises(SpecError):
+            c._network_precheck()  # pylint: disable=protected-access
+
+    def test_no_dhcp_range(self):
+        driver = get_driver(self.vol_dir.name)
+
+        net_root = ET.fromstring(MockNetwork("test_net").XMLDesc())
+        net_root.find("ip").remove(net_root.find("ip/dhcp"))
+        net_xml = ET.tostring(net_root, encoding="unicode")
+
+        vmspec = get_vmspec("test_dom", ip="auto")
+
+        c = APIDriverVMCreator(driver, vmspec)
+
+        with unittest.mock.patch.object(MockNetwork, "XMLDesc", return_value=net_xml):
+            with self.assertRaises(SpecError):
+                c._network_precheck()  # pylint: disable=protected-access
+
+
+class NetworkBatch(unittest.TestCase):
+    def test_live_coalescing(self):
+        driver = get_driver(None)
+
+        batch = NetworkUpdateBatch(driver)
+        batch.add_host("test_net", "dom_0", "52:54:00:00:00:01", "192.168.254.130")
+        batch.add_host("test_net", "dom_1", "52:54:00:00:00:02", "192.168.254.131")
+        batch.remove_host("test_net", "dom_1")
+
+        results = batch.flush()
+        network = driver.cache.network("test_net").network
+
+        self.assertEqual(results, {"dom_0": None})
+        self.assertEqual(len(network.updates), 2)
+
+        # already in place, nothing to do
+        batch.add_host("test_net", "dom_0", "52:54:00:00:00:01", "192.168.254.130")
+        batch.flush()
+        self.assertEqual(len(network.updates), 2)
+
+        batch.remove_host("test_net", "dom_0")
+        batch.flush()
+        self.assertEqual(len(network.updates), 4)
+
+    def test_redefine(self):
+        driver = get_driver(None)
+
+        batch = NetworkUpdateBatch(driver, mode="redefine")
+        for i in range(10):
+            batch.add_host(
+                "test_net", f"dom_{i}", f"52:54:00:00:00:1{i}", f"192.168.254.14{i}"
+            )
+
+        results = batch.flush()
+        network = driver.cache.network("test_net").network
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual(network.updates, [])
+
+        net_root = ET.fromstring(driver.conn.defined_net_xml)
+        self.assertEqual(len(net_root.findall("ip/dhcp/host")), 10)
+        self.assertEqual(len(net_root.findall("dns/host")), 10)
+
+    def test_inactive_network(self):
+        driver = get_driver(None)
+
+        # nothing is serving the hosts yet, one redefinition instead
+        batch = NetworkUpdateBatch(driver)
+        batch.add_host("test_net", "dom_0", "52:54:00:00:00:01", "192.168.254.130")
+        batch.add_host("test_net", "dom_1", "52:54:00:00:00:02", "192.168.254.131")
+
+        with unittest.mock.patch.object(MockNetwork, "isActive", return_value=0):
+            results = batch.flush()
+
+        self.assertEqual(results, {"dom_0": None, "dom_1": None})
+        self.assertEqual(driver.cache.network("test_net").network.updates, [])
+
+        net_root = ET.fromstring(driver.conn.defined_net_xml)
+        self.assertEqual(len(net_root.findall("ip/dhcp/host")), 2)
+
+    def test_redefine_without_dhcp(self):
+        driver = get_driver(None)
+
+        net_root = ET.fromstring(MockNetwork("test_net").XMLDesc())
+        net_root.find("ip").remove(net_root.find("ip/dhcp"))
+        net_xml = ET.tostring(net_root, encoding="unicode")
+
+        batch = NetworkUpdateBatch(driver, mode="redefine")
+        batch.add_host("test_net", "dom_0", "52:54:00:00:00:01", "192.168.254.130")
+
+        with unittest.mock.patch.object(MockNetwork, "XMLDesc", return_value=net_xml):
+            results = batch.flush()
+
+        self.assertIn("no DHCP section", results["dom_0"])
+        self.assertFalse(hasattr(driver.conn, "defined_net_xml"))
+
+
+class AsyncDriver(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.vol_dir = (
+            tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        )
+
+    def tearDown(self):
+        self.vol_dir.cleanup()
+
+    async def test_create_nuke(self):
+        adriver = AsyncAPIDriver(workers=8)
+        adriver.driver.conn = MockDriver(self.vol_dir.name)
+
+        vmspecs = []
+        for i in range(32):
+            vmspec = get_vmspec(f"test_dom_{i}", ip="auto")
+            vmspecs.append(vmspec)
+
+        await asyncio.gather(*[adriver.create(vmspec) for vmspec in vmspecs])
+
+        # every vm got its own address out of the shared allocator
+        self.assertEqual(len({vmspec.ip for vmspec in vmspecs}), 32)
+        self.assertEqual(len(await adriver.list_domains()), 33)
+
+        await adriver.nuke("test_nuke_dom")
+
+        # errors reach the awaiting coroutine instead of exiting the loop
+        with self.assertRaises(SpecError):
+            await adriver.nuke("nonexistent_dom")
+
+    async def test_domain_events(self):
+        adriver = AsyncAPIDriver()
+        adriver.driver.conn = MockDriver(None)
+        dom = adriver.driver.conn.lookupByName("test_nuke_dom")
+
+        async with adriver.domain_events() as events:
+            _, cb, opaque = adriver.driver.conn.dom_event_cbs[0]
+
+            # as delivered by the default implementation's thread
+            thread = threading.Thread(target=cb, args=(None, dom, 1, 2, opaque))
+            thread.start()
+            thread.join()
+
+            event = await asyncio.wait_for(events.__anext__(), 1)
+
+        self.assertEqual(event, {"dom_name": "test_nuke_dom", "event": 1, "detail": 2})
+        self.assertEqual(adriver.driver.conn.dom_event_cbs, {})
+
+        # closing the stream ends an iteration waiting on it
+        async with adriver.domain_events() as events:
+            pending = asyncio.ensure_future(events.__anext__())
+            await asyncio.sleep(0)
+
+        with self.assertRaises(StopAsyncIteration):
+            await asyncio.wait_for(pending, 1)